@@ -5,7 +5,9 @@
 
 Usage:
   awsaccounts report [-d] [--boto-log]
+                     [--metrics-file FILE [--metrics-format FORMAT]]
   awsaccounts create (--spec-file FILE) [--exec] [-vd] [--boto-log]
+                     [--metrics-file FILE [--metrics-format FORMAT]]
   awsaccounts (-h | --help)
   awsaccounts --version
 
@@ -21,12 +23,17 @@ Options:
   -v, --verbose              Log to activity to STDOUT at log level INFO.
   -d, --debug                Increase log level to 'DEBUG'. Implies '--verbose'.
   --boto-log                 Include botocore and boto3 logs in log stream.
+  --metrics-file FILE        Write API call metrics to FILE at exit.
+  --metrics-format FORMAT    Metrics file format: 'json' or 'prom' [default: json].
 
 """
 
 
+import os
 import yaml
+import json
 import time
+import threading
 
 import boto3
 import botocore.exceptions
@@ -40,36 +47,210 @@ import awsorgs.orgs
 from awsorgs.orgs import scan_deployed_accounts
 
 
+# Organizations allows only a few account creations in progress at once.
+MAX_ACCOUNT_CREATIONS = 5
+
+# Seconds between polls of account creation status.  The interval
+# doubles after each poll up to MAX_POLL_INTERVAL.  Stop polling after
+# POLL_TIMEOUT seconds.
+POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 60
+POLL_TIMEOUT = 900
+
+
+class CreationJournal(object):
+    """
+    Append-only journal of account creation requests, one json record
+    per line.  Each record holds the AccountName, CreateAccountRequestId
+    and State of a request.  A record with State 'REQUESTED' is written
+    before create_account is called.  If a run dies mid-request, the next
+    run finds that record, looks the account up in the creation status
+    scan and resumes polling the request if AWS received it.  The last
+    record for an AccountName is its last known state.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.accounts = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # partial record from an interrupted write
+                        continue
+                    self.accounts[record['AccountName']] = record
+
+    def record(self, name, state, create_id=None, reason=None):
+        record = dict(AccountName=name, State=state, Id=create_id,
+                Timestamp=time.time())
+        if reason:
+            record['FailureReason'] = reason
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.accounts[name] = record
+
+    def in_progress(self, name):
+        """
+        Return the CreateAccountRequestId of account 'name' if its last
+        known state is 'IN_PROGRESS', else None.
+        """
+        record = self.accounts.get(name)
+        if record and record['State'] == 'IN_PROGRESS':
+            return record['Id']
+        return None
+
+    def interrupted(self, name):
+        """
+        Test if the last known state of account 'name' is 'REQUESTED',
+        meaning a run died while requesting its creation.
+        """
+        record = self.accounts.get(name)
+        return bool(record) and record['State'] == 'REQUESTED'
+
+
+def get_journal(account_spec):
+    """
+    Return the CreationJournal for the Organization in 'account_spec'.
+    """
+    return CreationJournal(os.path.join(get_cache_dir(),
+            'create-account-journal-%s.jsonl' % account_spec['master_account_id']))
+
+
 def scan_created_accounts(log, org_client):
     """
-    Query AWS Organization for accounts with creation status of 'SUCCEEDED'.
-    Returns a list of dictionary.
+    Query AWS Organization for accounts with creation status of
+    'IN_PROGRESS' or 'SUCCEEDED'.  Returns a ResourceIndex keyed by
+    'AccountName'.
     """
     log.debug('running')
-    status = org_client.list_create_account_status(States=['SUCCEEDED'])
-    created_accounts = status['CreateAccountStatuses']
-    while 'NextToken' in status and status['NextToken']:
-        log.debug("NextToken: %s" % status['NextToken'])
-        status = org_client.list_create_account_status(
-                States=['SUCCEEDED'],
-                NextToken=status['NextToken'])
-        created_accounts += status['CreateAccountStatuses']
-    return created_accounts
+    return ResourceIndex(paginate(org_client, 'list_create_account_status',
+            States=['IN_PROGRESS', 'SUCCEEDED']),
+            name_key='AccountName', id_key='AccountId')
+
+
+def submit_account_creation(org_client, log, journal, name, email_addr):
+    """
+    Request creation of a new account and record it in 'journal'.
+    Return the CreateAccountRequestId or None if the request failed.
+    """
+    journal.record(name, 'REQUESTED')
+    try:
+        new_account = org_client.create_account(
+                AccountName=name, Email=email_addr)
+    except ClientError as e:
+        log.error("Account creation failed for '%s': %s" % (name, e))
+        journal.record(name, 'FAILED', reason=str(e))
+        return None
+    create_id = new_account['CreateAccountStatus']['Id']
+    log.info("CreateAccountStatus Id: %s" % (create_id))
+    journal.record(name, 'IN_PROGRESS', create_id)
+    return create_id
+
+
+def poll_account_creation(org_client, log, journal, new_accounts,
+        in_progress=None):
+    """
+    Submit account creation requests for each (name, email) tuple in
+    'new_accounts', keeping at most MAX_ACCOUNT_CREATIONS in progress.
+    Poll the status of every request in progress with exponential
+    backoff until all have finished or POLL_TIMEOUT is reached.
+    'in_progress' is a dict of CreateAccountRequestId to AccountName of
+    requests resumed from the journal.  Each state change is recorded
+    in 'journal'.
+    """
+    queue = list(new_accounts)
+    in_progress = dict(in_progress or {})
+    interval = POLL_INTERVAL
+    deadline = time.time() + POLL_TIMEOUT
+    while queue or in_progress:
+        while queue and len(in_progress) < MAX_ACCOUNT_CREATIONS:
+            name, email_addr = queue.pop(0)
+            create_id = submit_account_creation(org_client, log, journal,
+                    name, email_addr)
+            if create_id:
+                in_progress[create_id] = name
+                interval = POLL_INTERVAL
+        if not in_progress:
+            continue
+        if time.time() > deadline:
+            for name in sorted(in_progress.values()):
+                log.warn("Account creation still pending for '%s'. Moving on!" % name)
+            for name, email_addr in queue:
+                log.warn("Account creation not submitted for '%s' before "
+                        "timeout. Moving on!" % name)
+            break
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        for create_id, name in sorted(in_progress.items()):
+            try:
+                creation = org_client.describe_create_account_status(
+                        CreateAccountRequestId=create_id)['CreateAccountStatus']
+            except ClientError as e:
+                log.error("Can not get account creation status for '%s': %s" %
+                        (name, e))
+                journal.record(name, 'UNKNOWN', create_id)
+                del in_progress[create_id]
+                continue
+            if creation['State'] == 'IN_PROGRESS':
+                log.info("Account creation in progress for '%s'" % name)
+            elif creation['State'] == 'SUCCEEDED':
+                log.info("Account creation succeeded for '%s'" % name)
+                journal.record(name, 'SUCCEEDED', create_id)
+                del in_progress[create_id]
+            elif creation['State'] == 'FAILED':
+                log.error("Account creation failed for '%s': %s" %
+                        (name, creation['FailureReason']))
+                journal.record(name, 'FAILED', create_id,
+                        creation['FailureReason'])
+                del in_progress[create_id]
 
 
 def create_accounts(org_client, args, log, deployed_accounts, account_spec):
     """
     Compare deployed_accounts to list of accounts in the accounts spec.
-    Create accounts not found in deployed_accounts.
+    Create accounts not found in deployed_accounts.  All creation
+    requests are submitted up front and polled together.  Requests
+    still in progress according to the journal are polled again
+    instead of being looked up in the creation status scan.  Requests
+    interrupted in an earlier run are looked up in the scan and polled
+    again if AWS received them.
     """
+    journal = get_journal(account_spec)
+    created_accounts = None
+    new_accounts = []
+    resumed = {}
     for a_spec in account_spec['accounts']:
-        if not lookup(deployed_accounts, 'Name', a_spec['Name'],):
+        if not deployed_accounts.lookup('Name', a_spec['Name']):
             # check if it is still being provisioned
-            created_accounts = scan_created_accounts(log, org_client)
-            if lookup(created_accounts, 'AccountName', a_spec['Name']):
+            create_id = journal.in_progress(a_spec['Name'])
+            if create_id:
+                log.warn("New account '%s' is not yet available. "
+                        "Resuming CreateAccountStatus Id: %s" %
+                        (a_spec['Name'], create_id))
+                resumed[create_id] = a_spec['Name']
+                continue
+            if created_accounts is None:
+                created_accounts = scan_created_accounts(log, org_client)
+            creation = created_accounts.lookup('AccountName', a_spec['Name'])
+            if journal.interrupted(a_spec['Name']):
+                log.warn("Creation of account '%s' was interrupted in an "
+                        "earlier run" % a_spec['Name'])
+                if creation and creation['State'] == 'IN_PROGRESS':
+                    log.warn("Resuming CreateAccountStatus Id: %s" %
+                            creation['Id'])
+                    journal.record(a_spec['Name'], 'IN_PROGRESS', creation['Id'])
+                    resumed[creation['Id']] = a_spec['Name']
+                    continue
+            if creation:
                 log.warn("New account '%s' is not yet available" %
                         a_spec['Name'])
-                break
+                continue
             # create a new account
             if 'Email' in a_spec and a_spec['Email']:
                 email_addr = a_spec['Email']
@@ -77,32 +258,9 @@ def create_accounts(org_client, args, log, deployed_accounts, account_spec):
                 email_addr = '%s@%s' % (a_spec['Name'], account_spec['default_domain'])
             log.info("Creating account '%s'" % (a_spec['Name']))
             log.debug('account email: %s' % email_addr)
-            if args['--exec']:
-                new_account = org_client.create_account(
-                        AccountName=a_spec['Name'], Email=email_addr)
-                create_id = new_account['CreateAccountStatus']['Id']
-                log.info("CreateAccountStatus Id: %s" % (create_id))
-                # validate creation status
-                counter = 0
-                maxtries = 5
-                while counter < maxtries:
-                    creation = org_client.describe_create_account_status(
-                            CreateAccountRequestId=create_id
-                            )['CreateAccountStatus']
-                    if creation['State'] == 'IN_PROGRESS':
-                        time.sleep(5)
-                        log.info("Account creation in progress for '%s'" %
-                                a_spec['Name'])
-                    elif creation['State'] == 'SUCCEEDED':
-                        log.info("Account creation succeeded")
-                        break
-                    elif creation['State'] == 'FAILED':
-                        log.error("Account creation failed: %s" %
-                                creation['FailureReason'])
-                        break
-                    counter += 1
-                if counter == maxtries and creation['State'] == 'IN_PROGRESS':
-                     log.warn("Account creation still pending. Moving on!")
+            new_accounts.append((a_spec['Name'], email_addr))
+    if args['--exec'] and (new_accounts or resumed):
+        poll_account_creation(org_client, log, journal, new_accounts, resumed)
 
 
 def display_provisioned_accounts(log, deployed_accounts):
@@ -112,32 +270,31 @@ def display_provisioned_accounts(log, deployed_accounts):
     header = "Provisioned Accounts in Org:"
     overbar = '_' * len(header)
     log.info("\n%s\n%s" % (overbar, header))
-    for a_name in sorted([a['Name'] for a in deployed_accounts]):
-        a_id = lookup(deployed_accounts, 'Name', a_name, 'Id')
-        a_email = lookup(deployed_accounts, 'Name', a_name, 'Email')
+    for a_name in sorted(deployed_accounts.names()):
+        account = deployed_accounts.lookup('Name', a_name)
         spacer = ' ' * (24 - len(a_name))
-        log.info("%s%s%s\t\t%s" % (a_name, spacer, a_id, a_email))
+        log.info("%s%s%s\t\t%s" % (a_name, spacer, account['Id'], account['Email']))
 
 
 def main():
     args = docopt(__doc__)
     log = get_logger(args)
-    org_client = boto3.client('organizations')
+    write_metrics_on_exit(log, args)
+    org_client = get_client('organizations')
     root_id = get_root_id(org_client)
-    deployed_accounts = scan_deployed_accounts(log, org_client)
+    deployed = DeployedOrg(accounts=scan_deployed_accounts(log, org_client))
 
     if args['--spec-file']:
         account_spec = validate_spec_file(log, args['--spec-file'], 'account_spec')
         validate_master_id(org_client, account_spec)
 
     if args['report']:
-        display_provisioned_accounts(log, deployed_accounts)
+        display_provisioned_accounts(log, deployed['accounts'])
 
     if args['create']:
-        create_accounts(org_client, args, log, deployed_accounts, account_spec)
-        unmanaged= [a
-                for a in [a['Name'] for a in deployed_accounts]
-                if a not in [a['Name'] for a in account_spec['accounts']]]
+        create_accounts(org_client, args, log, deployed['accounts'], account_spec)
+        unmanaged = sorted(deployed['accounts'].names()
+                - set(a['Name'] for a in account_spec['accounts']))
         if unmanaged:
             log.warn("Unmanaged accounts in Org: %s" % (', '.join(unmanaged)))
 
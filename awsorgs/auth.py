@@ -6,8 +6,13 @@ AWS Organization.
 
 Usage:
   awsauth report (--spec-file FILE) [-d] [--boto-log]
+                 [--metrics-file FILE [--metrics-format FORMAT]]
   awsauth users (--spec-file FILE) [--exec] [-vd] [--boto-log]
+                [--metrics-file FILE [--metrics-format FORMAT]]
+                [--concurrency N]
   awsauth delegation (--spec-file FILE) [--exec] [-vd] [--boto-log]
+                     [--metrics-file FILE [--metrics-format FORMAT]]
+                     [--concurrency N]
   awsauth --version
   awsauth --help
 
@@ -21,9 +26,13 @@ Options:
   --version                  Display version info and exit.
   -s FILE, --spec-file FILE  AWS account specification file in yaml format.
   --exec                     Execute proposed changes to AWS accounts.
+  -c N, --concurrency N      Number of accounts or changes to process at once
+                             [default: 8].
   -v, --verbose              Log to activity to STDOUT at log level INFO.
   -d, --debug                Increase log level to 'DEBUG'. Implies '--verbose'.
   --boto-log                 Include botocore and boto3 logs in log stream.
+  --metrics-file FILE        Write API call metrics to FILE at exit.
+  --metrics-format FORMAT    Metrics file format: 'json' or 'prom' [default: json].
 
 """
 
@@ -31,6 +40,9 @@ import os
 import sys
 import yaml
 import json
+from functools import partial
+
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import botocore.exceptions
@@ -47,26 +59,27 @@ from awsorgs.orgs import scan_deployed_accounts
 def get_assume_role_credentials(account_id, role_name, path=None,
         region_name=None):
     """
-    Get temporary sts assume_role credentials for account.
+    Get temporary sts assume_role credentials for account.  Credentials
+    are cached in CREDENTIAL_CACHE until shortly before they expire.
     """
     if path:
         role_arn = "arn:aws:iam::%s:role/%s/%s" % ( account_id, path, role_name)
     else:
         role_arn = "arn:aws:iam::%s:role/%s" % ( account_id, role_name)
     role_session_name = account_id + '-' + role_name
-    sts_client = boto3.client('sts')
 
-    if account_id == sts_client.get_caller_identity()['Account']:
+    if account_id == CREDENTIAL_CACHE.get_caller_identity()['Account']:
         return dict(
                 aws_access_key_id=None,
                 aws_secret_access_key=None,
                 aws_session_token=None,
                 region_name=None)
     else:
-        credentials = sts_client.assume_role(
-                RoleArn=role_arn,
-                RoleSessionName=role_session_name
-                )['Credentials']
+        credentials = CREDENTIAL_CACHE.get((account_id, role_name, path),
+                lambda: get_client('sts').assume_role(
+                        RoleArn=role_arn,
+                        RoleSessionName=role_session_name
+                        )['Credentials'])
         return dict(
                 aws_access_key_id=credentials['AccessKeyId'],
                 aws_secret_access_key=credentials['SecretAccessKey'],
@@ -74,6 +87,51 @@ def get_assume_role_credentials(account_id, role_name, path=None,
                 region_name=region_name)
 
 
+def scan_authorization_details(iam_client,
+        entity_filter=('User', 'Group', 'Role', 'LocalManagedPolicy')):
+    """
+    Return IAM entities in an account from paginated calls to
+    get_account_authorization_details() as a dict of ResourceIndexes
+    keyed 'users', 'groups', 'roles' and 'policies' (customer managed).
+    Entries include inline policies and managed policy attachments, and
+    users their group names.  The default version document of each
+    policy is kept under key 'Document'.  'entity_filter' selects entity
+    types as in the api parameter 'Filter'.
+    """
+    details = dict(
+            users=ResourceIndex(name_key='UserName', id_key='UserId'),
+            groups=ResourceIndex(name_key='GroupName', id_key='GroupId'),
+            roles=ResourceIndex(name_key='RoleName', id_key='RoleId'),
+            policies=ResourceIndex(name_key='PolicyName', id_key='PolicyId'))
+    paginator = iam_client.get_paginator('get_account_authorization_details')
+    config = {}
+    if PAGE_SIZE:
+        config['PageSize'] = PAGE_SIZE
+    for page in paginator.paginate(Filter=list(entity_filter),
+            PaginationConfig=config):
+        details['users'].extend(page['UserDetailList'])
+        details['groups'].extend(page['GroupDetailList'])
+        details['roles'].extend(page['RoleDetailList'])
+        for policy in page['Policies']:
+            for version in policy['PolicyVersionList']:
+                if version['IsDefaultVersion']:
+                    policy['Document'] = version['Document']
+            details['policies'].append(policy)
+    return details
+
+
+def group_members(deployed):
+    """
+    Return dict of lists of user names keyed by group name, from the
+    group lists of deployed users.
+    """
+    members = {}
+    for user in deployed['users']:
+        for group_name in user.get('GroupList', []):
+            members.setdefault(group_name, []).append(user['UserName'])
+    return members
+
+
 def display_provisioned_users(log, deployed):
     """
     Print report of currently deployed IAM users in Auth account.
@@ -82,42 +140,52 @@ def display_provisioned_users(log, deployed):
     overbar = '_' * len(header)
     log.info("\n%s\n%s\n" % (overbar, header))
     for name in sorted([u['UserName'] for u in deployed['users']]):
-        arn = lookup(deployed['users'], 'UserName', name, 'Arn')
+        arn = deployed['users'].lookup('UserName', name, 'Arn')
         spacer = ' ' * (12 - len(name))
         log.info("%s%s\t%s" % (name, spacer, arn))
 
 
-def display_provisioned_groups(credentials, log, deployed):
+def display_provisioned_groups(log, deployed):
     """
     Print report of currently deployed IAM groups in Auth account.
     List group memebers, attached policies and delegation assume role
     profiles.
     """
-    iam_resource = boto3.resource('iam', **credentials)
+    members = group_members(deployed)
     header = "Provisioned IAM Groups in Auth Account:"
     overbar = '_' * len(header)
     log.info("\n\n%s\n%s" % (overbar, header))
     for name in sorted([g['GroupName'] for g in deployed['groups']]):
-        group = iam_resource.Group(name)
-        members = list(group.users.all())
-        attached_policies = list(group.attached_policies.all())
-        assume_role_resources = [p.policy_document['Statement'][0]['Resource']
-                for p in list(group.policies.all()) if
-                p.policy_document['Statement'][0]['Action'] == 'sts:AssumeRole']
+        group = deployed['groups'].lookup('GroupName', name)
+        attached_policies = group.get('AttachedManagedPolicies', [])
+        assume_role_resources = []
+        policy_docs = [p['PolicyDocument'] for p in group.get('GroupPolicyList', [])]
+        for p in attached_policies:
+            local_policy = deployed['local_policies'].lookup('PolicyName',
+                    p['PolicyName'])
+            if local_policy and local_policy['Arn'] == p['PolicyArn']:
+                policy_docs.append(local_policy['Document'])
+        for policy_doc in policy_docs:
+            statement = policy_doc['Statement'][0]
+            if statement['Action'] == 'sts:AssumeRole':
+                if isinstance(statement['Resource'], list):
+                    assume_role_resources += statement['Resource']
+                else:
+                    assume_role_resources.append(statement['Resource'])
         log.info("\n%s\t%s" % ('Name:', name))
-        log.info("%s\t%s" % ('Arn:', group.arn))
-        if members:
+        log.info("%s\t%s" % ('Arn:', group['Arn']))
+        if members.get(name):
             log.info("Members:")
-            log.info("\n".join(["  %s" % u.name for u in members]))
+            log.info("\n".join(["  %s" % u for u in members[name]]))
         if attached_policies:
             log.info("Policies:")
-            log.info("\n".join(["  %s" % p.arn for p in attached_policies]))
+            log.info("\n".join(["  %s" % p['PolicyArn'] for p in attached_policies]))
         if assume_role_resources:
             log.info("Assume role profiles:")
             log.info("  Account\tRole ARN")
             profiles = {}
             for role_arn in assume_role_resources:
-                account_name = lookup(deployed['accounts'], 'Id',
+                account_name = deployed['accounts'].lookup('Id',
                         role_arn.split(':')[4], 'Name')
                 profiles[account_name] =  role_arn
             for account_name in sorted(profiles.keys()):
@@ -136,139 +204,288 @@ def display_roles_in_accounts(log, deployed, auth_spec):
     for account in deployed['accounts']:
         credentials = get_assume_role_credentials( account['Id'],
                 auth_spec['org_access_role'])
-        iam_client = boto3.client('iam', **credentials)
-        iam_resource = boto3.resource('iam', **credentials)
-        role_names = [r['RoleName'] for r in iam_client.list_roles()['Roles']]
-        custom_policies = iam_client.list_policies(Scope='Local')['Policies']
+        iam_client = get_client('iam', **credentials)
+        details = scan_authorization_details(iam_client,
+                ['Role', 'LocalManagedPolicy'])
         log.info("\nAccount:\t%s" % account['Name'])
-        if custom_policies:
+        if details['policies']:
             log.info("Custom Policies:")
-            for policy in custom_policies:
+            for policy in details['policies']:
                 log.info("  %s" % policy['PolicyName'])
         log.info("Roles:")
-        for name in role_names:
-            role = iam_resource.Role(name)
-            principal = role.assume_role_policy_document['Statement'][0]['Principal']
+        for role in details['roles']:
+            principal = role['AssumeRolePolicyDocument']['Statement'][0]['Principal']
             if 'AWS' in principal:
-                log.info("  %s" % name)
-                log.info("    Arn:\t%s" % role.arn)
+                log.info("  %s" % role['RoleName'])
+                log.info("    Arn:\t%s" % role['Arn'])
                 log.info("    Principal:\t%s" % principal['AWS'])
-                attached = [p.policy_name for p 
-                         in list(role.attached_policies.all())]
+                attached = [p['PolicyName'] for p
+                         in role['AttachedManagedPolicies']]
                 if attached:
                     log.info("    Attached Policies:")
                     for policy in attached:
                         log.info("      %s" % policy)
 
 
-# ISSUE: deleting user: may need to delete user policy and signing keys as well.
-def create_users(credentials, args, log, deployed, auth_spec):
+def scan_user_credentials(iam_client, user_names, max_workers=MAX_WORKERS):
+    """
+    Return dict keyed by user name of the access key Ids and MFA device
+    serial numbers of each user in 'user_names'.  Users are listed
+    concurrently.
+    """
+    def scan(user_name):
+        return dict(
+                AccessKeys=[k['AccessKeyId'] for k in paginate(iam_client,
+                        'list_access_keys', UserName=user_name)],
+                MFADevices=[d['SerialNumber'] for d in paginate(iam_client,
+                        'list_mfa_devices', UserName=user_name)])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(user_names, executor.map(scan, user_names)))
+
+
+def delete_login_profile(iam_client, user_name):
+    """
+    Delete the login profile of user 'user_name' if it has one.
+    """
+    try:
+        iam_client.delete_login_profile(UserName=user_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchEntity':
+            raise
+
+
+def delete_user(iam_client, deployed, deployed_user):
+    """
+    Delete IAM user 'deployed_user' and remove it from 'deployed'.
+    """
+    iam_client.delete_user(UserName=deployed_user['UserName'])
+    with deployed.lock:
+        deployed['users'].remove(deployed_user)
+
+
+def plan_user_deletion(iam_client, deployed, deployed_user, credentials):
+    """
+    Return list of Operations which delete an IAM user.  Group
+    memberships, managed and inline policies, access keys, MFA devices
+    and login profile are removed concurrently, then the user is deleted.
+    'credentials' is the user's entry from scan_user_credentials().
+    """
+    user_name = deployed_user['UserName']
+    operations = [Operation("remove user '%s' from group '%s'" %
+            (user_name, group_name), remove_group_member,
+            (iam_client, group_name, user_name))
+            for group_name in deployed_user.get('GroupList', [])]
+    for policy in deployed_user.get('AttachedManagedPolicies', []):
+        operations.append(Operation("detach policy '%s' from user '%s'" %
+                (policy['PolicyName'], user_name),
+                partial(iam_client.detach_user_policy, UserName=user_name,
+                        PolicyArn=policy['PolicyArn'])))
+    for policy in deployed_user.get('UserPolicyList', []):
+        operations.append(Operation("delete policy '%s' from user '%s'" %
+                (policy['PolicyName'], user_name),
+                partial(iam_client.delete_user_policy, UserName=user_name,
+                        PolicyName=policy['PolicyName'])))
+    for key_id in credentials['AccessKeys']:
+        operations.append(Operation("delete access key '%s' of user '%s'" %
+                (key_id, user_name),
+                partial(iam_client.delete_access_key, UserName=user_name,
+                        AccessKeyId=key_id)))
+    for serial_number in credentials['MFADevices']:
+        operations.append(Operation("deactivate MFA device '%s' of user '%s'" %
+                (serial_number, user_name),
+                partial(iam_client.deactivate_mfa_device, UserName=user_name,
+                        SerialNumber=serial_number)))
+    operations.append(Operation("delete login profile of user '%s'" %
+            user_name, delete_login_profile, (iam_client, user_name)))
+    operations.append(Operation("delete user '%s'" % user_name, delete_user,
+            (iam_client, deployed, deployed_user), requires=list(operations)))
+    return operations
+
+
+def create_user(iam_client, log, deployed, user_name, path):
+    """
+    Create IAM user 'user_name' and record it in 'deployed'.
+    """
+    response = iam_client.create_user(UserName=user_name, Path=path)
+    log.info(response['User']['Arn'])
+    with deployed.lock:
+        deployed['users'].append(response['User'])
+
+
+def create_group(iam_client, log, deployed, group_name, path):
+    """
+    Create IAM group 'group_name' and record it in 'deployed'.
+    """
+    response = iam_client.create_group(GroupName=group_name, Path=path)
+    log.info(response['Group']['Arn'])
+    with deployed.lock:
+        deployed['groups'].append(response['Group'])
+
+
+def delete_group(iam_client, deployed, deployed_group):
+    """
+    Delete IAM group 'deployed_group' and remove it from 'deployed'.
+    """
+    iam_client.delete_group(GroupName=deployed_group['GroupName'])
+    with deployed.lock:
+        deployed['groups'].remove(deployed_group)
+
+
+def add_group_member(iam_client, group_name, user_name):
+    """
+    Add user 'user_name' to IAM group 'group_name'.
+    """
+    iam_client.add_user_to_group(GroupName=group_name, UserName=user_name)
+
+
+def remove_group_member(iam_client, group_name, user_name):
     """
-    Manage IAM users based on user specification
+    Remove user 'user_name' from IAM group 'group_name'.
     """
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
+    iam_client.remove_user_from_group(GroupName=group_name, UserName=user_name)
+
+
+def attach_group_policy(iam_client, group_name, policy_arn):
+    """
+    Attach managed policy 'policy_arn' to IAM group 'group_name'.
+    """
+    iam_client.attach_group_policy(GroupName=group_name, PolicyArn=policy_arn)
+
+
+# ISSUE: deleting user: may need to delete signing keys as well.
+def plan_users(iam_client, args, log, deployed, auth_spec, created_users,
+        deleted_users):
+    """
+    Plan changes to IAM users based on user specification.  Users
+    specified 'absent' are deleted, see plan_user_deletion().  The
+    Operations creating and deleting users are recorded by user name in
+    'created_users' and 'deleted_users'.  Returns list of Operations.
+    """
+    operations = []
+    absent_users = []
     for u_spec in auth_spec['users']:
         path = munge_path(auth_spec['default_path'], u_spec)
-        deployed_user = lookup(deployed['users'], 'UserName', u_spec['Name'])
+        deployed_user = deployed['users'].lookup('UserName', u_spec['Name'])
         if deployed_user:
-            user = iam_resource.User(u_spec['Name'])
             # delete user
             if ensure_absent(u_spec):
                 log.info("Deleting user '%s'" % u_spec['Name'])
-                if args['--exec']:
-                    for group in user.groups.all():
-                        user.remove_group(GroupName=group.name)
-                    for policy in user.attached_policies.all():
-                        policy.detach_user(UserName=u_spec['Name'])
-                    for key in user.access_keys.all():
-                        key.delete()
-                    for mfa in user.mfa_devices.all():
-                        mfa.disassociate()
-                    try:
-                        user.LoginProfile().delete()
-                    except ClientError as e:
-                        if e.response['Error']['Code'] == 'NoSuchEntity':
-                            pass
-                    user.delete()
+                absent_users.append(deployed_user)
             # update user
-            elif user.path != path:
+            elif deployed_user['Path'] != path:
                 log.info("Updating path on user '%s'" % u_spec['Name'])
-                if args['--exec']:
-                    user.update(NewPath=path)
+                operations.append(Operation(
+                        "update path on user '%s'" % u_spec['Name'],
+                        partial(iam_client.update_user,
+                                UserName=u_spec['Name'], NewPath=path)))
         # create new user
         elif not ensure_absent(u_spec):
             log.info("Creating user '%s'" % u_spec['Name'])
-            if args['--exec']:
-                response = iam_client.create_user(UserName=u_spec['Name'], Path=path)
-                log.info(response['User']['Arn'])
-                deployed['users'].append(response['User'])
+            created_users[u_spec['Name']] = Operation(
+                    "create user '%s'" % u_spec['Name'],
+                    create_user, (iam_client, log, deployed, u_spec['Name'], path))
+            operations.append(created_users[u_spec['Name']])
+    if absent_users:
+        user_credentials = scan_user_credentials(iam_client,
+                [u['UserName'] for u in absent_users], int(args['--concurrency']))
+        for deployed_user in absent_users:
+            deletion = plan_user_deletion(iam_client, deployed, deployed_user,
+                    user_credentials[deployed_user['UserName']])
+            deleted_users[deployed_user['UserName']] = deletion[-1]
+            operations += deletion
+    return operations
 
 
-def create_groups(credentials, args, log, deployed, auth_spec):
+def plan_groups(iam_client, log, deployed, auth_spec, created_groups,
+        deleted_users):
     """
-    Manage IAM groups based on group specification
+    Plan changes to IAM groups based on group specification.  A group is
+    deleted only once users deleted in 'deleted_users' are gone from it.
+    The Operations creating groups are recorded by group name in
+    'created_groups'.  Returns list of Operations.
     """
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
+    operations = []
+    members = group_members(deployed)
     for g_spec in auth_spec['groups']:
         path = munge_path(auth_spec['default_path'], g_spec)
-        deployed_group = lookup(deployed['groups'], 'GroupName', g_spec['Name'])
+        deployed_group = deployed['groups'].lookup('GroupName', g_spec['Name'])
         if deployed_group:
-            group = iam_resource.Group(g_spec['Name'])
             # delete group?
             if ensure_absent(g_spec):
                 # check if group has users
-                if list(group.users.all()):
+                current_members = members.get(g_spec['Name'], [])
+                if [u for u in current_members if u not in deleted_users]:
                     log.error("Can not delete group '%s'. Still contains users"
                              % g_spec['Name'])
                 else:
                     log.info("Deleting group '%s'" % g_spec['Name'])
-                    if args['--exec']:
-                        for policy in group.policies.all():
-                            policy.delete()
-                        for policy in group.attached_policies.all():
-                            policy.detach_group(GroupName=g_spec['Name'])
-                        group.delete()
-                        deployed['groups'].remove(deployed_group)
+                    policy_operations = []
+                    for policy in deployed_group.get('GroupPolicyList', []):
+                        policy_operations.append(Operation(
+                                "delete policy '%s' from group '%s'" %
+                                (policy['PolicyName'], g_spec['Name']),
+                                partial(iam_client.delete_group_policy,
+                                        GroupName=g_spec['Name'],
+                                        PolicyName=policy['PolicyName'])))
+                    for policy in deployed_group.get('AttachedManagedPolicies', []):
+                        policy_operations.append(Operation(
+                                "detach policy '%s' from group '%s'" %
+                                (policy['PolicyName'], g_spec['Name']),
+                                partial(iam_client.detach_group_policy,
+                                        GroupName=g_spec['Name'],
+                                        PolicyArn=policy['PolicyArn'])))
+                    operations += policy_operations
+                    operations.append(Operation(
+                            "delete group '%s'" % g_spec['Name'],
+                            delete_group, (iam_client, deployed, deployed_group),
+                            requires=policy_operations + [deleted_users[u]
+                                    for u in current_members]))
             # update group?
-            elif group.path != path:
+            elif deployed_group['Path'] != path:
                 log.info("Updating path on group '%s'" % g_spec['Name'])
-                if args['--exec']:
-                    group.update(NewPath=path)
+                operations.append(Operation(
+                        "update path on group '%s'" % g_spec['Name'],
+                        partial(iam_client.update_group,
+                                GroupName=g_spec['Name'], NewPath=path)))
         # create group
         elif not ensure_absent(g_spec):
             log.info("Creating group '%s'" % g_spec['Name'])
-            if args['--exec']:
-                response = iam_client.create_group(
-                        GroupName=g_spec['Name'], Path=path)
-                log.info(response['Group']['Arn'])
-                deployed['groups'].append(response['Group'])
+            created_groups[g_spec['Name']] = Operation(
+                    "create group '%s'" % g_spec['Name'],
+                    create_group, (iam_client, log, deployed, g_spec['Name'], path))
+            operations.append(created_groups[g_spec['Name']])
+    return operations
 
 
-def manage_group_members(credentials, args, log, deployed, auth_spec):
+def plan_group_members(iam_client, log, deployed, auth_spec, created_users,
+        created_groups, deleted_users):
     """
-    Populate users into groups based on group specification.
+    Plan changes to group membership based on group specification.
+    Current members of all groups come from the snapshot of deployed
+    users.  Adding a member waits for the user and the group to be
+    created.  Users in 'deleted_users' leave their groups as part of
+    their deletion.  Returns list of Operations.
     """
-    iam_resource = boto3.resource('iam', **credentials)
+    user_specs = ResourceIndex(auth_spec['users'])
+    members = group_members(deployed)
+    all_members = set(user['Name'] for user in auth_spec['users']
+            if not ensure_absent(user))
+    operations = []
     for g_spec in auth_spec['groups']:
-        if lookup(deployed['groups'], 'GroupName', g_spec['Name']):
-            group = iam_resource.Group(g_spec['Name'])
-            current_members = [user.name for user in group.users.all()] 
-            # build list of specified group members
-            spec_members = []
+        if (deployed['groups'].lookup('GroupName', g_spec['Name'])
+                or g_spec['Name'] in created_groups):
+            current_members = set(members.get(g_spec['Name'], [])) - set(deleted_users)
+            # build set of specified group members
+            spec_members = set()
             if 'Members' in g_spec and g_spec['Members']:
                 if g_spec['Members'] == 'ALL':
                     # all managed users except when user ensure: absent
-                    spec_members = [user['Name'] for user in auth_spec['users']
-                            if not ensure_absent(user)]
-                    if 'ExcludeMembers' in g_spec and g_spec['ExcludeMembers']:
-                        spec_members = [user for user in spec_members
-                                if user not in g_spec['ExcludeMembers']]
+                    spec_members = all_members - set(
+                            g_spec.get('ExcludeMembers') or [])
                 else:
                     # just specified members
                     for username in g_spec['Members']:
-                        u_spec = lookup(auth_spec['users'], 'Name', username)
+                        u_spec = user_specs.lookup('Name', username)
                         # not a managed user?
                         if not u_spec:
                             log.error("User '%s' not in auth_spec['users']. "
@@ -281,91 +498,160 @@ def manage_group_members(credentials, args, log, deployed, auth_spec):
                                     "to group '%s'" % 
                                     (username, g_spec['Name']))
                         else:
-                            spec_members.append(username)
+                            spec_members.add(username)
             # ensure all specified members are in group
             if not ensure_absent(g_spec):
-                for username in spec_members:
-                    if username not in current_members:
-                        log.info("Adding user '%s' to group '%s'." %
-                                (username, g_spec['Name']))
-                        if args['--exec']:
-                            group.add_user(UserName=username)
-            # ensure no unspecified members are in group
-            for username in current_members:
-                if username not in spec_members:
-                    log.info("Removing user '%s' from group '%s'." %
+                for username in sorted(spec_members - current_members):
+                    log.info("Adding user '%s' to group '%s'." %
                             (username, g_spec['Name']))
-                    if args['--exec']:
-                        group.remove_user(UserName=username)
+                    requires = [op for op in (created_users.get(username),
+                            created_groups.get(g_spec['Name'])) if op]
+                    operations.append(Operation(
+                            "add user '%s' to group '%s'" %
+                            (username, g_spec['Name']),
+                            add_group_member,
+                            (iam_client, g_spec['Name'], username),
+                            requires=requires))
+            # ensure no unspecified members are in group
+            for username in sorted(current_members - spec_members):
+                log.info("Removing user '%s' from group '%s'." %
+                        (username, g_spec['Name']))
+                operations.append(Operation(
+                        "remove user '%s' from group '%s'" %
+                        (username, g_spec['Name']),
+                        remove_group_member,
+                        (iam_client, g_spec['Name'], username)))
+    return operations
 
 
-def manage_group_policies(credentials, args, log, deployed, auth_spec):
+def plan_group_policies(iam_client, args, log, deployed, auth_spec,
+        created_groups):
     """
-    Attach managed policies to groups based on group specification
+    Plan managed policy attachments to groups based on group
+    specification.  Custom policies are created or updated by their own
+    Operations, which the attachments of those policies depend on.
+    Returns list of Operations.
     """
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
-    auth_account = lookup(deployed['accounts'], 'Id',
+    local_policies = deployed['local_policies']
+    policy_arns = {}
+    auth_account = deployed['accounts'].lookup('Id',
             auth_spec['auth_account_id'], 'Name')
     log.debug("auth account: '%s'" % auth_account)
+    operations = []
     for g_spec in auth_spec['groups']:
         log.debug("processing group spec for '%s':\n%s" % (g_spec['Name'], g_spec))
         if 'Policies' in g_spec and g_spec['Policies']:
-            if (lookup(deployed['groups'], 'GroupName', g_spec['Name'])
-                    and not ensure_absent(g_spec)):
-                group = iam_resource.Group(g_spec['Name'])
-                attached_policies = [p.policy_name for p
-                        in list(group.attached_policies.all())]
-                log.debug("attached policies: '%s'" % attached_policies)
+            deployed_group = deployed['groups'].lookup('GroupName', g_spec['Name'])
+            created_group = created_groups.get(g_spec['Name'])
+            if (deployed_group or created_group) and not ensure_absent(g_spec):
+                attached_policies = dict((p['PolicyName'], p['PolicyArn'])
+                        for p in (deployed_group or {}).get(
+                                'AttachedManagedPolicies', []))
+                # assume role policies are left to delegation mode
+                assume_role_policies = group_assume_role_policy_names(
+                        deployed, auth_spec, g_spec['Name'])
+                log.debug("attached policies: '%s'" % sorted(attached_policies))
                 log.debug("specified policies: '%s'" % g_spec['Policies'])
                 # attach missing policies
                 for policy_name in g_spec['Policies']:
                     if not policy_name in attached_policies:
-                        policy_arn = get_policy_arn(iam_client, policy_name, args,
-                                log, auth_spec)
+                        policy_arn = plan_policy_arn(iam_client, policy_name,
+                                log, auth_spec, local_policies, policy_arns,
+                                operations)
                         log.debug("policy Arn for '%s': %s" % (policy_name, policy_arn))
                         log.info("Attaching policy '%s' to group '%s' in "
                                 "account '%s'." % (policy_name, g_spec['Name'],
                                 auth_account))
-                        if args['--exec']:
-                            group.attach_policy(PolicyArn=policy_arn)
+                        if policy_arn:
+                            operations.append(Operation(
+                                    "attach policy '%s' to group '%s'" %
+                                    (policy_name, g_spec['Name']),
+                                    attach_group_policy,
+                                    [iam_client, g_spec['Name'], policy_arn],
+                                    requires=[created_group] if created_group else []))
                     elif lookup(auth_spec['custom_policies'], 'PolicyName',
                             policy_name):
-                        policy_arn = get_policy_arn(iam_client, policy_name, args,
-                                log, auth_spec)
+                        plan_policy_arn(iam_client, policy_name, log, auth_spec,
+                                local_policies, policy_arns, operations)
                 # datach obsolete policies
-                for policy_name in attached_policies:
-                    if not policy_name in g_spec['Policies']:
-                        policy_arn = get_policy_arn(iam_client, policy_name, args,
-                                log, auth_spec)
+                for policy_name in sorted(attached_policies):
+                    if not (policy_name in g_spec['Policies']
+                            or policy_name in assume_role_policies):
                         log.info("Detaching policy '%s' from group '%s' in "
                                 "account '%s'." % (policy_name, g_spec['Name'],
                                 auth_account))
-                        if args['--exec']:
-                            group.detach_policy(PolicyArn=policy_arn)
+                        operations.append(Operation(
+                                "detach policy '%s' from group '%s'" %
+                                (policy_name, g_spec['Name']),
+                                partial(iam_client.detach_group_policy,
+                                        GroupName=g_spec['Name'],
+                                        PolicyArn=attached_policies[policy_name])))
+    return operations
 
 
-def get_policy_arn(iam_client, policy_name, args, log, auth_spec):
+def get_policy_arn(iam_client, policy_name, args, log, auth_spec,
+        local_policies):
     """
     Return the policy arn of the named IAM policy in an account.
-    Checks AWS scope first, then calls manage_custom_policy() for
-    local scope policies.
+    Checks AWS scope first in AWS_POLICY_INDEX, then calls
+    manage_custom_policy() for local scope policies.
     """
     log.debug("policyName: '%s'" % policy_name)
-    aws_policies = iam_client.list_policies(Scope='AWS',
-            MaxItems=500)['Policies']
-    policy_arn = lookup(aws_policies, 'PolicyName', policy_name, 'Arn')
+    policy_arn = AWS_POLICY_INDEX.lookup(iam_client, policy_name,
+            rebuild_on_miss=not lookup(auth_spec['custom_policies'],
+                    'PolicyName', policy_name))
     if policy_arn:
         return policy_arn
-    else:
-        return manage_custom_policy(iam_client, policy_name, args,
-                log, auth_spec)
+    return manage_custom_policy(iam_client, policy_name, args,
+            log, auth_spec, local_policies)
+
+
+def plan_policy_arn(iam_client, policy_name, log, auth_spec, local_policies,
+        policy_arns, operations):
+    """
+    Return the policy arn of the named IAM policy in an account, as
+    get_policy_arn() does without changing the account.  When a custom
+    policy must be created or updated, the Operation doing so is appended
+    to 'operations' and returned in place of the arn.  Results are kept
+    in dict 'policy_arns' by policy name, so each custom policy is
+    planned once.
+    """
+    if policy_name not in policy_arns:
+        policy_arn = AWS_POLICY_INDEX.lookup(iam_client, policy_name,
+                rebuild_on_miss=not lookup(auth_spec['custom_policies'],
+                        'PolicyName', policy_name))
+        if not policy_arn:
+            policy_arn, operation = plan_custom_policy(iam_client, policy_name,
+                    log, auth_spec, local_policies)
+            if operation:
+                operations.append(operation)
+                policy_arn = operation
+        policy_arns[policy_name] = policy_arn
+    return policy_arns[policy_name]
 
 
-def manage_custom_policy(iam_client, policy_name, args, log, auth_spec):
+def manage_custom_policy(iam_client, policy_name, args, log, auth_spec,
+        local_policies):
     """
     Create or update a custom IAM policy in an account based on
-    a policy specification.  Returns the policy arn.
+    a policy specification.  Returns the policy arn.  'local_policies'
+    is the account's index of customer managed policies from
+    scan_authorization_details().  It is updated after each change.
+    """
+    policy_arn, operation = plan_custom_policy(iam_client, policy_name, log,
+            auth_spec, local_policies)
+    if operation and args['--exec']:
+        return operation.run()
+    return policy_arn
+
+
+def plan_custom_policy(iam_client, policy_name, log, auth_spec, local_policies):
+    """
+    Compare a custom IAM policy in an account with its policy
+    specification.  Returns tuple (policy_arn, operation).  'policy_arn'
+    is None if the policy does not exist yet.  'operation' creates or
+    updates the policy and returns its arn, or is None if the policy is
+    current.
     """
     log.debug("policyName: '%s'" % policy_name)
     p_spec = lookup(auth_spec['custom_policies'], 'PolicyName', policy_name)
@@ -373,106 +659,307 @@ def manage_custom_policy(iam_client, policy_name, args, log, auth_spec):
         log.error("Custom Policy spec for '%s' not found in auth-spec." %
                 policy_name)
         log.error("Policy creation failed.")
-        return None
+        return None, None
     policy_doc = json.dumps(dict(
             Version='2012-10-17',
             Statement=p_spec['Statement']))
     log.debug("Policy document from auth_spec:\n'%s'" %
             json.dumps(json.loads(policy_doc), indent=2, separators=(',', ': ')))
-    custom_policies = iam_client.list_policies(Scope='Local')['Policies']
-    log.debug("Custom policies:'%s'" % custom_policies)
-    policy = lookup(custom_policies, 'PolicyName', policy_name)
+    log.debug("Custom policies:'%s'" % local_policies.names())
+    policy = local_policies.lookup('PolicyName', policy_name)
     if not policy:
         log.info("Creating custom policy '%s'." % policy_name)
-        if args['--exec']:
-            return iam_client.create_policy(
-                PolicyName=p_spec['PolicyName'],
-                Path=munge_path(auth_spec['default_path'], p_spec),
-                Description=p_spec['Description'],
-                PolicyDocument=policy_doc)['Policy']['Arn']
-        return None
-    else:
-        current_doc = iam_client.get_policy_version(
+        return None, Operation("create custom policy '%s'" % policy_name,
+                create_custom_policy,
+                [iam_client, auth_spec, p_spec, policy_doc, local_policies])
+    if 'Document' not in policy:
+        policy['Document'] = iam_client.get_policy_version(
                 PolicyArn=policy['Arn'],
                 VersionId=policy['DefaultVersionId']
                 )['PolicyVersion']['Document']
-        log.debug("Policy document from deployed policy:\n'%s'" %
-                json.dumps(current_doc, indent=2, separators=(',', ': ')))
-        if json.dumps(current_doc) != policy_doc:
-            log.info("Updating custom policy '%s'." % policy_name)
-            if args['--exec']:
-                log.debug("check for non-default policy versions for '%s'" % policy_name)
-                for v in iam_client.list_policy_versions(
-                        PolicyArn=policy['Arn'])['Versions']:
-                    if not v['IsDefaultVersion']:
-                        log.info("Deleting non-default policy version '%s' for "
-                                "policy '%s'" % (v['VersionId'], policy_name))
-                        iam_client.delete_policy_version(
-                                PolicyArn=policy['Arn'],
-                                VersionId=v['VersionId'])
-                iam_client.create_policy_version(
-                        PolicyArn=policy['Arn'],
-                        PolicyDocument=policy_doc,
-                        SetAsDefault=True)
-        return policy['Arn']
+    current_doc = policy['Document']
+    log.debug("Policy document from deployed policy:\n'%s'" %
+            json.dumps(current_doc, indent=2, separators=(',', ': ')))
+    if (normalize_policy_document(current_doc)
+            != normalize_policy_document(policy_doc)):
+        log.info("Updating custom policy '%s'." % policy_name)
+        return policy['Arn'], Operation(
+                "update custom policy '%s'" % policy_name,
+                update_custom_policy, [iam_client, log, policy, policy_doc])
+    return policy['Arn'], None
+
+
+def create_custom_policy(iam_client, auth_spec, p_spec, policy_doc,
+        local_policies):
+    """
+    Create custom IAM policy from policy specification 'p_spec' and
+    record it in 'local_policies'.  Returns the policy arn.
+    """
+    policy = iam_client.create_policy(
+        PolicyName=p_spec['PolicyName'],
+        Path=munge_path(auth_spec['default_path'], p_spec),
+        Description=p_spec['Description'],
+        PolicyDocument=policy_doc)['Policy']
+    policy['Document'] = json.loads(policy_doc)
+    local_policies.append(policy)
+    return policy['Arn']
+
+
+def update_custom_policy(iam_client, log, policy, policy_doc):
+    """
+    Make 'policy_doc' the default version of custom IAM policy 'policy',
+    first deleting non-default versions.  Returns the policy arn.
+    """
+    policy_name = policy['PolicyName']
+    log.debug("check for non-default policy versions for '%s'" % policy_name)
+    for v in paginate(iam_client, 'list_policy_versions',
+            PolicyArn=policy['Arn']):
+        if not v['IsDefaultVersion']:
+            log.info("Deleting non-default policy version '%s' for "
+                    "policy '%s'" % (v['VersionId'], policy_name))
+            iam_client.delete_policy_version(
+                    PolicyArn=policy['Arn'],
+                    VersionId=v['VersionId'])
+    version = iam_client.create_policy_version(
+            PolicyArn=policy['Arn'],
+            PolicyDocument=policy_doc,
+            SetAsDefault=True)['PolicyVersion']
+    policy['DefaultVersionId'] = version['VersionId']
+    policy['Document'] = json.loads(policy_doc)
+    return policy['Arn']
+
+
+def delete_custom_policy(iam_client, log, policy, local_policies):
+    """
+    Delete custom IAM policy 'policy' and its non-default versions, and
+    remove it from 'local_policies'.  The policy must be detached.
+    """
+    for v in paginate(iam_client, 'list_policy_versions',
+            PolicyArn=policy['Arn']):
+        if not v['IsDefaultVersion']:
+            log.debug("Deleting non-default policy version '%s' for "
+                    "policy '%s'" % (v['VersionId'], policy['PolicyName']))
+            iam_client.delete_policy_version(
+                    PolicyArn=policy['Arn'],
+                    VersionId=v['VersionId'])
+    iam_client.delete_policy(PolicyArn=policy['Arn'])
+    local_policies.remove(policy)
+
+
+def delegation_role_arns(deployed, auth_spec, trusting_accounts, d_spec):
+    """
+    Return list of (account name, role arn) tuples for the delegation role
+    in each trusting account found in the organization.
+    """
+    role_arns = []
+    for account in trusting_accounts:
+        account_id = deployed['accounts'].lookup('Name', account, 'Id')
+        if account_id:
+            role_arns.append((account, "arn:aws:iam::%s:role%s%s" % (
+                    account_id,
+                    munge_path(auth_spec['default_path'], d_spec),
+                    d_spec['RoleName'])))
+    return role_arns
+
+
+def assume_role_policy_document(resource):
+    """
+    Return json policy document, without whitespace, allowing
+    sts:AssumeRole on 'resource', a role arn or list of role arns.
+    """
+    return json.dumps(dict(
+            Version='2012-10-17',
+            Statement=[dict(
+                    Effect='Allow',
+                    Action='sts:AssumeRole',
+                    Resource=resource)]), separators=(',', ':'))
+
+
+def assume_role_group_policies(log, deployed, auth_spec, trusting_accounts,
+        d_spec, inline_limit=GROUP_POLICY_MAX_SIZE):
+    """
+    Return tuple of dicts (inline_policies, managed_policies) of assume
+    role policy documents for the trusted group of a delegation, keyed by
+    policy name.  By default there is one inline policy per trusting
+    account named '<account>-<RoleName>'.  When auth spec
+    'assume_role_group_policies' is 'consolidated', all role arns are
+    listed as the Resource of one inline policy named
+    '<RoleName>-assume-role'.  If that document is larger than
+    'inline_limit', the space left for inline policies on the group, the
+    role arns are split instead across customer managed policies named
+    '<RoleName>-assume-role-<n>' of at most MANAGED_POLICY_MAX_SIZE each.
+    """
+    role_arns = delegation_role_arns(deployed, auth_spec, trusting_accounts,
+            d_spec)
+    if auth_spec.get('assume_role_group_policies') != 'consolidated':
+        return dict(("%s-%s" % (account, d_spec['RoleName']),
+                assume_role_policy_document(arn))
+                for account, arn in role_arns), {}
+    if not role_arns:
+        return {}, {}
+    arns = [arn for account, arn in role_arns]
+    policy_doc = assume_role_policy_document(arns)
+    if len(policy_doc) <= inline_limit:
+        return {"%s-assume-role" % d_spec['RoleName']: policy_doc}, {}
+    chunks = [[]]
+    size = len(assume_role_policy_document([]))
+    for arn in arns:
+        # each arn adds its quoted length plus a separating comma
+        if chunks[-1] and size + len(arn) + 3 > MANAGED_POLICY_MAX_SIZE:
+            chunks.append([])
+            size = len(assume_role_policy_document([]))
+        chunks[-1].append(arn)
+        size += len(arn) + 3
+    managed_policies = dict(
+            ("%s-assume-role-%d" % (d_spec['RoleName'], n + 1),
+            assume_role_policy_document(chunk))
+            for n, chunk in enumerate(chunks))
+    log.debug("assume role managed policies for delegation '%s': %s" %
+            (d_spec['RoleName'], sorted(managed_policies)))
+    return {}, managed_policies
+
+
+def _assume_role_resources_only(policy_doc, role_name):
+    # test that every statement allows sts:AssumeRole on roles 'role_name'
+    if not isinstance(policy_doc, dict):
+        policy_doc = json.loads(policy_doc)
+    statements = policy_doc.get('Statement', [])
+    if isinstance(statements, dict):
+        statements = [statements]
+    resources = []
+    for statement in statements:
+        if statement.get('Action') != 'sts:AssumeRole':
+            return False
+        resource = statement.get('Resource', [])
+        resources += resource if isinstance(resource, list) else [resource]
+    return all(':role/' in arn and arn.endswith('/' + role_name)
+            for arn in resources)
+
+
+def is_assume_role_group_policy(policy_name, policy_doc, d_spec):
+    """
+    Test if group inline policy 'policy_name' is an assume role policy for
+    the delegation in either the per account or the consolidated form.
+    The name must end in '-<RoleName>' or be '<RoleName>-assume-role', and
+    every Resource of the document must be a role named RoleName.  The
+    trusting account need not still be in the organization.
+    """
+    role_name = d_spec['RoleName']
+    if not (policy_name.endswith('-' + role_name)
+            or policy_name == "%s-assume-role" % role_name):
+        return False
+    return _assume_role_resources_only(policy_doc, role_name)
+
+
+def is_assume_role_managed_policy(policy_name, policy_doc, d_spec):
+    """
+    Test if customer managed policy 'policy_name' is an assume role policy
+    for the delegation, named '<RoleName>-assume-role-<n>'.
+    """
+    prefix = "%s-assume-role-" % d_spec['RoleName']
+    if not (policy_name.startswith(prefix)
+            and policy_name[len(prefix):].isdigit()):
+        return False
+    return _assume_role_resources_only(policy_doc, d_spec['RoleName'])
+
+
+def group_assume_role_policy_names(deployed, auth_spec, group_name):
+    """
+    Return set of names of the customer managed assume role policies of
+    delegations trusting group 'group_name'.  These are managed by
+    set_group_assume_role_policies(), not by the group spec.
+    """
+    return set(policy['PolicyName']
+            for d_spec in auth_spec.get('delegations') or []
+            if d_spec['TrustedGroup'] == group_name
+            for policy in deployed['local_policies']
+            if is_assume_role_managed_policy(policy['PolicyName'],
+                    policy.get('Document', {}), d_spec))
+
+
+def group_policy_size(policy_doc):
+    """
+    Return the size of a group inline policy document as counted against
+    GROUP_POLICY_MAX_SIZE, that is without whitespace.
+    """
+    if not isinstance(policy_doc, dict):
+        policy_doc = json.loads(policy_doc)
+    return len(json.dumps(policy_doc, separators=(',', ':')))
 
 
 def set_group_assume_role_policies(args, log, deployed, auth_spec,
         trusting_accounts, d_spec):
     """
     Assign and manage assume role trust policies on IAM groups in
-    Auth account.
+    Auth account.  Existing assume role policies for the delegation in
+    another form than the one needed are purged, so switching modes
+    migrates the group in one run.  Returns False if the group can not
+    be brought up to date.
     """
     credentials = get_assume_role_credentials(
             auth_spec['auth_account_id'],
             auth_spec['org_access_role'])
-    iam_resource = boto3.resource('iam', **credentials)
-    auth_account = lookup(deployed['accounts'], 'Id',
+    iam_client = get_client('iam', **credentials)
+    iam_resource = get_resource('iam', **credentials)
+    auth_account = deployed['accounts'].lookup('Id',
             auth_spec['auth_account_id'], 'Name')
-    if lookup(deployed['groups'], 'GroupName', d_spec['TrustedGroup']):
+    deployed_group = deployed['groups'].lookup('GroupName', d_spec['TrustedGroup'])
+    if deployed_group:
         group = iam_resource.Group(d_spec['TrustedGroup'])
     else:
         log.error("Can not manage assume role policy for delegation role '%s' "
                 "in group '%s'. Group not found in auth account '%s'" %
                 (d_spec['RoleName'], d_spec['TrustedGroup'], auth_account))
-        return
+        return False
 
-    # make list of existing group policies which match this role name
-    group_policies_for_role = [p.policy_name
-            for p in list(group.policies.all())
-            if d_spec['RoleName'] in p.policy_name.split('-')]
-
-    # test if delegation should be deleted
-    if ensure_absent(d_spec): 
-        for policy_name in group_policies_for_role:
-            log.info("Deleting assume role group policy '%s' from group '%s' "
-                    "in account '%s'" %
-                    (policy_name, d_spec['TrustedGroup'], auth_account))
-            if args['--exec']:
-                group.Policy(policy_name).delete()
-        return
+    # make lists of existing inline and managed policies for this delegation
+    group_policies = dict((p['PolicyName'], p['PolicyDocument'])
+            for p in deployed_group.get('GroupPolicyList', []))
+    group_policies_for_role = sorted(policy_name
+            for policy_name, policy_doc in group_policies.items()
+            if is_assume_role_group_policy(policy_name, policy_doc, d_spec))
+    managed_policies_for_role = dict((p['PolicyName'], p)
+            for p in deployed['local_policies']
+            if is_assume_role_managed_policy(p['PolicyName'],
+                    p.get('Document', {}), d_spec))
 
-    # keep track of managed group policies as we process them
-    managed_policies = []
-    for account in trusting_accounts:
-        account_id = lookup(deployed['accounts'], 'Name', account, 'Id')
-        policy_name = "%s-%s" % (account, d_spec['RoleName'])
-        managed_policies.append(policy_name)
-
-        # assemble assume role policy document
-        statement = dict(
-                Effect='Allow',
-                Action='sts:AssumeRole',
-                Resource="arn:aws:iam::%s:role%s%s" % (
-                        account_id,
-                        munge_path(auth_spec['default_path'], d_spec),
-                        d_spec['RoleName'])) 
-        policy_doc = json.dumps(dict(
-                Version='2012-10-17',
-                Statement=[statement]))
-
-        # create or update group policy
-        if not policy_name in group_policies_for_role:
+    # IAM limits the total size of all inline policies on a group
+    inline_size = sum(group_policy_size(policy_doc)
+            for policy_name, policy_doc in group_policies.items()
+            if policy_name not in group_policies_for_role)
+    if ensure_absent(d_spec):
+        inline_policies, managed_policies = {}, {}
+    else:
+        inline_policies, managed_policies = assume_role_group_policies(log,
+                deployed, auth_spec, trusting_accounts, d_spec,
+                GROUP_POLICY_MAX_SIZE - inline_size)
+    total_size = inline_size + sum(group_policy_size(policy_doc)
+            for policy_doc in inline_policies.values())
+    if total_size > GROUP_POLICY_MAX_SIZE:
+        log.error("Can not manage assume role policies for delegation role "
+                "'%s' in group '%s'. Inline policies would total %d "
+                "characters, exceeding the limit of %d" % (d_spec['RoleName'],
+                d_spec['TrustedGroup'], total_size, GROUP_POLICY_MAX_SIZE))
+        return False
+
+    # IAM checks the limit on every write.  Purge obsolete inline policies
+    # first if the group can not hold them next to the new ones.
+    obsolete_policies = [policy_name for policy_name in group_policies_for_role
+            if policy_name not in inline_policies]
+    peak_size = inline_size
+    for policy_name, policy_doc in inline_policies.items():
+        peak_size += max(group_policy_size(policy_doc),
+                group_policy_size(group_policies.get(policy_name, policy_doc)))
+    for policy_name in obsolete_policies:
+        peak_size += group_policy_size(group_policies[policy_name])
+    if peak_size > GROUP_POLICY_MAX_SIZE:
+        delete_assume_role_group_policies(args, log, group, deployed_group,
+                obsolete_policies, auth_account)
+        obsolete_policies = []
+
+    # create or update inline policies
+    for policy_name, policy_doc in sorted(inline_policies.items()):
+        if not policy_name in group_policies:
             log.info("Creating assume role policy '%s' for group '%s' in "
                     "account '%s'." % (policy_name, d_spec['TrustedGroup'],
                     auth_account))
@@ -480,54 +967,110 @@ def set_group_assume_role_policies(args, log, deployed, auth_spec,
                 group.create_policy(
                         PolicyName=policy_name,
                         PolicyDocument=policy_doc)
-        elif json.dumps(group.Policy(policy_name).policy_document) != policy_doc:
+                set_group_policy(deployed_group, policy_name, policy_doc)
+        elif (normalize_policy_document(group_policies[policy_name])
+                != normalize_policy_document(policy_doc)):
             log.info("Updating assume role policy '%s' for group '%s' in "
                     "account '%s'." % (policy_name, d_spec['TrustedGroup'],
                     auth_account))
             if args['--exec']:
                 group.Policy(policy_name).put(PolicyDocument=policy_doc)
+                set_group_policy(deployed_group, policy_name, policy_doc)
+
+    # create, update and attach managed policies
+    attached_arns = [p['PolicyArn']
+            for p in deployed_group.get('AttachedManagedPolicies', [])]
+    for policy_name, policy_doc in sorted(managed_policies.items()):
+        policy = managed_policies_for_role.get(policy_name)
+        policy_arn = policy and policy['Arn']
+        if not policy:
+            log.info("Creating assume role managed policy '%s' in account "
+                    "'%s'." % (policy_name, auth_account))
+            if args['--exec']:
+                policy_arn = create_custom_policy(iam_client, auth_spec,
+                        dict(PolicyName=policy_name,
+                                Description="Assume role policy for "
+                                "delegation '%s'" % d_spec['RoleName']),
+                        policy_doc, deployed['local_policies'])
+        elif (normalize_policy_document(policy.get('Document', {}))
+                != normalize_policy_document(policy_doc)):
+            log.info("Updating assume role managed policy '%s' in account "
+                    "'%s'." % (policy_name, auth_account))
+            if args['--exec']:
+                update_custom_policy(iam_client, log, policy, policy_doc)
+        if policy_arn not in attached_arns:
+            log.info("Attaching assume role managed policy '%s' to group '%s' "
+                    "in account '%s'." % (policy_name, d_spec['TrustedGroup'],
+                    auth_account))
+            if args['--exec']:
+                attach_group_policy(iam_client, d_spec['TrustedGroup'],
+                        policy_arn)
+                set_attached_group_policy(deployed_group, policy_name,
+                        policy_arn)
 
     # purge any policies for this role that are no longer being managed
-    for policy_name in group_policies_for_role:
+    delete_assume_role_group_policies(args, log, group, deployed_group,
+            obsolete_policies, auth_account)
+    for policy_name, policy in sorted(managed_policies_for_role.items()):
         if policy_name not in managed_policies:
-            log.info("Deleting obsolete policy '%s' from group '%s' in "
-                    "account '%s'." % (policy_name, d_spec['TrustedGroup'],
-                    auth_account))
+            log.info("Deleting obsolete managed policy '%s' in account '%s'." %
+                    (policy_name, auth_account))
             if args['--exec']:
-                group.Policy(policy_name).delete()
+                if policy['Arn'] in attached_arns:
+                    iam_client.detach_group_policy(
+                            GroupName=d_spec['TrustedGroup'],
+                            PolicyArn=policy['Arn'])
+                    set_attached_group_policy(deployed_group, policy_name, None)
+                delete_custom_policy(iam_client, log, policy,
+                        deployed['local_policies'])
+    return True
 
 
-def manage_delegation_role(credentials, args, log, deployed,
-        auth_spec, account_name, trusting_accounts, d_spec):
+def delete_assume_role_group_policies(args, log, group, deployed_group,
+        policy_names, auth_account):
     """
-    Create and manage a cross account access delegetion role in an
-    account based on delegetion specification.
+    Delete the named inline assume role policies from IAM group resource
+    'group' and from the group snapshot.
     """
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
-    role = iam_resource.Role(d_spec['RoleName'])
-
-    # check if role should not exist
-    if account_name not in trusting_accounts or ensure_absent(d_spec):
-        try:
-            role.load()
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchEntity':
-                return
-            else:
-                raise e
-        except:
-            raise
-        # delete delegation role
-        log.info("Deleting role '%s' from account '%s'" %
-                (d_spec['RoleName'], account_name))
+    for policy_name in policy_names:
+        log.info("Deleting obsolete policy '%s' from group '%s' in "
+                "account '%s'." % (policy_name, group.name, auth_account))
         if args['--exec']:
-            for p in list(role.attached_policies.all()):
-                role.detach_policy(PolicyArn=p.arn)
-            role.delete()
-        return
+            group.Policy(policy_name).delete()
+            set_group_policy(deployed_group, policy_name, None)
 
-    # else: assemble assume role policy document for delegation role
+
+def set_group_policy(deployed_group, policy_name, policy_doc):
+    """
+    Record inline policy 'policy_name' of a deployed group in the snapshot,
+    so later delegations for the same group count it.  A 'policy_doc' of
+    None removes the policy.
+    """
+    policy_list = [p for p in deployed_group.get('GroupPolicyList', [])
+            if p['PolicyName'] != policy_name]
+    if policy_doc is not None:
+        policy_list.append(dict(PolicyName=policy_name,
+                PolicyDocument=json.loads(policy_doc)))
+    deployed_group['GroupPolicyList'] = policy_list
+
+
+def set_attached_group_policy(deployed_group, policy_name, policy_arn):
+    """
+    Record managed policy 'policy_name' as attached to a deployed group in
+    the snapshot.  A 'policy_arn' of None records it as detached.
+    """
+    attached = [p for p in deployed_group.get('AttachedManagedPolicies', [])
+            if p['PolicyName'] != policy_name]
+    if policy_arn is not None:
+        attached.append(dict(PolicyName=policy_name, PolicyArn=policy_arn))
+    deployed_group['AttachedManagedPolicies'] = attached
+
+
+def delegation_trust_policy(auth_spec, d_spec):
+    """
+    Return the assume role policy document for a delegation role as a
+    json string.
+    """
     principal = "arn:aws:iam::%s:root" % auth_spec['auth_account_id']
     statement = dict(
             Effect='Allow',
@@ -539,80 +1082,116 @@ def manage_delegation_role(credentials, args, log, deployed,
     if mfa:
         statement['Condition'] = {
                 'Bool':{'aws:MultiFactorAuthPresent':'true'}}
-    policy_doc = json.dumps(dict(
+    return json.dumps(dict(
             Version='2012-10-17', Statement=[statement]))
 
-    # get iam role object.  create role if it does not exist (i.e. won't load)
-    try:
-        role.load()
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchEntity':
-            log.info("Creating role '%s' in account '%s'" %
-                    (d_spec['RoleName'], account_name))
-            if args['--exec']:
-                iam_client.create_role(
-                        Description=d_spec['Description'],
-                        Path=munge_path(auth_spec['default_path'], d_spec),
-                        RoleName=d_spec['RoleName'],
-                        AssumeRolePolicyDocument=policy_doc)
-                if 'Policies' in d_spec and d_spec['Policies']:
-                    role.load()
-                    for policy_name in d_spec['Policies']:
-                        policy_arn = get_policy_arn(iam_client, policy_name,
-                                args, log, auth_spec)
-                        log.info("Attaching policy '%s' to role '%s' "
-                                "in account '%s'" %
-                                (policy_name, d_spec['RoleName'], account_name))
-                        if args['--exec'] and policy_arn:
-                            role.attach_policy(PolicyArn=policy_arn)
-                return
-            else:
-                return
-        else:
-            raise e
-    except:
-        raise
+
+def scan_account_roles(iam_client, details):
+    """
+    Return a ResourceIndex of IAM roles deployed in an account.  Role
+    descriptions come from list_roles(), as authorization details do
+    not include them.  Managed policy attachments are taken from
+    'details', as returned by scan_authorization_details().
+    """
+    roles = ResourceIndex(paginate(iam_client, 'list_roles'),
+            name_key='RoleName', id_key='RoleId')
+    for role in roles:
+        detail = details['roles'].lookup('RoleName', role['RoleName'])
+        role['AttachedManagedPolicies'] = (
+                detail['AttachedManagedPolicies'] if detail else [])
+    return roles
+
+
+def manage_delegation_role(iam_client, args, log, auth_spec, account_name,
+        deployed_roles, local_policies, trusting_accounts, d_spec, policy_doc):
+    """
+    Create and manage a cross account access delegetion role in an
+    account based on delegetion specification.  'deployed_roles' is
+    the ResourceIndex of roles in the account from scan_account_roles().
+    'local_policies' is the index of customer managed policies from
+    scan_authorization_details().
+    'policy_doc' is the assume role policy document for the role.
+    """
+    role = deployed_roles.lookup('RoleName', d_spec['RoleName'])
+
+    # check if role should not exist
+    if account_name not in trusting_accounts or ensure_absent(d_spec):
+        if not role:
+            return
+        # delete delegation role
+        log.info("Deleting role '%s' from account '%s'" %
+                (d_spec['RoleName'], account_name))
+        if args['--exec']:
+            for p in role['AttachedManagedPolicies']:
+                iam_client.detach_role_policy(RoleName=d_spec['RoleName'],
+                        PolicyArn=p['PolicyArn'])
+            iam_client.delete_role(RoleName=d_spec['RoleName'])
+        return
+
+    # create role if it does not exist
+    if not role:
+        log.info("Creating role '%s' in account '%s'" %
+                (d_spec['RoleName'], account_name))
+        if args['--exec']:
+            iam_client.create_role(
+                    Description=d_spec['Description'],
+                    Path=munge_path(auth_spec['default_path'], d_spec),
+                    RoleName=d_spec['RoleName'],
+                    AssumeRolePolicyDocument=policy_doc)
+            if 'Policies' in d_spec and d_spec['Policies']:
+                for policy_name in d_spec['Policies']:
+                    policy_arn = get_policy_arn(iam_client, policy_name,
+                            args, log, auth_spec, local_policies)
+                    log.info("Attaching policy '%s' to role '%s' "
+                            "in account '%s'" %
+                            (policy_name, d_spec['RoleName'], account_name))
+                    if policy_arn:
+                        iam_client.attach_role_policy(
+                                RoleName=d_spec['RoleName'],
+                                PolicyArn=policy_arn)
+        return
 
     # update delegation role if needed
-    if json.dumps(role.assume_role_policy_document) != policy_doc:
+    if (normalize_policy_document(role['AssumeRolePolicyDocument'])
+            != normalize_policy_document(policy_doc)):
         log.info("Updating policy document in role '%s' in account '%s'" %
                 (d_spec['RoleName'], account_name))
         if args['--exec']:
             iam_client.update_assume_role_policy(
-                RoleName=role.role_name,
+                RoleName=d_spec['RoleName'],
                 PolicyDocument=policy_doc)
-    if role.description != d_spec['Description']:
+    if role.get('Description') != d_spec['Description']:
         log.info("Updating description in role '%s' in account '%s'" %
                 (d_spec['RoleName'], account_name))
         if args['--exec']:
             iam_client.update_role_description(
-                RoleName=role.role_name,
+                RoleName=d_spec['RoleName'],
                 Description=d_spec['Description'])
 
     # manage policy attachments
-    attached_policies = [p.policy_name for p
-            in list(role.attached_policies.all())]
+    attached_policies = dict((p['PolicyName'], p['PolicyArn'])
+            for p in role['AttachedManagedPolicies'])
     for policy_name in d_spec['Policies']:
         # attach missing policies
         if not policy_name in attached_policies:
             policy_arn = get_policy_arn(iam_client, policy_name, args,
-                    log, auth_spec)
+                    log, auth_spec, local_policies)
             log.info("Attaching policy '%s' to role '%s' in account '%s'" %
                     (policy_name, d_spec['RoleName'], account_name))
             if args['--exec'] and policy_arn:
-                role.attach_policy(PolicyArn=policy_arn)
+                iam_client.attach_role_policy(RoleName=d_spec['RoleName'],
+                        PolicyArn=policy_arn)
         elif lookup(auth_spec['custom_policies'], 'PolicyName',policy_name):
             policy_arn = get_policy_arn(iam_client, policy_name, args,
-                    log, auth_spec)
-    for policy_name in attached_policies:
+                    log, auth_spec, local_policies)
+    for policy_name in sorted(attached_policies):
         # datach obsolete policies
         if not policy_name in d_spec['Policies']:
-            policy_arn = get_policy_arn(iam_client, policy_name, args,
-                    log, auth_spec)
             log.info("Detaching policy '%s' from role '%s' in account '%s'" %
                     (policy_name, d_spec['RoleName'], account_name))
-            if args['--exec'] and policy_arn:
-                role.detach_policy(PolicyArn=policy_arn)
+            if args['--exec']:
+                iam_client.detach_role_policy(RoleName=d_spec['RoleName'],
+                        PolicyArn=attached_policies[policy_name])
 
 
 def manage_delegations(args, log, deployed, auth_spec):
@@ -620,11 +1199,18 @@ def manage_delegations(args, log, deployed, auth_spec):
     Create and manage cross account access delegations based on 
     delegation specifications.  Manages delegation roles in 
     trusting accounts and group policies in Auth (trusted) account.
+    Each account is visited once for all delegations: its role is
+    assumed and its IAM roles listed once, then every delegation is
+    reconciled against that listing.  Accounts are processed
+    concurrently.  Returns dict of lists of failed delegations keyed
+    by account name.  Delegations whose trusted group could not be
+    updated are listed under the Auth account.
     """
+    delegations = []
     for d_spec in auth_spec['delegations']:
         if d_spec['RoleName'] == auth_spec['org_access_role']:
             log.error("Refusing to manage delegation '%s'" % d_spec['RoleName'])
-            return
+            break
 
         # munge trusting_accounts list
         if d_spec['TrustingAccount'] == 'ALL':
@@ -637,52 +1223,111 @@ def manage_delegations(args, log, deployed, auth_spec):
 
         # 
         for account_name in trusting_accounts:
-            if not lookup(deployed['accounts'], 'Name', account_name):
+            if not deployed['accounts'].lookup('Name', account_name):
                 log.error("Can not manage delegation role '%s' in account "
                         "'%s'.  Account '%s' not found in Org" %
                         (d_spec['RoleName'], account_name, account_name))
+        delegations.append((d_spec, trusting_accounts,
+                delegation_trust_policy(auth_spec, d_spec)))
 
-        # process roles in trusting accounts
-        for account in deployed['accounts']:
-            credentials = get_assume_role_credentials(
-                    account['Id'],
-                    auth_spec['org_access_role'])
-            manage_delegation_role(credentials, args, log, deployed, auth_spec,
-                    account['Name'], trusting_accounts, d_spec)
-        # process groups in Auth account
-        set_group_assume_role_policies(args, log, deployed, auth_spec,
-                trusting_accounts, d_spec)
+    # process roles in trusting accounts
+    failures = {}
+    def manage_account(account_log, account):
+        credentials = get_assume_role_credentials(
+                account['Id'],
+                auth_spec['org_access_role'])
+        iam_client = get_client('iam', **credentials)
+        details = scan_authorization_details(iam_client,
+                ['Role', 'LocalManagedPolicy'])
+        deployed_roles = scan_account_roles(iam_client, details)
+        local_policies = details['policies']
+        for d_spec, trusting_accounts, policy_doc in delegations:
+            try:
+                manage_delegation_role(iam_client, args, account_log,
+                        auth_spec, account['Name'], deployed_roles,
+                        local_policies, trusting_accounts, d_spec, policy_doc)
+            except Exception as e:
+                account_log.error("Failed to manage delegation role '%s' in "
+                        "account '%s': %s" % (d_spec['RoleName'],
+                        account['Name'], e))
+                failures.setdefault(account['Name'], []).append(
+                        d_spec['RoleName'])
+    for account_name in run_in_accounts(log, deployed['accounts'],
+            manage_account, int(args['--concurrency'])):
+        failures[account_name] = [d[0]['RoleName'] for d in delegations]
+
+    # process groups in Auth account
+    auth_account = deployed['accounts'].lookup('Id',
+            auth_spec['auth_account_id'], 'Name')
+    for d_spec, trusting_accounts, policy_doc in delegations:
+        try:
+            updated = set_group_assume_role_policies(args, log, deployed,
+                    auth_spec, trusting_accounts, d_spec)
+        except Exception as e:
+            log.error("Failed to manage assume role policies for delegation "
+                    "role '%s' in group '%s': %s" % (d_spec['RoleName'],
+                    d_spec['TrustedGroup'], e))
+            updated = False
+        if not updated:
+            failed_roles = failures.setdefault(auth_account, [])
+            if d_spec['RoleName'] not in failed_roles:
+                failed_roles.append(d_spec['RoleName'])
+    return failures
 
 
 def main():
     args = docopt(__doc__)
     log = get_logger(args)
+    write_metrics_on_exit(log, args)
+    set_client_concurrency(args)
     log.debug("%s: args:\n%s" % (__name__, args))
     auth_spec = validate_spec_file(log, args['--spec-file'], 'auth_spec')
-    org_client = boto3.client('organizations')
+    org_client = get_client('organizations')
     validate_master_id(org_client, auth_spec)
     credentials = get_assume_role_credentials(
             auth_spec['auth_account_id'],
             auth_spec['org_access_role'])
-    iam_client = boto3.client('iam', **credentials)
-    deployed = dict(
-            users = iam_client.list_users()['Users'],
-            groups = iam_client.list_groups()['Groups'],
+    iam_client = get_client('iam', **credentials)
+    details = scan_authorization_details(iam_client,
+            ['User', 'Group', 'LocalManagedPolicy'])
+    deployed = DeployedOrg(
+            users = details['users'],
+            groups = details['groups'],
+            local_policies = details['policies'],
             accounts = scan_deployed_accounts(log, org_client))
 
     if args['report']:
         display_provisioned_users(log, deployed)
-        display_provisioned_groups(credentials, log, deployed)
+        display_provisioned_groups(log, deployed)
         display_roles_in_accounts(log, deployed, auth_spec)
 
     if args['users']:
-        create_users(credentials, args, log, deployed, auth_spec)
-        create_groups(credentials, args, log, deployed, auth_spec)
-        manage_group_members(credentials, args, log, deployed, auth_spec)
-        manage_group_policies(credentials, args, log, deployed, auth_spec)
+        created_users = {}
+        deleted_users = {}
+        created_groups = {}
+        operations = plan_users(iam_client, args, log, deployed, auth_spec,
+                created_users, deleted_users)
+        operations += plan_groups(iam_client, log, deployed, auth_spec,
+                created_groups, deleted_users)
+        operations += plan_group_members(iam_client, log, deployed, auth_spec,
+                created_users, created_groups, deleted_users)
+        operations += plan_group_policies(iam_client, args, log, deployed,
+                auth_spec, created_groups)
+        if args['--exec']:
+            failed = execute_operations(log, operations,
+                    int(args['--concurrency']))
+            if failed:
+                log.critical("%s of %s changes to users and groups failed" %
+                        (len(failed), len(operations)))
+                sys.exit(1)
 
     if args['delegation']:
-        manage_delegations(args, log, deployed, auth_spec)
+        failures = manage_delegations(args, log, deployed, auth_spec)
+        if failures:
+            for account_name in sorted(failures):
+                log.error("Failed delegations in account '%s': %s" %
+                        (account_name, ', '.join(failures[account_name])))
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -5,7 +5,10 @@
 
 Usage:
   awsorgs report [-d] [--boto-log]
+                 [--metrics-file FILE [--metrics-format FORMAT]]
   awsorgs organization (--spec-file FILE) [--exec] [-vd] [--boto-log]
+                       [--metrics-file FILE [--metrics-format FORMAT]]
+                       [--concurrency N]
   awsorgs --version
   awsorgs --help
 
@@ -18,9 +21,12 @@ Options:
   --version                  Display version info and exit.
   -s FILE, --spec-file FILE  AWS Org specification file in yaml format.
   --exec                     Execute proposed changes to AWS Org.
+  -c N, --concurrency N      Number of changes to make at once [default: 8].
   -v, --verbose              Log to activity to STDOUT at log level INFO.
   -d, --debug                Increase log level to 'DEBUG'. Implies '--verbose'.
   --boto-log                 Include botocore and boto3 logs in log stream.
+  --metrics-file FILE        Write API call metrics to FILE at exit.
+  --metrics-format FORMAT    Metrics file format: 'json' or 'prom' [default: json].
 
 """
 
@@ -28,6 +34,7 @@ Options:
 import yaml
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from docopt import docopt
@@ -79,7 +86,7 @@ def get_parent_id(org_client, account_id):
     Query deployed AWS organanization for 'account_id. Return the 'Id' of
     the parent OrganizationalUnit or 'None'.
     """
-    parents = org_client.list_parents(ChildId=account_id)['Parents']
+    parents = list(paginate(org_client, 'list_parents', ChildId=account_id))
     try:
         len(parents) == 1
         return parents[0]['Id']
@@ -88,14 +95,15 @@ def get_parent_id(org_client, account_id):
                 % (account_id, parents))
 
 
-def list_policies_in_ou (org_client, ou_id):
+def list_policies_in_ou(deployed, ou_id):
     """
-    Query deployed AWS organanization.  Return a list (of type dict)
-    of policies attached to OrganizationalUnit referenced by 'ou_id'.
+    Return a sorted list of names of policies attached to the
+    OrganizationalUnit referenced by 'ou_id'.  Reads from the policy
+    attachment index built by scan_policy_targets().
     """
-    policies_in_ou = org_client.list_policies_for_target(
-            TargetId=ou_id, Filter='SERVICE_CONTROL_POLICY',)['Policies']
-    return sorted([ou['Name'] for ou in policies_in_ou])
+    return sorted([deployed['policies'].lookup('Id', policy_id, 'Name')
+            for policy_id in deployed.target_policies.get(ou_id, set())
+            if deployed['policies'].lookup('Id', policy_id)])
 
 
 def scan_deployed_accounts(log, org_client):
@@ -104,14 +112,8 @@ def scan_deployed_accounts(log, org_client):
     Returns a list of dictionary.
     """
     log.debug('running')
-    accounts = org_client.list_accounts()
-    deployed_accounts = accounts['Accounts']
-    while 'NextToken' in accounts and accounts['NextToken']:
-        log.debug("NextToken: %s" % accounts['NextToken'])
-        accounts = org_client.list_accounts(NextToken=accounts['NextToken'])
-        deployed_accounts += accounts['Accounts']
     # only return accounts that have an 'Name' key
-    return [d for d in deployed_accounts if 'Name' in d ]
+    return [d for d in paginate(org_client, 'list_accounts') if 'Name' in d]
 
 
 def scan_created_accounts(org_client):
@@ -119,57 +121,97 @@ def scan_created_accounts(org_client):
     Query AWS Organization for accounts with creation status of 'SUCCEEDED'.
     Returns a list of dictionary.
     """
-    status = org_client.list_create_account_status(
-            States=['SUCCEEDED'])
-    created_accounts = status['CreateAccountStatuses']
-    while 'NextToken' in status and status['NextToken']:
-        status = org_client.list_create_account_status(
-                States=['SUCCEEDED'],
-                NextToken=status['NextToken'])
-        created_accounts += status['CreateAccountStatuses']
-    return created_accounts
+    return list(paginate(org_client, 'list_create_account_status',
+            States=['SUCCEEDED']))
 
 
-def scan_deployed_policies(org_client):
+def scan_deployed_policies(org_client, policy_content, max_workers=MAX_WORKERS):
     """
-    Return list of Service Control Policies deployed in Organization
+    Return list of Service Control Policies deployed in Organization.
+    Content of every policy not already in cache 'policy_content' is
+    fetched concurrently and added to the cache.
     """
-    return org_client.list_policies(Filter='SERVICE_CONTROL_POLICY')['Policies']
+    policies = list(paginate(org_client, 'list_policies',
+            Filter='SERVICE_CONTROL_POLICY'))
+    policy_ids = [p['Id'] for p in policies if p['Id'] not in policy_content]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        contents = executor.map(lambda policy_id: org_client.describe_policy(
+                PolicyId=policy_id)['Policy']['Content'], policy_ids)
+        for policy_id, content in zip(policy_ids, contents):
+            policy_content.add(policy_id, content)
+    return policies
+
+
+def list_ou_children(org_client, parent_id, child_type):
+    """
+    Query deployed AWS Organization for all children of type 'child_type'
+    ('OrganizationalUnits' or 'Accounts') under 'parent_id'.  Returns a
+    list of dictionary.
+    """
+    if child_type == 'OrganizationalUnits':
+        operation = 'list_organizational_units_for_parent'
+    else:
+        operation = 'list_accounts_for_parent'
+    return list(paginate(org_client, operation, ParentId=parent_id))
 
 
-def scan_deployed_ou(org_client, root_id):
+def list_policy_targets(org_client, policy_id):
     """
-    Recursively traverse deployed AWS Organization.  Return list of
-    organizational unit dictionaries.  
+    Query deployed AWS Organization for all targets Service Control
+    Policy 'policy_id' is attached to.  Returns a list of target Ids.
     """
-    def build_deployed_ou_table(org_client, parent_name, parent_id, deployed_ou):
-        # recusive sub function to build the 'deployed_ou' table
-        child_ou = org_client.list_organizational_units_for_parent(
-                ParentId=parent_id)['OrganizationalUnits']
-        accounts = org_client.list_accounts_for_parent(
-                ParentId=parent_id)['Accounts']
-        if not deployed_ou:
-            deployed_ou.append(dict(
-                    Name = parent_name,
-                    Id = parent_id,
-                    Child_OU = [ou['Name'] for ou in child_ou if 'Name' in ou],
-                    Accounts = [acc['Name'] for acc in accounts if 'Name' in acc]))
-        else:
-            for ou in deployed_ou:
-                if ou['Name'] == parent_name:
-                    ou['Child_OU'] = [d['Name'] for d in child_ou]
-                    ou['Accounts'] = [d['Name'] for d in accounts]
-        for ou in child_ou:
-            ou['ParentId'] = parent_id
-            deployed_ou.append(ou)
-            build_deployed_ou_table(org_client, ou['Name'], ou['Id'], deployed_ou)
-    # build the table 
-    deployed_ou = []
-    build_deployed_ou_table(org_client, 'root', root_id, deployed_ou)
+    return [t['TargetId'] for t in
+            paginate(org_client, 'list_targets_for_policy', PolicyId=policy_id)]
+
+
+def scan_policy_targets(org_client, deployed, max_workers=MAX_WORKERS):
+    """
+    Build the policy attachment index in 'deployed'.  Targets of every
+    deployed Service Control Policy are queried concurrently.  There are
+    far fewer policies than OUs, so this is cheaper than asking each OU
+    for its policies.
+    """
+    policy_ids = [p['Id'] for p in deployed['policies']]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        targets = executor.map(lambda policy_id:
+                list_policy_targets(org_client, policy_id), policy_ids)
+        for policy_id, target_ids in zip(policy_ids, targets):
+            deployed.set_policy_targets(policy_id, target_ids)
+
+
+def scan_deployed_ou(org_client, root_id, max_workers=MAX_WORKERS):
+    """
+    Traverse deployed AWS Organization one level at a time.  Children of
+    every OU in a level are queried concurrently on a pool of at most
+    'max_workers' threads.  Return list of organizational unit dictionaries.
+    Each lists the names and Ids of the accounts it contains.
+    """
+    root = dict(Name='root', Id=root_id)
+    deployed_ou = [root]
+    level = [root]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while level:
+            ou_futures = [executor.submit(list_ou_children, org_client,
+                    ou['Id'], 'OrganizationalUnits') for ou in level]
+            account_futures = [executor.submit(list_ou_children, org_client,
+                    ou['Id'], 'Accounts') for ou in level]
+            next_level = []
+            for ou, ou_future, account_future in zip(level, ou_futures,
+                    account_futures):
+                children = ou_future.result()
+                ou['Child_OU'] = [d['Name'] for d in children if 'Name' in d]
+                child_accounts = account_future.result()
+                ou['Accounts'] = [d['Name'] for d in child_accounts if 'Name' in d]
+                ou['AccountIds'] = [d['Id'] for d in child_accounts]
+                for child in children:
+                    child['ParentId'] = ou['Id']
+                    next_level.append(child)
+            deployed_ou += next_level
+            level = next_level
     return deployed_ou
 
 
-def display_provisioned_policies(org_client, log, deployed):
+def display_provisioned_policies(log, deployed):
     """
     Print report of currently deployed Service Control Policies in
     AWS Organization.
@@ -182,25 +224,24 @@ def display_provisioned_policies(org_client, log, deployed):
         log.info("Description:\t%s" % policy['Description'])
         log.info("Id:\t%s" % policy['Id'])
         log.info("Content:")
-        log.info(json.dumps(json.loads(org_client.describe_policy(
-                PolicyId=policy['Id'])['Policy']['Content']),
+        log.info(json.dumps(deployed.policy_content.get(policy['Id'])['Document'],
                 indent=2,
                 separators=(',', ': ')))
 
 
-def display_provisioned_ou(org_client, log, deployed_ou, parent_name, indent=0):
+def display_provisioned_ou(log, deployed, parent_name, indent=0):
     """
     Recursive function to display the deployed AWS Organization structure.
     """
     # query aws for child orgs
-    parent_id = lookup(deployed_ou, 'Name', parent_name, 'Id')
-    child_ou_list = lookup(deployed_ou, 'Name', parent_name, 'Child_OU')
-    child_accounts = lookup(deployed_ou, 'Name', parent_name, 'Accounts')
+    parent_id = deployed['ou'].lookup('Name', parent_name, 'Id')
+    child_ou_list = deployed['ou'].lookup('Name', parent_name, 'Child_OU')
+    child_accounts = deployed['ou'].lookup('Name', parent_name, 'Accounts')
     # display parent ou name
     tab = '  '
     log.info(tab*indent + parent_name + ':')
     # look for policies
-    policy_names = list_policies_in_ou(org_client, parent_id)
+    policy_names = list_policies_in_ou(deployed, parent_id)
     if len(policy_names) > 0:
         log.info(tab*indent + tab + 'Policies: ' + ', '.join(policy_names))
     # look for accounts
@@ -213,47 +254,105 @@ def display_provisioned_ou(org_client, log, deployed_ou, parent_name, indent=0):
         indent+=2
         for ou_name in child_ou_list:
             # recurse
-            display_provisioned_ou(org_client, log, deployed_ou, ou_name, indent)
+            display_provisioned_ou(log, deployed, ou_name, indent)
+
+
+def create_ou(org_client, deployed, parent_id, name, default_policy_id):
+    """
+    Create OrganizationalUnit 'name' under 'parent_id'.  Return its Id.
+    Organizations attaches the default policy 'default_policy_id' to
+    every new OU, so it is recorded as attached.
+    """
+    new_ou = org_client.create_organizational_unit(
+            ParentId=parent_id, Name=name)['OrganizationalUnit']
+    deployed.add_ou(new_ou, parent_id)
+    if default_policy_id:
+        deployed.attach_policy(default_policy_id, new_ou['Id'])
+    return new_ou['Id']
+
+
+def delete_ou(org_client, deployed, ou_id):
+    """
+    Delete OrganizationalUnit 'ou_id'.
+    """
+    org_client.delete_organizational_unit(OrganizationalUnitId=ou_id)
+    deployed.remove_ou(ou_id)
+
+
+def attach_policy(org_client, deployed, policy_id, target_id):
+    """
+    Attach Service Control Policy 'policy_id' to 'target_id'.
+    """
+    org_client.attach_policy(PolicyId=policy_id, TargetId=target_id)
+    deployed.attach_policy(policy_id, target_id)
+
+
+def detach_policy(org_client, deployed, policy_id, target_id):
+    """
+    Detach Service Control Policy 'policy_id' from 'target_id'.
+    """
+    org_client.detach_policy(PolicyId=policy_id, TargetId=target_id)
+    deployed.detach_policy(policy_id, target_id)
+
+
+def move_account(org_client, deployed, account_id, source_parent_id,
+        dest_parent_id):
+    """
+    Move account 'account_id' from 'source_parent_id' to 'dest_parent_id'.
+    """
+    org_client.move_account(
+            AccountId=account_id,
+            SourceParentId=source_parent_id,
+            DestinationParentId=dest_parent_id)
+    deployed.move_account(account_id, dest_parent_id)
 
 
-def manage_account_moves(org_client, args, log, deployed, ou_spec, dest_parent_id):
+def plan_account_moves(org_client, log, deployed, ou_spec, dest_parent):
     """
-    Alter deployed AWS Organization.  Ensure accounts are contained
-    by designated OrganizationalUnits based on OU specification.
+    Plan changes to deployed AWS Organization.  Ensure accounts are
+    contained by designated OrganizationalUnits based on OU specification.
+    'dest_parent' is the Id of the deployed OU or the Operation which
+    creates it.  Return list of Operations.
     """
+    operations = []
     if 'Accounts' in ou_spec and ou_spec['Accounts']:
         for account in ou_spec['Accounts']:
-            account_id = lookup(deployed['accounts'], 'Name', account, 'Id')
+            account_id = deployed['accounts'].lookup('Name', account, 'Id')
             if not account_id:
                 log.warn("Account '%s' not yet in Organization" % account)
             else:
-                source_parent_id = get_parent_id(org_client, account_id)
-                if dest_parent_id != source_parent_id:
-                    log.info("Moving account '%s' to OU '%s'" %
+                source_parent_id = (deployed.account_parent.get(account_id)
+                        or get_parent_id(org_client, account_id))
+                if dest_parent != source_parent_id:
+                    description = ("Moving account '%s' to OU '%s'" %
                             (account, ou_spec['Name']))
-                    if args['--exec']:
-                        org_client.move_account(
-                                AccountId=account_id,
-                                SourceParentId=source_parent_id,
-                                DestinationParentId=dest_parent_id)
+                    log.info(description)
+                    operations.append(Operation(description, move_account,
+                            (org_client, deployed, account_id,
+                            source_parent_id, dest_parent)))
+    return operations
 
 
-def place_unmanged_accounts(org_client, args, log, deployed, account_list, dest_parent):
+def plan_unmanaged_account_moves(org_client, log, deployed, account_list,
+        dest_name, dest_parent):
     """
-    Move any unmanaged accounts into the default OU.
+    Plan moves of any unmanaged accounts into the default OU.
+    'dest_parent' is the Id of the default OU, the Operation which
+    creates it, or None.  Return list of Operations.
     """
+    operations = []
     for account in account_list:
-        account_id = lookup(deployed['accounts'], 'Name', account, 'Id')
-        dest_parent_id   = lookup(deployed['ou'], 'Name', dest_parent, 'Id')
-        source_parent_id = get_parent_id(org_client, account_id)
-        if dest_parent_id and dest_parent_id != source_parent_id:
-            log.info("Moving unmanged account '%s' to default OU '%s'" %
-                    (account, dest_parent))
-            if args['--exec']:
-                org_client.move_account(
-                        AccountId=account_id,
-                        SourceParentId=source_parent_id,
-                        DestinationParentId=dest_parent_id)
+        account_id = deployed['accounts'].lookup('Name', account, 'Id')
+        source_parent_id = (deployed.account_parent.get(account_id)
+                or get_parent_id(org_client, account_id))
+        if dest_parent and dest_parent != source_parent_id:
+            description = ("Moving unmanged account '%s' to default OU '%s'" %
+                    (account, dest_name))
+            log.info(description)
+            operations.append(Operation(description, move_account,
+                    (org_client, deployed, account_id, source_parent_id,
+                    dest_parent)))
+    return operations
 
 
 def manage_policies(org_client, args, log, deployed, org_spec):
@@ -268,17 +367,18 @@ def manage_policies(org_client, args, log, deployed, org_spec):
         # dont touch default policy
         if policy_name == org_spec['default_policy']:
             continue
-        policy = lookup(deployed['policies'], 'Name', policy_name)
+        policy = deployed['policies'].lookup('Name', policy_name)
         # delete existing sc_policy
         if ensure_absent(p_spec):
             if policy:
                 log.info("Deleting policy '%s'" % (policy_name))
                 # dont delete attached policy
-                if org_client.list_targets_for_policy( PolicyId=policy_id)['Targets']:
+                if deployed.policy_targets.get(policy['Id']):
                     log.error("Cannot delete policy '%s'. Still attached to OU" %
                             policy_name)
                 elif args['--exec']:
                     org_client.delete_policy(PolicyId=policy['Id'])
+                    deployed['policies'].remove(policy)
             continue
         # create or update sc_policy
         statement = dict(Effect=p_spec['Effect'], Action=p_spec['Actions'], Resource='*')
@@ -288,33 +388,42 @@ def manage_policies(org_client, args, log, deployed, org_spec):
         if not policy:
             log.info("Creating policy '%s'" % policy_name)
             if args['--exec']:
-                org_client.create_policy(
+                new_policy = org_client.create_policy(
                         Content=policy_doc,
                         Description=p_spec['Description'],
                         Name=p_spec['Name'],
-                        Type='SERVICE_CONTROL_POLICY')
+                        Type='SERVICE_CONTROL_POLICY')['Policy']
+                deployed.policy_content.add(new_policy['PolicySummary']['Id'],
+                        new_policy['Content'])
         # check for policy updates
         else:
-            deployed_policy_doc = json.dumps(json.loads(org_client.describe_policy(
-                    PolicyId=policy['Id'])['Policy']['Content']))
-            log.debug("real sc_policy_doc: %s" % deployed_policy_doc)
+            deployed_policy = deployed.policy_content.get(policy['Id'])
+            log.debug("real sc_policy_doc: %s" % deployed_policy['Normalized'])
             if (p_spec['Description'] != policy['Description']
-                or policy_doc != deployed_policy_doc):
+                or policy_document_hash(policy_doc) != deployed_policy['Hash']):
                 log.info("Updating policy '%s'" % policy_name)
                 if args['--exec']:
                     org_client.update_policy(
                             PolicyId=policy['Id'],
                             Content=policy_doc,
                             Description=p_spec['Description'],)
+                    deployed.policy_content.add(policy['Id'], policy_doc)
 
 
-def manage_policy_attachments(org_client, args, log, deployed, org_spec, ou_spec, ou_id):
+def plan_policy_attachments(org_client, log, deployed, org_spec, ou_spec,
+        target):
     """
-    Attach or detach specified Service Control Policy to a deployed 
-    OrganizatinalUnit.  Do not detach the default policy ever.
+    Plan attachment or detachment of specified Service Control Policies
+    to an OrganizatinalUnit.  'target' is the Id of the deployed OU or
+    the Operation which creates it.  Do not detach the default policy
+    ever.  Return list of Operations.
     """
     # create lists policies_to_attach and policies_to_detach
-    attached_policy_list = list_policies_in_ou(org_client, ou_id)
+    if isinstance(target, Operation):
+        # the default policy is attached to new OUs by Organizations
+        attached_policy_list = [org_spec['default_policy']]
+    else:
+        attached_policy_list = list_policies_in_ou(deployed, target)
     if 'SC_Policies' in ou_spec and isinstance(ou_spec['SC_Policies'], list):
         spec_policy_list = ou_spec['SC_Policies']
     else:
@@ -324,87 +433,121 @@ def manage_policy_attachments(org_client, args, log, deployed, org_spec, ou_spec
     policies_to_detach = [p for p in attached_policy_list
             if p not in spec_policy_list
             and p != org_spec['default_policy']]
+    operations = []
     # attach policies
     for policy_name in policies_to_attach:
-        if not lookup(deployed['policies'],'Name',policy_name):
+        if not deployed['policies'].lookup('Name', policy_name):
             raise RuntimeError("spec-file: ou_spec: policy '%s' not defined" %
                     policy_name)
         if not ensure_absent(ou_spec):
-            log.info("Attaching policy '%s' to OU '%s'" % (policy_name, ou_spec['Name']))
-            if args['--exec']:
-                org_client.attach_policy(
-                        PolicyId=lookup(deployed['policies'], 'Name', policy_name, 'Id'),
-                        TargetId=ou_id)
+            description = ("Attaching policy '%s' to OU '%s'" %
+                    (policy_name, ou_spec['Name']))
+            log.info(description)
+            operations.append(Operation(description, attach_policy,
+                    (org_client, deployed,
+                    deployed['policies'].lookup('Name', policy_name, 'Id'),
+                    target)))
     # detach policies
     for policy_name in policies_to_detach:
-        log.info("Detaching policy '%s' from OU '%s'" % (policy_name, ou_spec['Name']))
-        if args['--exec']:
-            org_client.detach_policy(
-                    PolicyId=lookup(deployed['policies'], 'Name', policy_name, 'Id'),
-                    TargetId=ou_id)
-
-
-def manage_ou(org_client, args, log, deployed, org_spec, ou_spec_list, parent_name):
+        description = ("Detaching policy '%s' from OU '%s'" %
+                (policy_name, ou_spec['Name']))
+        log.info(description)
+        operations.append(Operation(description, detach_policy,
+                (org_client, deployed,
+                deployed['policies'].lookup('Name', policy_name, 'Id'),
+                target)))
+    return operations
+
+
+def plan_ou_changes(org_client, log, deployed, org_spec, ou_spec_list,
+        parent_name, parent, created_ou):
     """
-    Recursive function to manage OrganizationalUnits in the AWS
-    Organization.
+    Recursive function to plan changes to OrganizationalUnits in the AWS
+    Organization.  'parent' is the Id of the deployed parent OU or the
+    Operation which creates it.  Operations which create OUs are
+    recorded by name in dict 'created_ou'.  Return list of Operations.
+    Each Operation requires only the Operations it depends on: an OU is
+    created after its parent, attachments and account moves after the
+    OU, and an OU is deleted after its child OUs.
     """
+    operations = []
     for ou_spec in ou_spec_list:
         # ou exists
-        ou = lookup(deployed['ou'], 'Name', ou_spec['Name'])
+        ou = deployed['ou'].lookup('Name', ou_spec['Name'])
         if ou:
-            # check for child_ou. recurse before other tasks.
+            # check for child_ou. plan these before other tasks.
+            child_operations = []
             if 'Child_OU' in ou_spec:
-                manage_ou(org_client, args, log, deployed, org_spec,
-                        ou_spec['Child_OU'], ou_spec['Name'])
+                child_operations = plan_ou_changes(org_client, log, deployed,
+                        org_spec, ou_spec['Child_OU'], ou_spec['Name'],
+                        ou['Id'], created_ou)
+                operations += child_operations
             # check if ou 'absent'
             if ensure_absent(ou_spec):
                 log.info("Deleting OU %s" % ou_spec['Name'])
-                # error if ou contains anything
+                # error if ou contains anything not being deleted
+                child_deletes = [op for op in child_operations
+                        if op.func is delete_ou]
+                deleted = [deployed['ou'].lookup('Id', op.args[2], 'Name')
+                        for op in child_deletes]
+                contents = dict(
+                        Accounts=ou.get('Accounts'),
+                        Child_OU=[name for name in ou.get('Child_OU', [])
+                                if name not in deleted])
                 error_flag = False
-                for key in ['Accounts', 'SC_Policies', 'Child_OU']:
-                    if key in ou and ou[key]:
+                for key in ['Accounts', 'Child_OU']:
+                    if contents[key]:
                         log.error("Can not delete OU '%s'. deployed '%s' exists." %
                                 (ou_spec['Name'], key))
                         error_flag = True
-                if error_flag:
-                    continue
-                elif args['--exec']:
-                    org_client.delete_organizational_unit(
-                            OrganizationalUnitId=ou['Id'])
+                if not error_flag:
+                    operations.append(Operation(
+                            "Deleting OU %s" % ou_spec['Name'], delete_ou,
+                            (org_client, deployed, ou['Id']),
+                            requires=child_deletes))
             # manage account and sc_policy placement in OU
             else:
-                manage_policy_attachments(org_client, args, log,
+                operations += plan_policy_attachments(org_client, log,
                         deployed, org_spec, ou_spec, ou['Id'])
-                manage_account_moves(org_client, args, log, deployed, ou_spec, ou['Id'])
+                operations += plan_account_moves(org_client, log, deployed,
+                        ou_spec, ou['Id'])
         # create new OU
         elif not ensure_absent(ou_spec):
-            log.info("Creating new OU '%s' under parent '%s'" %
+            description = ("Creating new OU '%s' under parent '%s'" %
                     (ou_spec['Name'], parent_name))
-            if args['--exec']:
-                new_ou = org_client.create_organizational_unit(
-                        ParentId=lookup(deployed['ou'],'Name',parent_name,'Id'),
-                        Name=ou_spec['Name'])['OrganizationalUnit']
-                # account and sc_policy placement
-                manage_policy_attachments(org_client, args, log,
-                        deployed, org_spec, ou_spec, new_ou['Id'])
-                manage_account_moves(org_client, args, log, deployed, ou_spec, new_ou['Id'])
-                # recurse if child OU
-                if ('Child_OU' in ou_spec and isinstance(new_ou, dict)
-                        and 'Id' in new_ou):
-                    manage_ou(org_client, args, log, deployed, org_spec,
-                            ou_spec['Child_OU'], new_ou['Name'])
+            log.info(description)
+            new_ou = Operation(description, create_ou,
+                    (org_client, deployed, parent, ou_spec['Name'],
+                    deployed['policies'].lookup('Name',
+                            org_spec['default_policy'], 'Id')))
+            created_ou[ou_spec['Name']] = new_ou
+            operations.append(new_ou)
+            # account and sc_policy placement
+            operations += plan_policy_attachments(org_client, log,
+                    deployed, org_spec, ou_spec, new_ou)
+            operations += plan_account_moves(org_client, log, deployed,
+                    ou_spec, new_ou)
+            # recurse if child OU
+            if 'Child_OU' in ou_spec:
+                operations += plan_ou_changes(org_client, log, deployed,
+                        org_spec, ou_spec['Child_OU'], ou_spec['Name'],
+                        new_ou, created_ou)
+    return operations
 
 
 def main():
     args = docopt(__doc__, version='awsorgs 0.0.0')
     log = get_logger(args)
-    org_client = boto3.client('organizations')
+    write_metrics_on_exit(log, args)
+    set_client_concurrency(args)
+    org_client = get_client('organizations')
     root_id = get_root_id(org_client)
-    deployed = dict(
-            policies = scan_deployed_policies(org_client),
+    deployed = DeployedOrg(
             accounts = scan_deployed_accounts(log, org_client),
             ou = scan_deployed_ou(org_client, root_id))
+    deployed['policies'] = scan_deployed_policies(org_client,
+            deployed.policy_content)
+    scan_policy_targets(org_client, deployed)
 
     if args['--spec-file']:
         org_spec = validate_spec_file(log, args['--spec-file'], 'org_spec')
@@ -423,25 +566,38 @@ def main():
         header = 'Provisioned Organizational Units in Org:'
         overbar = '_' * len(header)
         log.info("\n%s\n%s" % (overbar, header))
-        display_provisioned_ou(org_client, log, deployed['ou'], 'root')
-        display_provisioned_policies(org_client, log, deployed)
+        display_provisioned_ou(log, deployed, 'root')
+        display_provisioned_policies(log, deployed)
 
     if args['organization']:
         enable_policy_type_in_root(org_client, root_id)
         manage_policies(org_client, args, log, deployed, org_spec)
         # rescan deployed policies
-        deployed['policies'] = scan_deployed_policies(org_client)
-        manage_ou(org_client, args, log, deployed, org_spec,
-                org_spec['organizational_units'], 'root')
+        deployed['policies'] = scan_deployed_policies(org_client,
+                deployed.policy_content)
+        created_ou = {}
+        operations = plan_ou_changes(org_client, log, deployed, org_spec,
+                org_spec['organizational_units'], 'root', root_id, created_ou)
         # check for unmanaged resources
         for key in list(managed.keys()):
-            unmanaged= [a['Name'] for a in deployed[key] if a['Name'] not in managed[key]]
+            unmanaged = sorted(deployed[key].names() - set(managed[key]))
             if unmanaged:
                 log.warn("Unmanaged %s in Organization: %s" % (key,', '.join(unmanaged)))
                 if key ==  'accounts':
                     # append unmanaged accounts to default_ou
-                    place_unmanged_accounts(org_client, args, log, deployed,
-                            unmanaged, org_spec['default_ou'])
+                    default_ou = (deployed['ou'].lookup(
+                            'Name', org_spec['default_ou'], 'Id')
+                            or created_ou.get(org_spec['default_ou']))
+                    operations += plan_unmanaged_account_moves(org_client, log,
+                            deployed, unmanaged, org_spec['default_ou'],
+                            default_ou)
+        if args['--exec']:
+            failed = execute_operations(log, operations,
+                    int(args['--concurrency']))
+            if failed:
+                log.critical("%s of %s changes to Organization failed" %
+                        (len(failed), len(operations)))
+                sys.exit(1)
 
 
 if __name__ == "__main__":
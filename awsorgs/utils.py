@@ -2,12 +2,92 @@
 
 import os
 import sys
+import json
+import time
+import atexit
+import hashlib
+import calendar
+import threading
 import pkg_resources
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
 
 import boto3
+import botocore.config
 import yaml
 import logging
 
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+
+# Upper bound on concurrent API requests made by any one thread pool.
+MAX_WORKERS = 8
+
+# Requests per second allowed by the process-wide rate limiters, keyed
+# by service and operation class.  Limiters back off from these rates
+# when AWS throttles requests and recover as requests succeed.
+RATE_LIMITS = {
+    'organizations': dict(read=10, write=5),
+    'iam': dict(read=20, write=10),
+    'sts': dict(read=20, write=20),
+}
+DEFAULT_RATE_LIMIT = dict(read=10, write=5)
+
+# Error codes AWS returns when a request is throttled.
+THROTTLE_ERRORS = [
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'SlowDown',
+]
+
+# Upper bounds in seconds of the API call latency histogram buckets.
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Items requested per page by paginate().  None uses the service default.
+PAGE_SIZE = None
+
+# Number of credential sets, roughly accounts, whose clients are kept
+# open by the ClientPool.
+MAX_POOLED_CREDENTIALS = 64
+
+# Refresh cached sts credentials this many seconds before they expire.
+CREDENTIAL_REFRESH_MARGIN = 300
+
+# Seconds the AWS managed policy index is reused from disk.  Set with
+# environment variable AWSORGS_POLICY_CACHE_TTL.  0 disables the disk copy.
+AWS_POLICY_CACHE_TTL = int(os.environ.get('AWSORGS_POLICY_CACHE_TTL', 86400))
+
+# Maximum total size in characters of all inline policies on an IAM group.
+GROUP_POLICY_MAX_SIZE = 5120
+
+# Maximum size in characters of a customer managed policy document.
+MANAGED_POLICY_MAX_SIZE = 6144
+
+# Spec validation pattern file, installed with the package.
+VALIDATION_PATTERN_FILE = 'data/spec-validation-patterns.yaml'
+
+# Yaml loader for spec files.  Uses the libyaml based loader if available.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Botocore retry config for every client made by get_client().  The
+# connection pool is sized again by set_client_concurrency().
+CLIENT_CONFIG = botocore.config.Config(
+        retries=dict(mode='adaptive', max_attempts=10),
+        max_pool_connections=MAX_WORKERS * 2)
+
 def lookup(dlist, lkey, lvalue, rkey=None):
     """
     Use a known key:value pair to lookup a dictionary in a list of
@@ -23,6 +103,10 @@ def lookup(dlist, lkey, lvalue, rkey=None):
     items = [d for d in dlist
              if lkey in d
              and d[lkey] == lvalue]
+    return _lookup_result(items, rkey)
+
+
+def _lookup_result(items, rkey):
     if not items:
         return None
     if len(items) > 1:
@@ -36,6 +120,438 @@ def lookup(dlist, lkey, lvalue, rkey=None):
     return items[0]
 
 
+class ResourceIndex(list):
+    """
+    A list of resource dictionaries with hash indexes on a name key and
+    an id key.  lookup() on an indexed key runs in constant time.  Use
+    append(), extend() and remove() to modify the list so the indexes
+    stay current.
+    """
+
+    def __init__(self, items=(), name_key='Name', id_key='Id'):
+        list.__init__(self)
+        self.name_key = name_key
+        self.id_key = id_key
+        self._index = {name_key: {}, id_key: {}}
+        self.extend(items)
+
+    def append(self, item):
+        list.append(self, item)
+        for key, index in self._index.items():
+            if key in item:
+                index.setdefault(item[key], []).append(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def remove(self, item):
+        list.remove(self, item)
+        for key, index in self._index.items():
+            if key in item and item[key] in index:
+                index[item[key]] = [d for d in index[item[key]] if d is not item]
+                if not index[item[key]]:
+                    del index[item[key]]
+
+    def lookup(self, lkey, lvalue, rkey=None):
+        """
+        Same as utils.lookup() with this index as 'dlist'.
+        """
+        if lkey in self._index:
+            items = self._index[lkey].get(lvalue, [])
+        else:
+            items = [d for d in self if lkey in d and d[lkey] == lvalue]
+        return _lookup_result(items, rkey)
+
+    def names(self):
+        """
+        Return set of values of the name key.
+        """
+        return set(self._index[self.name_key])
+
+    def ids(self):
+        """
+        Return set of values of the id key.
+        """
+        return set(self._index[self.id_key])
+
+
+# Policy statement elements which take a string or a list of strings.
+POLICY_LIST_ELEMENTS = ['Action', 'NotAction', 'Resource', 'NotResource']
+
+def _canonical_values(value):
+    # a string or list of values as a sorted list of unique strings
+    if not isinstance(value, list):
+        value = [value]
+    values = set()
+    for v in value:
+        if isinstance(v, bool):
+            v = str(v).lower()
+        elif not isinstance(v, str):
+            v = str(v)
+        values.add(v)
+    return sorted(values)
+
+
+def _canonical_principal(principal):
+    if not isinstance(principal, dict):
+        return principal
+    canonical = {}
+    for key, value in principal.items():
+        value = _canonical_values(value)
+        if key == 'AWS':
+            # IAM stores a bare account Id as the arn of the account root
+            value = sorted(set("arn:aws:iam::%s:root" % v
+                    if v.isdigit() and len(v) == 12 else v for v in value))
+        canonical[key] = value
+    return canonical
+
+
+def _canonical_statement(statement):
+    statement = dict(statement)
+    for key in POLICY_LIST_ELEMENTS:
+        if key in statement:
+            statement[key] = _canonical_values(statement[key])
+    for key in ['Principal', 'NotPrincipal']:
+        if key in statement:
+            statement[key] = _canonical_principal(statement[key])
+    if 'Condition' in statement:
+        statement['Condition'] = dict(
+                (operator, dict((k, _canonical_values(v))
+                        for k, v in condition.items()))
+                for operator, condition in statement['Condition'].items())
+    return statement
+
+
+def normalize_policy_document(document):
+    """
+    Return IAM or Service Control Policy 'document' (a dict, a json
+    string or a url-encoded json string) in canonical form: compact json
+    with sorted keys, single values as lists, lists sorted and Statements
+    in sorted order.  Documents which differ only in ways IAM and
+    Organizations ignore normalize to the same string.
+    """
+    if not isinstance(document, dict):
+        document = document.strip()
+        if not document.startswith('{'):
+            document = unquote(document)
+        document = json.loads(document)
+    document = dict(document)
+    if 'Statement' in document:
+        statements = document['Statement']
+        if not isinstance(statements, list):
+            statements = [statements]
+        statements = [_canonical_statement(s) for s in statements]
+        document['Statement'] = sorted(statements,
+                key=lambda s: json.dumps(s, sort_keys=True))
+    return json.dumps(document, sort_keys=True, separators=(',', ':'))
+
+
+def policy_document_hash(document):
+    """
+    Return sha256 hex digest of the canonical form of a policy document.
+    """
+    return hashlib.sha256(
+            normalize_policy_document(document).encode('utf-8')).hexdigest()
+
+
+class PolicyContentCache(object):
+    """
+    Cache of policy document content keyed by policy Id and by sha256
+    hash of the content.  Each distinct document is parsed and normalized
+    once.  get() returns a dict with keys 'Content' (as fetched),
+    'Document' (parsed), 'Normalized' and 'Hash' (of the normalized
+    document).
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.documents = {}
+
+    def __contains__(self, policy_id):
+        return policy_id in self.hashes
+
+    def add(self, policy_id, content):
+        """
+        Record 'content' as the current content of policy 'policy_id'.
+        """
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        if content_hash not in self.documents:
+            document = json.loads(content)
+            normalized = normalize_policy_document(document)
+            self.documents[content_hash] = dict(
+                    Content=content,
+                    Document=document,
+                    Normalized=normalized,
+                    Hash=hashlib.sha256(normalized.encode('utf-8')).hexdigest())
+        self.hashes[policy_id] = content_hash
+        return self.documents[content_hash]
+
+    def get(self, policy_id):
+        return self.documents[self.hashes[policy_id]]
+
+
+class DeployedOrg(dict):
+    """
+    In-memory model of deployed AWS Organization resources.  Maps resource
+    type ('accounts', 'ou', 'policies', 'users', 'groups',
+    'local_policies') to a ResourceIndex.  Also maps each organizational
+    unit Id to the Id of its parent and to the Ids of its child OUs, and
+    each account Id to the Id of its parent.  Service Control Policy
+    attachments are indexed both ways, policy Id to target Ids and target
+    Id to policy Ids.  Policy content is held in a PolicyContentCache.
+    """
+
+    INDEX_KEYS = dict(
+            accounts=('Name', 'Id'),
+            ou=('Name', 'Id'),
+            policies=('Name', 'Id'),
+            users=('UserName', 'UserId'),
+            groups=('GroupName', 'GroupId'),
+            local_policies=('PolicyName', 'PolicyId'))
+
+    def __init__(self, **resources):
+        dict.__init__(self)
+        self.lock = threading.RLock()
+        self.ou_parent = {}
+        self.ou_children = {}
+        self.account_parent = {}
+        self.policy_targets = {}
+        self.target_policies = {}
+        self.policy_content = PolicyContentCache()
+        for key, items in resources.items():
+            self[key] = items
+
+    def __setitem__(self, key, items):
+        name_key, id_key = self.INDEX_KEYS[key]
+        dict.__setitem__(self, key, ResourceIndex(items, name_key, id_key))
+        if key == 'ou':
+            self.ou_parent = {}
+            self.ou_children = {}
+            self.account_parent = {}
+            for ou in self['ou']:
+                self._map_ou(ou)
+
+    def _map_ou(self, ou):
+        self.ou_children.setdefault(ou['Id'], [])
+        if 'ParentId' in ou:
+            self.ou_parent[ou['Id']] = ou['ParentId']
+            self.ou_children.setdefault(ou['ParentId'], []).append(ou['Id'])
+        for account_id in ou.get('AccountIds', []):
+            self.account_parent[account_id] = ou['Id']
+
+    def add_ou(self, ou, parent_id):
+        """
+        Record a newly created organizational unit under 'parent_id'.
+        """
+        with self.lock:
+            self._add_ou(ou, parent_id)
+
+    def _add_ou(self, ou, parent_id):
+        ou['ParentId'] = parent_id
+        ou.setdefault('Child_OU', [])
+        ou.setdefault('Accounts', [])
+        ou.setdefault('AccountIds', [])
+        self['ou'].append(ou)
+        self._map_ou(ou)
+        parent = self['ou'].lookup('Id', parent_id)
+        if parent is not None:
+            parent.setdefault('Child_OU', []).append(ou['Name'])
+
+    def move_account(self, account_id, parent_id):
+        """
+        Record that account 'account_id' now lives under 'parent_id'.
+        """
+        with self.lock:
+            self._move_account(account_id, parent_id)
+
+    def _move_account(self, account_id, parent_id):
+        name = self['accounts'].lookup('Id', account_id, 'Name')
+        source = self['ou'].lookup('Id', self.account_parent.get(account_id))
+        if source is not None:
+            source['AccountIds'].remove(account_id)
+            if name in source['Accounts']:
+                source['Accounts'].remove(name)
+        dest = self['ou'].lookup('Id', parent_id)
+        if dest is not None:
+            dest['AccountIds'].append(account_id)
+            if name:
+                dest['Accounts'].append(name)
+        self.account_parent[account_id] = parent_id
+
+    def set_policy_targets(self, policy_id, target_ids):
+        """
+        Record the full set of targets policy 'policy_id' is attached to.
+        """
+        for target_id in self.policy_targets.get(policy_id, set()):
+            self.target_policies[target_id].discard(policy_id)
+        self.policy_targets[policy_id] = set()
+        for target_id in target_ids:
+            self.attach_policy(policy_id, target_id)
+
+    def attach_policy(self, policy_id, target_id):
+        """
+        Record that policy 'policy_id' is attached to 'target_id'.
+        """
+        with self.lock:
+            self.policy_targets.setdefault(policy_id, set()).add(target_id)
+            self.target_policies.setdefault(target_id, set()).add(policy_id)
+
+    def detach_policy(self, policy_id, target_id):
+        """
+        Record that policy 'policy_id' is no longer attached to 'target_id'.
+        """
+        with self.lock:
+            self.policy_targets.get(policy_id, set()).discard(target_id)
+            self.target_policies.get(target_id, set()).discard(policy_id)
+
+    def remove_ou(self, ou_id):
+        """
+        Record that organizational unit 'ou_id' has been deleted.
+        """
+        with self.lock:
+            ou = self['ou'].lookup('Id', ou_id)
+            parent = self['ou'].lookup('Id', self.ou_parent.pop(ou_id, None))
+            if parent is not None:
+                self.ou_children[parent['Id']].remove(ou_id)
+                if ou['Name'] in parent['Child_OU']:
+                    parent['Child_OU'].remove(ou['Name'])
+            self.ou_children.pop(ou_id, None)
+            for policy_id in self.target_policies.pop(ou_id, set()):
+                self.policy_targets[policy_id].discard(ou_id)
+            self['ou'].remove(ou)
+
+
+class Operation(object):
+    """
+    A planned change to deployed resources.  When run, calls
+    func(*args), with any argument which is itself an Operation replaced
+    by that Operation's result.  An Operation runs only after every
+    Operation among its args and in 'requires' has completed.
+    """
+
+    def __init__(self, description, func, args=(), requires=()):
+        self.description = description
+        self.func = func
+        self.args = tuple(args)
+        self.requires = [a for a in self.args if isinstance(a, Operation)]
+        self.requires += [r for r in requires if r not in self.requires]
+        self.result = None
+        self.error = None
+
+    def run(self):
+        args = [a.result if isinstance(a, Operation) else a for a in self.args]
+        self.result = self.func(*args)
+        return self.result
+
+
+def execute_operations(log, operations, max_workers=MAX_WORKERS):
+    """
+    Run a list of planned Operations on a pool of at most 'max_workers'
+    threads.  Each Operation starts as soon as the Operations it requires
+    have completed, so independent changes run concurrently.  Operations
+    which require a failed Operation are skipped.  Requirements must be
+    members of 'operations'.  Return list of failed or skipped Operations.
+    """
+    waiting = {}
+    dependents = {}
+    for op in operations:
+        waiting[op] = len(op.requires)
+        for required in op.requires:
+            dependents.setdefault(required, []).append(op)
+    failed = []
+
+    def skip_dependents(op):
+        for dependent in dependents.get(op, []):
+            if dependent.error is None:
+                dependent.error = "required operation failed: %s" % op.description
+                log.error("Skipping: %s" % dependent.description)
+                failed.append(dependent)
+                skip_dependents(dependent)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        for op in operations:
+            if not waiting[op]:
+                running[executor.submit(op.run)] = op
+        while running:
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                op = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    op.error = e
+                    log.error("Failed: %s: %s" % (op.description, e))
+                    failed.append(op)
+                    skip_dependents(op)
+                    continue
+                for dependent in dependents.get(op, []):
+                    waiting[dependent] -= 1
+                    if not waiting[dependent] and dependent.error is None:
+                        running[executor.submit(dependent.run)] = dependent
+    return failed
+
+
+class BufferedLog(object):
+    """
+    Holds log messages from one unit of work run on a thread pool, so
+    they can be written out together when the work is done.  Provides
+    the logging.Logger methods used by awsorgs.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.records = []
+
+    def debug(self, msg):
+        self.records.append((logging.DEBUG, msg))
+
+    def info(self, msg):
+        self.records.append((logging.INFO, msg))
+
+    def warning(self, msg):
+        self.records.append((logging.WARNING, msg))
+
+    warn = warning
+
+    def error(self, msg):
+        self.records.append((logging.ERROR, msg))
+
+    def critical(self, msg):
+        self.records.append((logging.CRITICAL, msg))
+
+    def flush(self):
+        for level, msg in self.records:
+            self.log.log(level, msg)
+        self.records = []
+
+
+def run_in_accounts(log, accounts, func, max_workers=MAX_WORKERS):
+    """
+    Call func(account_log, account) for each account in 'accounts' on a
+    pool of at most 'max_workers' threads.  'account_log' is a
+    BufferedLog.  Each account's messages are logged together, in the
+    order of 'accounts'.  An exception in one account does not stop the
+    others.  Return dict of exceptions keyed by account name.
+    """
+    failures = {}
+
+    def run(account):
+        account_log = BufferedLog(log)
+        try:
+            func(account_log, account)
+        except Exception as e:
+            account_log.error("Failed in account '%s': %s" % (account['Name'], e))
+            failures[account['Name']] = e
+        return account_log
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for account_log in executor.map(run, accounts):
+            account_log.flush()
+    return failures
+
+
 def search_spec(spec, search_key, recurse_key):
     """
     Recursively scans spec structure and returns a list of values
@@ -99,11 +615,588 @@ def get_logger(args):
     return log
 
 
+class RateLimiter(object):
+    """
+    Token bucket limiting requests to 'rate' per second.  On throttling
+    the rate is halved, down to 'min_rate'.  Each successful request
+    raises it again by a twentieth of the initial rate.  Counts requests,
+    throttles and seconds spent waiting for a token.
+    """
+
+    def __init__(self, rate, min_rate=0.5):
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self.tokens = self.max_rate
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttles = 0
+        self.wait_time = 0.0
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.  Tokens are
+        reserved under the lock so waiting threads are served in order.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.max_rate,
+                    self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= 1
+            delay = 0
+            if self.tokens < 0:
+                delay = -self.tokens / self.rate
+            self.requests += 1
+            self.wait_time += delay
+        if delay:
+            time.sleep(delay)
+
+    def throttled(self):
+        with self.lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self):
+        return dict(
+                requests=self.requests,
+                throttles=self.throttles,
+                wait_time=self.wait_time,
+                rate=self.rate)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(service, operation):
+    """
+    Return the process-wide RateLimiter for the service and class
+    ('read' or 'write') of 'operation'.
+    """
+    if operation.startswith(('Get', 'List', 'Describe')):
+        op_class = 'read'
+    else:
+        op_class = 'write'
+    with _rate_limiters_lock:
+        if (service, op_class) not in _rate_limiters:
+            rate = RATE_LIMITS.get(service, DEFAULT_RATE_LIMIT)[op_class]
+            _rate_limiters[(service, op_class)] = RateLimiter(rate)
+        return _rate_limiters[(service, op_class)]
+
+
+def get_rate_limiter_stats():
+    """
+    Return dict of RateLimiter counters keyed by 'service.class'.
+    """
+    with _rate_limiters_lock:
+        return dict(('%s.%s' % key, limiter.stats())
+                for key, limiter in sorted(_rate_limiters.items()))
+
+
+def _rate_limit_request(service, event_name=None, **kwargs):
+    # called from 'before-send.<service_id>.<operation>' for each attempt,
+    # so retries take a token too.
+    get_rate_limiter(service, event_name.rsplit('.', 1)[1]).acquire()
+
+
+def _rate_limit_response(model, http_response=None, parsed=None, **kwargs):
+    if not parsed or 'Error' not in parsed:
+        get_rate_limiter(model.service_model.endpoint_prefix,
+                model.name).succeeded()
+
+
+def _rate_limit_retry(operation, response=None, **kwargs):
+    # called for each attempt.  response is (http_response, parsed) or None.
+    if response and response[1].get('Error', {}).get('Code') in THROTTLE_ERRORS:
+        get_rate_limiter(operation.service_model.endpoint_prefix,
+                operation.name).throttled()
+
+
+class ApiMetrics(object):
+    """
+    Per operation API call counters and latency histograms, collected
+    from botocore events on every client made by get_client().  Keyed
+    by 'service.OperationName'.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.operations = {}
+
+    def _operation(self, model):
+        key = '%s.%s' % (model.service_model.endpoint_prefix, model.name)
+        if key not in self.operations:
+            self.operations[key] = dict(
+                    calls=0, retries=0, throttles=0, errors=0,
+                    latency_sum=0.0,
+                    latency_buckets=[0] * (len(LATENCY_BUCKETS) + 1))
+        return self.operations[key]
+
+    def before_call(self, model, context=None, **kwargs):
+        if context is not None:
+            context['awsorgs_start'] = time.time()
+
+    def after_call(self, model, parsed=None, context=None, **kwargs):
+        latency = None
+        if context and 'awsorgs_start' in context:
+            latency = time.time() - context['awsorgs_start']
+        parsed = parsed or {}
+        with self.lock:
+            op = self._operation(model)
+            op['calls'] += 1
+            op['retries'] += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            if 'Error' in parsed:
+                op['errors'] += 1
+            if latency is not None:
+                op['latency_sum'] += latency
+                bucket = len([b for b in LATENCY_BUCKETS if latency > b])
+                op['latency_buckets'][bucket] += 1
+
+    def after_call_error(self, model, context=None, **kwargs):
+        with self.lock:
+            op = self._operation(model)
+            op['calls'] += 1
+            op['errors'] += 1
+
+    def needs_retry(self, operation, response=None, **kwargs):
+        if response and response[1].get('Error', {}).get('Code') in THROTTLE_ERRORS:
+            with self.lock:
+                self._operation(operation)['throttles'] += 1
+
+    def summary(self):
+        """
+        Return dict of all metrics suitable for json.dump().
+        """
+        with self.lock:
+            operations = {}
+            for key, op in sorted(self.operations.items()):
+                buckets = {}
+                count = 0
+                for bound, n in zip(LATENCY_BUCKETS + ['+Inf'], op['latency_buckets']):
+                    count += n
+                    buckets[str(bound)] = count
+                operations[key] = dict(
+                        calls=op['calls'],
+                        retries=op['retries'],
+                        throttles=op['throttles'],
+                        errors=op['errors'],
+                        latency=dict(sum=op['latency_sum'], count=count,
+                                buckets=buckets))
+        return dict(
+                elapsed=time.time() - self.start,
+                operations=operations,
+                rate_limiters=get_rate_limiter_stats())
+
+    def prometheus(self):
+        """
+        Return metrics in Prometheus text exposition format.
+        """
+        summary = self.summary()
+        lines = []
+        def metric(name, mtype, helptext):
+            lines.append('# HELP awsorgs_%s %s' % (name, helptext))
+            lines.append('# TYPE awsorgs_%s %s' % (name, mtype))
+        def labels(key):
+            return 'service="%s",operation="%s"' % tuple(key.split('.', 1))
+        for name, helptext in [
+                ('calls', 'API calls made.'),
+                ('retries', 'API call attempts retried by botocore.'),
+                ('throttles', 'API call attempts throttled by AWS.'),
+                ('errors', 'API calls which returned an error.')]:
+            metric('api_%s_total' % name, 'counter', helptext)
+            for key, op in sorted(summary['operations'].items()):
+                lines.append('awsorgs_api_%s_total{%s} %d' %
+                        (name, labels(key), op[name]))
+        metric('api_call_duration_seconds', 'histogram',
+                'API call latency including retries.')
+        for key, op in sorted(summary['operations'].items()):
+            for bound in LATENCY_BUCKETS + ['+Inf']:
+                lines.append('awsorgs_api_call_duration_seconds_bucket{%s,le="%s"} %d' %
+                        (labels(key), bound, op['latency']['buckets'][str(bound)]))
+            lines.append('awsorgs_api_call_duration_seconds_sum{%s} %f' %
+                    (labels(key), op['latency']['sum']))
+            lines.append('awsorgs_api_call_duration_seconds_count{%s} %d' %
+                    (labels(key), op['latency']['count']))
+        metric('rate_limiter_wait_seconds_total', 'counter',
+                'Seconds spent waiting on client side rate limiters.')
+        for key, limiter in sorted(summary['rate_limiters'].items()):
+            lines.append('awsorgs_rate_limiter_wait_seconds_total{service="%s",class="%s"} %f' %
+                    (tuple(key.split('.')) + (limiter['wait_time'],)))
+        metric('run_duration_seconds', 'gauge', 'Seconds since start of run.')
+        lines.append('awsorgs_run_duration_seconds %f' % summary['elapsed'])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename, metrics_format='json'):
+        """
+        Write metrics to 'filename' as json or, if 'metrics_format' is
+        'prom', as a Prometheus textfile.
+        """
+        if metrics_format == 'prom':
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=2, sort_keys=True) + '\n'
+        with open(filename, 'w') as f:
+            f.write(content)
+
+
+API_METRICS = ApiMetrics()
+
+
+def register_client_events(client):
+    """
+    Attach the rate limiter and metrics event handlers to a botocore client.
+    """
+    events = client.meta.events
+    events.register('before-send.*.*', partial(_rate_limit_request,
+            client.meta.service_model.endpoint_prefix))
+    events.register('before-call.*.*', API_METRICS.before_call)
+    events.register('after-call.*.*', _rate_limit_response)
+    events.register('after-call.*.*', API_METRICS.after_call)
+    events.register('after-call-error.*.*', API_METRICS.after_call_error)
+    events.register('needs-retry.*.*', _rate_limit_retry)
+    events.register('needs-retry.*.*', API_METRICS.needs_retry)
+
+
+def write_metrics_on_exit(log, args):
+    """
+    If '--metrics-file' is set, write API call metrics there when the
+    process exits.
+    """
+    if args.get('--metrics-file'):
+        metrics_format = args.get('--metrics-format') or 'json'
+        if metrics_format not in ('json', 'prom'):
+            log.critical("unknown metrics format '%s'" % metrics_format)
+            sys.exit(1)
+        atexit.register(API_METRICS.write, args['--metrics-file'],
+                metrics_format)
+
+
+class ClientPool(object):
+    """
+    Caches one client and resource per service and set of credentials,
+    so connection pools are opened only once per account.  All are made
+    from a single boto3 Session, which loads each service model once.
+    A Session per set of credentials would load the models again for
+    every account.  Clients are shared between threads.  boto3 resources
+    are not thread safe, so each thread gets its own.  Only the
+    'max_credentials' most recently used credential sets are kept.
+    """
+
+    def __init__(self, max_credentials=MAX_POOLED_CREDENTIALS):
+        self.lock = threading.Lock()
+        self.session = None
+        self.max_credentials = max_credentials
+        self.pools = OrderedDict()
+
+    def _pool(self, credentials):
+        # called with self.lock held
+        if self.session is None:
+            self.session = boto3.session.Session()
+        key = tuple(sorted(credentials.items()))
+        pool = self.pools.pop(key, None)
+        if pool is None:
+            pool = dict(clients={}, resources={})
+        self.pools[key] = pool
+        while len(self.pools) > self.max_credentials:
+            # evicted clients may still be in use.  leave them to be
+            # closed when garbage collected.
+            self.pools.popitem(last=False)
+        return pool
+
+    def client(self, service, **credentials):
+        with self.lock:
+            clients = self._pool(credentials)['clients']
+            if service not in clients:
+                clients[service] = self.session.client(
+                        service, config=CLIENT_CONFIG, **credentials)
+                register_client_events(clients[service])
+            return clients[service]
+
+    def resource(self, service, **credentials):
+        key = (service, threading.current_thread().ident)
+        with self.lock:
+            resources = self._pool(credentials)['resources']
+            if key not in resources:
+                resources[key] = self.session.resource(
+                        service, config=CLIENT_CONFIG, **credentials)
+                register_client_events(resources[key].meta.client)
+            return resources[key]
+
+    def close(self):
+        """
+        Close connection pools of every client and resource.
+        """
+        with self.lock:
+            for pool in self.pools.values():
+                clients = list(pool['clients'].values())
+                clients += [r.meta.client for r in pool['resources'].values()]
+                for client in clients:
+                    # client.close() is new in botocore 1.23
+                    if hasattr(client, 'close'):
+                        client.close()
+            self.session = None
+            self.pools.clear()
+
+
+CLIENT_POOL = ClientPool()
+atexit.register(CLIENT_POOL.close)
+
+
+def get_client(service, **credentials):
+    """
+    Return a boto3 client for 'service' from CLIENT_POOL.  Clients use
+    adaptive retries and share the process-wide RateLimiters.
+    'credentials' are passed to boto3.session.Session.client().
+    """
+    return CLIENT_POOL.client(service, **credentials)
+
+
+def get_resource(service, **credentials):
+    """
+    Return a boto3 service resource from CLIENT_POOL whose client is
+    made the same way as get_client().
+    """
+    return CLIENT_POOL.resource(service, **credentials)
+
+
+def set_client_concurrency(args):
+    """
+    Size the connection pool of clients made by get_client() for the
+    number of threads set with '--concurrency'.  Clients such as sts are
+    shared by every thread, and urllib3 discards connections beyond the
+    pool size.  Call before any client is made.
+    """
+    global CLIENT_CONFIG
+    if args.get('--concurrency'):
+        max_workers = max(MAX_WORKERS, int(args['--concurrency']))
+        CLIENT_CONFIG = CLIENT_CONFIG.merge(botocore.config.Config(
+                max_pool_connections=max_workers * 2))
+
+
+def paginate(client, operation, result_key=None, page_size=None, **kwargs):
+    """
+    Generator yielding each item returned by paginated client method
+    'operation' across all pages.  Pages are read only as items are
+    consumed, so callers may stop early or stream large listings.
+    'result_key' defaults to the result key of the botocore paginator.
+    'page_size' defaults to PAGE_SIZE.  kwargs are passed to the method.
+    """
+    paginator = client.get_paginator(operation)
+    if result_key is None:
+        result_key = paginator.result_keys[0].expression
+    config = {}
+    if page_size or PAGE_SIZE:
+        config['PageSize'] = page_size or PAGE_SIZE
+    for item in paginator.paginate(PaginationConfig=config, **kwargs).search(result_key):
+        yield item
+
+
+def get_cache_dir():
+    """
+    Return path of the directory where awsorgs keeps cache and state
+    files, creating it if needed.  Set with environment variable
+    AWSORGS_CACHE_DIR.  Defaults to '~/.awsorgs'.
+    """
+    cache_dir = os.environ.get('AWSORGS_CACHE_DIR',
+            os.path.expanduser('~/.awsorgs'))
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir, 0o700)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
+
+class CredentialCache(object):
+    """
+    Process-wide cache of sts assume_role credentials keyed by
+    (account_id, role_name, path).  Credentials are refreshed
+    CREDENTIAL_REFRESH_MARGIN seconds before they expire.
+
+    If environment variable AWSORGS_CREDENTIAL_CACHE_KEY holds a Fernet
+    key, credentials are also stored encrypted in the awsorgs cache
+    directory, so back to back runs reuse them.  This requires the
+    'cryptography' package.  Create a key with:
+      python -c 'from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())'
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.credentials = {}
+        self.caller_identity = None
+        self.fernet = None
+        self.filename = None
+
+    def get_caller_identity(self):
+        """
+        Return sts caller identity of the base credentials.  Queried
+        once per process.
+        """
+        with self.lock:
+            if self.caller_identity is None:
+                self.caller_identity = get_client('sts').get_caller_identity()
+                self._load()
+            return self.caller_identity
+
+    def _load(self):
+        key = os.environ.get('AWSORGS_CREDENTIAL_CACHE_KEY')
+        if not key:
+            return
+        if Fernet is None:
+            raise RuntimeError("AWSORGS_CREDENTIAL_CACHE_KEY is set but "
+                    "package 'cryptography' is not installed")
+        self.fernet = Fernet(key.encode())
+        # credentials on disk belong to the identity which assumed them
+        self.filename = os.path.join(get_cache_dir(), 'sts-credentials-%s' %
+                hashlib.sha256(self.caller_identity['Arn'].encode()).hexdigest()[:16])
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'rb') as f:
+                cached = json.loads(self.fernet.decrypt(f.read()).decode())
+        except (InvalidToken, ValueError):
+            # wrong key or damaged file.  start over.
+            return
+        for key, credentials in cached:
+            if not self._expiring(credentials):
+                self.credentials[tuple(key)] = credentials
+
+    def _save(self):
+        if self.fernet is None:
+            return
+        with self.lock:
+            data = json.dumps([[list(key), credentials]
+                    for key, credentials in self.credentials.items()])
+            tmp_file = self.filename + '.tmp'
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.fernet.encrypt(data.encode()))
+            os.rename(tmp_file, self.filename)
+
+    @staticmethod
+    def _expiring(credentials):
+        return credentials['Expiration'] - CREDENTIAL_REFRESH_MARGIN < time.time()
+
+    def get(self, key, assume_role):
+        """
+        Return cached credentials for 'key'.  If missing or about to
+        expire, call 'assume_role' for new sts Credentials.  Concurrent
+        callers for the same key wait for a single assume_role call.
+        """
+        self.get_caller_identity()
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            credentials = self.credentials.get(key)
+            if credentials is None or self._expiring(credentials):
+                response = assume_role()
+                credentials = dict(
+                        AccessKeyId=response['AccessKeyId'],
+                        SecretAccessKey=response['SecretAccessKey'],
+                        SessionToken=response['SessionToken'],
+                        Expiration=calendar.timegm(
+                                response['Expiration'].utctimetuple()))
+                # _save() iterates the credentials holding self.lock
+                with self.lock:
+                    self.credentials[key] = credentials
+                self._save()
+            return credentials
+
+
+CREDENTIAL_CACHE = CredentialCache()
+
+
+class AwsPolicyIndex(object):
+    """
+    Index of AWS managed IAM policy names to Arns.  These are the same in
+    every account of a partition, so the index is built once per run and
+    partition from a full listing in the first account asked.  The index
+    is also saved in the awsorgs cache directory and reused by later runs
+    for AWS_POLICY_CACHE_TTL seconds.  A name missing from an index read
+    from disk causes one rebuild, as the policy may be newer than the
+    disk copy, unless lookup() is told not to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arns = {}
+        self.from_disk = set()
+
+    def _filename(self, partition):
+        return os.path.join(get_cache_dir(),
+                'aws-managed-policies-%s.json' % partition)
+
+    def _load(self, partition):
+        if not AWS_POLICY_CACHE_TTL:
+            return None
+        try:
+            with open(self._filename(partition)) as f:
+                cached = json.load(f)
+        except (OSError, IOError, ValueError):
+            return None
+        if cached['Timestamp'] + AWS_POLICY_CACHE_TTL < time.time():
+            return None
+        return cached['Arns']
+
+    def _save(self, partition):
+        if not AWS_POLICY_CACHE_TTL:
+            return
+        try:
+            tmp_file = self._filename(partition) + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(dict(Timestamp=time.time(),
+                        Arns=self.arns[partition]), f)
+            os.rename(tmp_file, self._filename(partition))
+        except (OSError, IOError):
+            # the disk copy is only an optimization
+            pass
+
+    def _build(self, iam_client, partition):
+        self.arns[partition] = dict((p['PolicyName'], p['Arn']) for p in
+                paginate(iam_client, 'list_policies', Scope='AWS',
+                        page_size=1000))
+        self.from_disk.discard(partition)
+        self._save(partition)
+
+    def lookup(self, iam_client, policy_name, rebuild_on_miss=True):
+        """
+        Return the Arn of AWS managed policy 'policy_name' or None.
+        'iam_client' is used to build the index for its partition if
+        needed.  Set 'rebuild_on_miss' False for names not expected to
+        be AWS managed policies.
+        """
+        partition = iam_client.meta.partition
+        with self.lock:
+            if partition not in self.arns:
+                arns = self._load(partition)
+                if arns is None:
+                    self._build(iam_client, partition)
+                else:
+                    self.arns[partition] = arns
+                    self.from_disk.add(partition)
+            if (rebuild_on_miss and policy_name not in self.arns[partition]
+                    and partition in self.from_disk):
+                self._build(iam_client, partition)
+            return self.arns[partition].get(policy_name)
+
+
+AWS_POLICY_INDEX = AwsPolicyIndex()
+
+
 def get_root_id(org_client):
     """
     Query deployed AWS Organization for its Root ID.
     """
-    roots = org_client.list_roots()['Roots']
+    roots = list(paginate(org_client, 'list_roots'))
     if len(roots) >1:
         raise RuntimeError("org_client.list_roots returned multiple roots.")
     return roots[0]['Id']
@@ -124,98 +1217,180 @@ def validate_master_id(org_client, spec):
 
 def validate_spec_file(log, spec_file, pattern_name):
     """
-    Validate spec-file is properly formed.
+    Validate spec-file is properly formed.  All syntax errors in the
+    spec are reported before exiting.
     """
     log.debug("loading spec file '%s'" % spec_file)
-    validation_patterns = load_validation_patterns(log)
+    validators = load_spec_validators(log)
     with open(spec_file) as f:
-        spec = yaml.load(f.read())
-    log.debug("calling validate_spec() for pattern '%s'" % pattern_name)
-    if validate_spec(log, validation_patterns, pattern_name, spec):
-        return spec
-    else:
-        log.critical("Spec file '%s' failed syntax validation" % spec_file)
+        spec = yaml.load(f.read(), Loader=YAML_LOADER)
+    log.debug("validating spec file against pattern '%s'" % pattern_name)
+    errors = []
+    warnings = []
+    validators[pattern_name](spec, pattern_name, errors, warnings)
+    for message in warnings:
+        log.warn(message)
+    for message in errors:
+        log.error(message)
+    if errors:
+        log.critical("Spec file '%s' failed syntax validation with %d errors" %
+                (spec_file, len(errors)))
         sys.exit(1)
+    return spec
 
 
-# QUESTION: I'm loading a data file by name.  It is part of the project and
-# explicitly installed by setup.py.  but in code, should I define it as
-# a constant insted of just loading a str? where should I declare this 
-# constant?
 def load_validation_patterns(log):
     """
     Return dict of patterns for use when validating specification syntax
     """
-    PATTERN_FILE = 'data/spec-validation-patterns.yaml'
-    log.debug("loading file: '%s'" % PATTERN_FILE)
-    filename =  os.path.abspath(pkg_resources.resource_filename(__name__, PATTERN_FILE))
-            #__name__, '../data/spec-validation-patterns.yaml'))
-    with open(filename) as f:
-        return yaml.load(f.read())
-
-
-def validate_spec(log, validation_patterns, pattern_name, spec):
-    """
-    Validate syntax of a given 'spec' dictionary against the
-    named spec_pattern.
-    """
-    pattern = validation_patterns[pattern_name]
-    valid_spec = True
-    # test for required attributes
-    required_attributes = [attr for attr in pattern if pattern[attr]['required']]
-    for attr in required_attributes:
-        if attr not in spec:
-            log.error("Required attribute '%s' not found in '%s' spec. Context: %s" %
-                    (attr, pattern_name, spec))
-            valid_spec = False
-    for attr in spec:
-        log.debug("  considering attribute '%s'" % attr)
-        # test if attribute is permitted
-        if attr not in pattern:
-            log.warn("Attribute '%s' does not exist in validation pattern '%s'" %
-                    (attr, pattern_name))
-            continue
-        # handle recursive patterns
-        if 'spec_pattern' in pattern[attr]:
-            pattern_name = pattern[attr]['spec_pattern']
-            if not isinstance(spec[attr], list):
-                log.error("Attribute '%s' must be a list of '%s' specs.  Context: %s" %
-                        (attr, pattern_name, spec))
-                valid_spec = False
-                continue
-            for sub_spec in spec[attr]:
-                log.debug("calling validate_spec() for pattern '%s'" % pattern_name)
-                log.debug("context: %s" % sub_spec)
-                if not validate_spec(log, validation_patterns, pattern_name, sub_spec):
-                    valid_spec = False
-        # test attribute type. ignore attr if value is None
-        elif spec[attr]:
-            spec_attr_type = spec[attr].__class__.__name__
-            log.debug("    spec attribute object type: '%s'" % (spec_attr_type))
-            # simple attribute pattern
-            if isinstance(pattern[attr]['atype'], str):
-                if spec_attr_type != pattern[attr]['atype']:
-                    log.error("Attribute '%s' must be of type '%s'" %
-                            (attr, pattern[attr]['atype']))
-                    valid_spec = False
-                    continue
+    log.debug("loading file: '%s'" % VALIDATION_PATTERN_FILE)
+    with open(_validation_pattern_filename()) as f:
+        return yaml.load(f.read(), Loader=YAML_LOADER)
+
+
+def _validation_pattern_filename():
+    return os.path.abspath(pkg_resources.resource_filename(__name__,
+            VALIDATION_PATTERN_FILE))
+
+
+def compile_validation_patterns(validation_patterns):
+    """
+    Reduce validation patterns to plain tables keyed by pattern name.
+    Each table lists the 'required' attributes and maps each permitted
+    attribute to either its 'spec_pattern' or the allowed 'types', with
+    the allowed values of each type or None.
+    """
+    tables = {}
+    for pattern_name, pattern in validation_patterns.items():
+        table = dict(required=[], attributes={})
+        for attr, rule in pattern.items():
+            if rule.get('required'):
+                table['required'].append(attr)
+            if 'spec_pattern' in rule:
+                table['attributes'][attr] = dict(spec_pattern=rule['spec_pattern'])
+            elif isinstance(rule['atype'], str):
+                table['attributes'][attr] = dict(types={rule['atype']: None})
             else:
-                # complex attribute pattern
-                valid_types = list(pattern[attr]['atype'].keys())
-                log.debug("    pattern attribute types: '%s'" % valid_types)
-                if not spec_attr_type in valid_types: 
-                    log.error("Attribute '%s' must be one of type '%s'" %
-                            (attr, valid_types))
-                    valid_spec = False
-                    continue
-                atype = pattern[attr]['atype'][spec_attr_type]
-                # test attributes values
-                if atype and 'values' in atype:
-                    log.debug("    allowed values for attribute '%s': %s" %
-                            (attr, atype['values']))
-                    if not spec[attr] in atype['values']:
-                        log.error("Value of attribute '%s' must be one of '%s'" %
-                                (attr, atype['values']))
-                        valid_spec = False
-                        continue
-    return valid_spec
+                table['attributes'][attr] = dict(types=dict(
+                        (atype, (values or {}).get('values'))
+                        for atype, values in rule['atype'].items()))
+        tables[pattern_name] = table
+    return tables
+
+
+def _attribute_validator(attr, rule, validators):
+    # return function validating the value of one spec attribute
+    if 'spec_pattern' in rule:
+        sub_pattern = rule['spec_pattern']
+
+        def validate(value, context, errors, warnings):
+            if not isinstance(value, list):
+                errors.append("%s: Attribute '%s' must be a list of '%s' specs" %
+                        (context, attr, sub_pattern))
+                return
+            validate_sub_spec = validators[sub_pattern]
+            for n, sub_spec in enumerate(value):
+                validate_sub_spec(sub_spec, '%s.%s[%d]' % (context, attr, n),
+                        errors, warnings)
+        return validate
+
+    types = rule['types']
+    if len(types) == 1:
+        type_message = "Attribute '%s' must be of type '%s'" % (attr, list(types)[0])
+    else:
+        type_message = "Attribute '%s' must be one of type '%s'" % (attr, sorted(types))
+
+    def validate(value, context, errors, warnings):
+        # ignore attr if value is None
+        if not value:
+            return
+        values = types.get(value.__class__.__name__, False)
+        if values is False:
+            errors.append("%s: %s" % (context, type_message))
+        elif values is not None and value not in values:
+            errors.append("%s: Value of attribute '%s' must be one of '%s'" %
+                    (context, attr, values))
+    return validate
+
+
+def _pattern_validator(pattern_name, table, validators):
+    # return function validating a spec against one pattern
+    required = table['required']
+    attributes = dict((attr, _attribute_validator(attr, rule, validators))
+            for attr, rule in table['attributes'].items())
+
+    def validate(spec, context, errors, warnings):
+        if not isinstance(spec, dict):
+            errors.append("%s: Must be a '%s' spec" % (context, pattern_name))
+            return
+        for attr in required:
+            if attr not in spec:
+                errors.append("%s: Required attribute '%s' not found in '%s' spec" %
+                        (context, attr, pattern_name))
+        for attr, value in spec.items():
+            validate_attr = attributes.get(attr)
+            if validate_attr is None:
+                warnings.append("%s: Attribute '%s' does not exist in validation "
+                        "pattern '%s'" % (context, attr, pattern_name))
+            else:
+                validate_attr(value, context, errors, warnings)
+    return validate
+
+
+def build_spec_validators(tables):
+    """
+    Return dict of validator functions keyed by pattern name, built from
+    tables returned by compile_validation_patterns().  A validator is
+    called as validator(spec, context, errors, warnings) and appends a
+    message for each problem found to list 'errors' or 'warnings'.
+    'context' names the spec in messages.
+    """
+    validators = {}
+    for pattern_name, table in tables.items():
+        validators[pattern_name] = _pattern_validator(pattern_name, table,
+                validators)
+    return validators
+
+
+def load_spec_validators(log):
+    """
+    Return dict of spec validator functions keyed by pattern name for the
+    validation pattern file.  The compiled pattern tables are saved in the
+    awsorgs cache directory under the sha256 hash of the pattern file, so
+    the yaml is parsed only when the file changes.  The cache file is best
+    effort: if it can not be read or written the tables are compiled in
+    memory.
+    """
+    with open(_validation_pattern_filename(), 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if digest in SPEC_VALIDATORS:
+        return SPEC_VALIDATORS[digest]
+    tables = None
+    try:
+        cache_file = os.path.join(get_cache_dir(),
+                'spec-validators-%s.json' % digest[:16])
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached['Hash'] == digest:
+            tables = cached['Patterns']
+    except (OSError, IOError, ValueError, KeyError):
+        pass
+    if tables is None:
+        tables = compile_validation_patterns(load_validation_patterns(log))
+        try:
+            cache_file = os.path.join(get_cache_dir(),
+                    'spec-validators-%s.json' % digest[:16])
+            tmp_file = cache_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(dict(Hash=digest, Patterns=tables), f)
+            os.rename(tmp_file, cache_file)
+        except (OSError, IOError) as e:
+            log.debug("not caching spec validators: %s" % e)
+    log.debug("loaded spec validators for pattern file hash '%s'" % digest)
+    SPEC_VALIDATORS[digest] = build_spec_validators(tables)
+    return SPEC_VALIDATORS[digest]
+
+
+# Spec validator functions built by load_spec_validators(), keyed by hash
+# of the validation pattern file.
+SPEC_VALIDATORS = {}
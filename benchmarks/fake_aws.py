@@ -0,0 +1,1006 @@
+"""In-process fake of the Organizations, IAM and STS APIs.
+
+The fake answers API calls from botocore's 'before-call' event, the same
+hook botocore.stub.Stubber uses, so no request ever leaves the process.
+Unlike Stubber it keeps state, so calls may arrive in any order and from
+any number of threads.  Each call is counted per service and operation.
+"""
+
+import copy
+import datetime
+import json
+import threading
+from collections import Counter
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+from botocore.client import ClientCreator
+
+
+MASTER_ID = '111111111111'
+ORG_ACCESS_ROLE = 'OrganizationAccountAccessRole'
+DEFAULT_POLICY = 'FullAWSAccess'
+ORG_PAGE_SIZE = 20
+IAM_PAGE_SIZE = 100
+IAM_MAX_ITEMS = 1000
+
+# IAM quotas the fake enforces, as in a default account.
+GROUP_INLINE_POLICY_SIZE = 5120
+MANAGED_POLICY_SIZE = 6144
+GROUP_ATTACHED_POLICIES = 10
+
+# AWS managed policies referenced by the generated specs.  A real account
+# has well over 1000 of these, so pad the list out with filler names.
+AWS_POLICY_NAMES = [
+    'AdministratorAccess',
+    'ReadOnlyAccess',
+    'IAMUserChangePassword',
+    'IAMSelfManageServiceSpecificCredentials',
+]
+AWS_POLICY_COUNT = 1200
+
+
+class FakeError(Exception):
+    def __init__(self, code, message='', status=400):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _account_id(n):
+    return '%012d' % (222222222222 + n)
+
+
+def _trust_policy(principal):
+    return dict(Version='2012-10-17', Statement=[dict(
+            Effect='Allow',
+            Principal=dict(AWS=principal),
+            Action='sts:AssumeRole')])
+
+
+class IAMAccount(object):
+    """
+    IAM state of one account.
+    """
+
+    def __init__(self, account_id):
+        self.account_id = account_id
+        self.users = {}
+        self.groups = {}
+        self.roles = {}
+        self.policies = {}
+        self.counter = 0
+
+    def next_id(self, prefix):
+        self.counter += 1
+        return '%s%s%08d' % (prefix, self.account_id, self.counter)
+
+    def arn(self, kind, path, name):
+        return 'arn:aws:iam::%s:%s%s%s' % (self.account_id, kind, path, name)
+
+
+class FakeAWS(object):
+    """
+    Stateful fake of an AWS Organization and the IAM state of each of
+    its accounts.
+
+    args:
+        accounts:   number of accounts in the organization
+        depth:      depth of the organizational unit tree
+        policies:   number of custom service control policies
+        ous:        number of organizational units (default accounts/10)
+    """
+
+    def __init__(self, accounts=10, depth=1, policies=0, ous=None):
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.root_id = 'r-fake'
+        self.ou = {}
+        self.children = {self.root_id: []}
+        self.accounts = {}
+        self.account_parent = {}
+        self.scp = {}
+        self.scp_targets = {}
+        self.create_requests = {}
+        self.iam = {}
+        self.counter = 0
+        self.aws_policies = self._build_aws_policies()
+        if ous is None:
+            ous = max(depth, accounts // 10)
+        self._build_tree(ous, depth)
+        self._build_accounts(accounts)
+        self._build_scp(policies)
+
+    # -- setup --------------------------------------------------------
+
+    def _next(self, prefix):
+        self.counter += 1
+        return '%s%08d' % (prefix, self.counter)
+
+    def _build_aws_policies(self):
+        names = list(AWS_POLICY_NAMES)
+        names += ['AWSFillerPolicy%04d' % n
+                for n in range(AWS_POLICY_COUNT - len(names))]
+        policies = []
+        for name in names:
+            policies.append(dict(
+                    PolicyName=name,
+                    PolicyId='ANPA%s' % name.upper()[:17],
+                    Arn='arn:aws:iam::aws:policy/%s' % name,
+                    Path='/',
+                    DefaultVersionId='v1',
+                    AttachmentCount=0,
+                    IsAttachable=True,
+                    CreateDate=_now(),
+                    UpdateDate=_now()))
+        return policies
+
+    def _build_tree(self, ous, depth):
+        levels = [[self.root_id]]
+        per_level = max(1, ous // depth)
+        made = 0
+        for level in range(depth):
+            count = per_level if level < depth - 1 else ous - made
+            parents = levels[-1]
+            new_level = []
+            for n in range(count):
+                parent = parents[n % len(parents)]
+                new_level.append(self.add_ou(parent, 'ou-%d-%04d' % (level + 1, n)))
+                made += 1
+            if not new_level:
+                break
+            levels.append(new_level)
+
+    def _build_accounts(self, count):
+        parents = [self.root_id] + list(self.ou.keys())
+        self.add_account(MASTER_ID, 'master', self.root_id)
+        for n in range(1, count):
+            self.add_account(_account_id(n), 'account-%04d' % n,
+                    parents[n % len(parents)])
+
+    def _build_scp(self, count):
+        self.add_scp(DEFAULT_POLICY, 'Allows access to every operation',
+                dict(Version='2012-10-17', Statement=[dict(
+                        Effect='Allow', Action='*', Resource='*')]),
+                policy_id='p-FullAWSAccess')
+        targets = [self.root_id] + list(self.ou.keys()) + list(self.accounts.keys())
+        for t in targets:
+            self.scp_targets['p-FullAWSAccess'].add(t)
+        ou_ids = list(self.ou.keys())
+        for n in range(count):
+            policy_id = self.add_scp('scp-%03d' % n, 'custom scp %d' % n,
+                    dict(Version='2012-10-17', Statement=[dict(
+                            Effect='Deny',
+                            Action=['svc%d:Action' % n, 'svc%d:Other' % n],
+                            Resource='*')]))
+            if ou_ids:
+                self.scp_targets[policy_id].add(ou_ids[n % len(ou_ids)])
+
+    def add_ou(self, parent_id, name):
+        ou_id = 'ou-fake-%s' % self._next('')
+        self.ou[ou_id] = dict(
+                Id=ou_id,
+                Name=name,
+                Arn='arn:aws:organizations::%s:ou/%s' % (MASTER_ID, ou_id))
+        self.children[ou_id] = []
+        self.children[parent_id].append(ou_id)
+        # Organizations attaches the default policy to every new OU
+        if 'p-FullAWSAccess' in self.scp_targets:
+            self.scp_targets['p-FullAWSAccess'].add(ou_id)
+        return ou_id
+
+    def add_account(self, account_id, name, parent_id):
+        self.accounts[account_id] = dict(
+                Id=account_id,
+                Arn='arn:aws:organizations::%s:account/%s' % (MASTER_ID, account_id),
+                Email='%s@example.com' % name,
+                Name=name,
+                Status='ACTIVE',
+                JoinedMethod='CREATED',
+                JoinedTimestamp=_now())
+        self.account_parent[account_id] = parent_id
+        iam = IAMAccount(account_id)
+        self.iam[account_id] = iam
+        if account_id != MASTER_ID:
+            self._put_role(iam, ORG_ACCESS_ROLE, '/', '',
+                    _trust_policy('arn:aws:iam::%s:root' % MASTER_ID),
+                    ['arn:aws:iam::aws:policy/AdministratorAccess'])
+        return account_id
+
+    def add_scp(self, name, description, document, policy_id=None):
+        policy_id = policy_id or 'p-%s' % self._next('')
+        self.scp[policy_id] = dict(
+                PolicySummary=dict(
+                    Id=policy_id,
+                    Arn='arn:aws:organizations::aws:policy/%s' % policy_id,
+                    Name=name,
+                    Description=description,
+                    Type='SERVICE_CONTROL_POLICY',
+                    AwsManaged=policy_id == 'p-FullAWSAccess'),
+                Content=json.dumps(document))
+        self.scp_targets[policy_id] = set()
+        return policy_id
+
+    def _put_role(self, iam, name, path, description, trust, attached=()):
+        iam.roles[name] = dict(
+                RoleName=name,
+                RoleId=iam.next_id('AROA'),
+                Arn=iam.arn('role', path, name),
+                Path=path,
+                Description=description,
+                CreateDate=_now(),
+                AssumeRolePolicyDocument=trust,
+                attached=list(attached))
+
+    def add_user(self, account_id, name, path='/', access_keys=0, mfa=0):
+        iam = self.iam[account_id]
+        iam.users[name] = dict(
+                UserName=name,
+                UserId=iam.next_id('AIDA'),
+                Arn=iam.arn('user', path, name),
+                Path=path,
+                CreateDate=_now(),
+                groups=[],
+                attached=[],
+                inline={},
+                keys=[iam.next_id('AKIA') for n in range(access_keys)],
+                mfa=[iam.arn('mfa', '/', '%s-%d' % (name, n)) for n in range(mfa)],
+                login_profile=True)
+        return iam.users[name]
+
+    def add_group(self, account_id, name, path='/'):
+        iam = self.iam[account_id]
+        iam.groups[name] = dict(
+                GroupName=name,
+                GroupId=iam.next_id('AGPA'),
+                Arn=iam.arn('group', path, name),
+                Path=path,
+                CreateDate=_now(),
+                attached=[],
+                inline={})
+        return iam.groups[name]
+
+    def add_group_member(self, account_id, group, user):
+        users = self.iam[account_id].users
+        if group not in users[user]['groups']:
+            users[user]['groups'].append(group)
+
+    def account_id_by_name(self, name):
+        for account in self.accounts.values():
+            if account['Name'] == name:
+                return account['Id']
+
+    # -- event plumbing -----------------------------------------------
+
+    def install(self):
+        """
+        Attach this fake to every botocore client created from now on,
+        whichever session or resource it is created through.
+        """
+        create_client = ClientCreator.create_client
+        fake = self
+
+        def create_fake_client(creator, *args, **kwargs):
+            return fake.attach(create_client(creator, *args, **kwargs))
+
+        ClientCreator.create_client = create_fake_client
+        self._create_client = create_client
+
+    def uninstall(self):
+        ClientCreator.create_client = self._create_client
+
+    def attach(self, client):
+        """
+        Route every API call made by a botocore client to this fake.
+        """
+        events = client.meta.events
+        events.register_first('before-parameter-build.*.*', self._save_params)
+        events.register_last('before-call.*.*', self._dispatch)
+        return client
+
+    def _save_params(self, params, context, **kwargs):
+        context['fake_params'] = copy.deepcopy(params)
+
+    def _dispatch(self, model, context, request_signer, **kwargs):
+        service = model.service_model.service_name
+        operation = xform_name(model.name)
+        params = context.get('fake_params', {})
+        caller = self._caller(request_signer)
+        with self.lock:
+            self.calls[(service, operation)] += 1
+            handler = getattr(self, '_%s_%s' % (service, operation), None)
+            try:
+                if handler is None:
+                    raise FakeError('NotImplemented',
+                            'fake has no handler for %s.%s' % (service, operation))
+                parsed = handler(caller, params) or {}
+                parsed = copy.deepcopy(parsed)
+                status = 200
+            except FakeError as e:
+                parsed = dict(Error=dict(Code=e.code, Message=e.message))
+                status = e.status
+        parsed['ResponseMetadata'] = dict(
+                HTTPStatusCode=status, RetryAttempts=0, HTTPHeaders={})
+        return AWSResponse('https://fake', status, {}, None), parsed
+
+    def _caller(self, request_signer):
+        credentials = request_signer._credentials
+        if credentials is None:
+            return MASTER_ID
+        access_key = credentials.get_frozen_credentials().access_key
+        return access_key[-12:]
+
+    # -- pagination ---------------------------------------------------
+
+    @staticmethod
+    def _org_page(items, params, key):
+        start = int(params.get('NextToken') or 0)
+        size = min(params.get('MaxResults') or ORG_PAGE_SIZE, ORG_PAGE_SIZE)
+        response = {key: items[start:start + size]}
+        if start + size < len(items):
+            response['NextToken'] = str(start + size)
+        return response
+
+    @staticmethod
+    def _iam_page(items, params, key):
+        start = int(params.get('Marker') or 0)
+        size = min(params.get('MaxItems') or IAM_PAGE_SIZE, IAM_MAX_ITEMS)
+        response = {key: items[start:start + size],
+                'IsTruncated': start + size < len(items)}
+        if response['IsTruncated']:
+            response['Marker'] = str(start + size)
+        return response
+
+    # -- sts ----------------------------------------------------------
+
+    def _sts_get_caller_identity(self, caller, params):
+        return dict(Account=caller,
+                Arn='arn:aws:iam::%s:user/fake' % caller,
+                UserId='AIDAFAKE')
+
+    def _sts_assume_role(self, caller, params):
+        account_id = params['RoleArn'].split(':')[4]
+        role_name = params['RoleArn'].split('/')[-1]
+        if account_id not in self.iam or role_name not in self.iam[account_id].roles:
+            raise FakeError('AccessDenied', 'cannot assume %s' % params['RoleArn'],
+                    status=403)
+        return dict(Credentials=dict(
+                AccessKeyId='ASIAFAKE%s' % account_id,
+                SecretAccessKey='fake',
+                SessionToken='fake',
+                Expiration=_now() + datetime.timedelta(hours=1)))
+
+    # -- organizations ------------------------------------------------
+
+    def _organizations_list_roots(self, caller, params):
+        return dict(Roots=[dict(Id=self.root_id, Name='Root',
+                Arn='arn:aws:organizations::%s:root/%s' % (MASTER_ID, self.root_id),
+                PolicyTypes=[dict(Type='SERVICE_CONTROL_POLICY', Status='ENABLED')])])
+
+    def _organizations_describe_organization(self, caller, params):
+        return dict(Organization=dict(
+                Id='o-fake',
+                MasterAccountId=MASTER_ID,
+                FeatureSet='ALL',
+                AvailablePolicyTypes=[dict(
+                        Type='SERVICE_CONTROL_POLICY', Status='ENABLED')]))
+
+    def _organizations_enable_policy_type(self, caller, params):
+        return dict(Root=self._organizations_list_roots(caller, params)['Roots'][0])
+
+    def _organizations_list_accounts(self, caller, params):
+        return self._org_page(list(self.accounts.values()), params, 'Accounts')
+
+    def _check_parent(self, parent_id):
+        if parent_id not in self.children:
+            raise FakeError('ParentNotFoundException', parent_id)
+
+    def _organizations_list_accounts_for_parent(self, caller, params):
+        self._check_parent(params['ParentId'])
+        accounts = [a for a in self.accounts.values()
+                if self.account_parent[a['Id']] == params['ParentId']]
+        return self._org_page(accounts, params, 'Accounts')
+
+    def _organizations_list_organizational_units_for_parent(self, caller, params):
+        self._check_parent(params['ParentId'])
+        ous = [self.ou[ou_id] for ou_id in self.children[params['ParentId']]]
+        return self._org_page(ous, params, 'OrganizationalUnits')
+
+    def _organizations_list_parents(self, caller, params):
+        child = params['ChildId']
+        if child in self.account_parent:
+            parent_id = self.account_parent[child]
+        else:
+            parent_id = [p for p, c in self.children.items() if child in c][0]
+        parent_type = 'ROOT' if parent_id == self.root_id else 'ORGANIZATIONAL_UNIT'
+        return dict(Parents=[dict(Id=parent_id, Type=parent_type)])
+
+    def _organizations_create_organizational_unit(self, caller, params):
+        self._check_parent(params['ParentId'])
+        for ou_id in self.children[params['ParentId']]:
+            if self.ou[ou_id]['Name'] == params['Name']:
+                raise FakeError('DuplicateOrganizationalUnitException', params['Name'])
+        ou_id = self.add_ou(params['ParentId'], params['Name'])
+        return dict(OrganizationalUnit=self.ou[ou_id])
+
+    def _organizations_delete_organizational_unit(self, caller, params):
+        ou_id = params['OrganizationalUnitId']
+        if self.children.get(ou_id) or ou_id in self.account_parent.values():
+            raise FakeError('OrganizationalUnitNotEmptyException', ou_id)
+        for children in self.children.values():
+            if ou_id in children:
+                children.remove(ou_id)
+        del self.children[ou_id]
+        del self.ou[ou_id]
+        for targets in self.scp_targets.values():
+            targets.discard(ou_id)
+
+    def _organizations_move_account(self, caller, params):
+        account_id = params['AccountId']
+        if self.account_parent.get(account_id) != params['SourceParentId']:
+            raise FakeError('SourceParentNotFoundException', account_id)
+        self._check_parent(params['DestinationParentId'])
+        self.account_parent[account_id] = params['DestinationParentId']
+
+    def _scp_summaries(self):
+        return [p['PolicySummary'] for p in self.scp.values()]
+
+    def _organizations_list_policies(self, caller, params):
+        return self._org_page(self._scp_summaries(), params, 'Policies')
+
+    def _get_scp(self, policy_id):
+        if policy_id not in self.scp:
+            raise FakeError('PolicyNotFoundException', policy_id)
+        return self.scp[policy_id]
+
+    def _organizations_describe_policy(self, caller, params):
+        return dict(Policy=self._get_scp(params['PolicyId']))
+
+    def _organizations_create_policy(self, caller, params):
+        policy_id = self.add_scp(params['Name'], params['Description'],
+                json.loads(params['Content']))
+        return dict(Policy=self.scp[policy_id])
+
+    def _organizations_update_policy(self, caller, params):
+        policy = self._get_scp(params['PolicyId'])
+        if 'Content' in params:
+            policy['Content'] = params['Content']
+        if 'Description' in params:
+            policy['PolicySummary']['Description'] = params['Description']
+        return dict(Policy=policy)
+
+    def _organizations_delete_policy(self, caller, params):
+        self._get_scp(params['PolicyId'])
+        if self.scp_targets[params['PolicyId']]:
+            raise FakeError('PolicyInUseException', params['PolicyId'])
+        del self.scp[params['PolicyId']]
+        del self.scp_targets[params['PolicyId']]
+
+    def _target_summary(self, target_id):
+        if target_id == self.root_id:
+            return dict(TargetId=target_id, Name='Root', Type='ROOT',
+                    Arn='arn:aws:organizations::%s:root/%s' % (MASTER_ID, target_id))
+        if target_id in self.accounts:
+            account = self.accounts[target_id]
+            return dict(TargetId=target_id, Name=account['Name'],
+                    Type='ACCOUNT', Arn=account['Arn'])
+        ou = self.ou[target_id]
+        return dict(TargetId=target_id, Name=ou['Name'],
+                Type='ORGANIZATIONAL_UNIT', Arn=ou['Arn'])
+
+    def _organizations_list_targets_for_policy(self, caller, params):
+        self._get_scp(params['PolicyId'])
+        targets = [self._target_summary(t)
+                for t in sorted(self.scp_targets[params['PolicyId']])]
+        return self._org_page(targets, params, 'Targets')
+
+    def _organizations_list_policies_for_target(self, caller, params):
+        policies = [self.scp[p]['PolicySummary']
+                for p, targets in self.scp_targets.items()
+                if params['TargetId'] in targets]
+        return self._org_page(policies, params, 'Policies')
+
+    def _organizations_attach_policy(self, caller, params):
+        self._get_scp(params['PolicyId'])
+        if params['TargetId'] in self.scp_targets[params['PolicyId']]:
+            raise FakeError('DuplicatePolicyAttachmentException', params['PolicyId'])
+        self.scp_targets[params['PolicyId']].add(params['TargetId'])
+
+    def _organizations_detach_policy(self, caller, params):
+        self._get_scp(params['PolicyId'])
+        if params['TargetId'] not in self.scp_targets[params['PolicyId']]:
+            raise FakeError('PolicyNotAttachedException', params['PolicyId'])
+        self.scp_targets[params['PolicyId']].discard(params['TargetId'])
+
+    def _organizations_create_account(self, caller, params):
+        request_id = 'car-%s' % self._next('')
+        self.create_requests[request_id] = dict(
+                status=dict(
+                    Id=request_id,
+                    AccountName=params['AccountName'],
+                    State='IN_PROGRESS',
+                    RequestedTimestamp=_now()),
+                email=params['Email'],
+                polls=2)
+        return dict(CreateAccountStatus=self.create_requests[request_id]['status'])
+
+    def _advance_create_request(self, request):
+        status = request['status']
+        if status['State'] != 'IN_PROGRESS':
+            return
+        request['polls'] -= 1
+        if request['polls'] > 0:
+            return
+        account_id = _account_id(len(self.accounts) + 1000)
+        self.add_account(account_id, status['AccountName'], self.root_id)
+        self.accounts[account_id]['Email'] = request['email']
+        status['State'] = 'SUCCEEDED'
+        status['AccountId'] = account_id
+        status['CompletedTimestamp'] = _now()
+
+    def _organizations_describe_create_account_status(self, caller, params):
+        request = self.create_requests.get(params['CreateAccountRequestId'])
+        if request is None:
+            raise FakeError('CreateAccountStatusNotFoundException',
+                    params['CreateAccountRequestId'])
+        self._advance_create_request(request)
+        return dict(CreateAccountStatus=request['status'])
+
+    def _organizations_list_create_account_status(self, caller, params):
+        statuses = [r['status'] for r in self.create_requests.values()
+                if not params.get('States') or r['status']['State'] in params['States']]
+        return self._org_page(statuses, params, 'CreateAccountStatuses')
+
+    # -- iam ----------------------------------------------------------
+
+    @staticmethod
+    def _doc(document):
+        # IAM returns policy documents url-encoded
+        return quote(json.dumps(document))
+
+    @staticmethod
+    def _public(entity):
+        return dict((k, v) for k, v in entity.items() if k[0].isupper()
+                and k != 'AssumeRolePolicyDocument')
+
+    def _user(self, iam, name):
+        if name not in iam.users:
+            raise FakeError('NoSuchEntity', 'user %s' % name, status=404)
+        return iam.users[name]
+
+    def _group(self, iam, name):
+        if name not in iam.groups:
+            raise FakeError('NoSuchEntity', 'group %s' % name, status=404)
+        return iam.groups[name]
+
+    def _role(self, iam, name):
+        if name not in iam.roles:
+            raise FakeError('NoSuchEntity', 'role %s' % name, status=404)
+        return iam.roles[name]
+
+    def _policy(self, iam, arn):
+        if arn in iam.policies:
+            return iam.policies[arn]
+        for policy in self.aws_policies:
+            if policy['Arn'] == arn:
+                return policy
+        raise FakeError('NoSuchEntity', 'policy %s' % arn, status=404)
+
+    def _attached(self, iam, arns):
+        return [dict(PolicyName=self._policy(iam, arn)['PolicyName'], PolicyArn=arn)
+                for arn in arns]
+
+    @staticmethod
+    def _policy_size(document):
+        # IAM does not count whitespace against policy size quotas
+        return len(json.dumps(json.loads(document), separators=(',', ':')))
+
+    def _path_filter(self, items, params):
+        prefix = params.get('PathPrefix')
+        if prefix:
+            items = [i for i in items if i['Path'].startswith(prefix)]
+        return items
+
+    # users
+    def _iam_list_users(self, caller, params):
+        iam = self.iam[caller]
+        users = [self._public(u) for u in iam.users.values()]
+        return self._iam_page(self._path_filter(users, params), params, 'Users')
+
+    def _iam_get_user(self, caller, params):
+        return dict(User=self._public(self._user(self.iam[caller], params['UserName'])))
+
+    def _iam_create_user(self, caller, params):
+        iam = self.iam[caller]
+        if params['UserName'] in iam.users:
+            raise FakeError('EntityAlreadyExists', params['UserName'], status=409)
+        user = self.add_user(caller, params['UserName'], params.get('Path', '/'))
+        user['login_profile'] = False
+        return dict(User=self._public(user))
+
+    def _iam_update_user(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        if 'NewPath' in params:
+            user['Path'] = params['NewPath']
+
+    def _iam_delete_user(self, caller, params):
+        iam = self.iam[caller]
+        user = self._user(iam, params['UserName'])
+        if (user['groups'] or user['attached'] or user['inline'] or user['keys']
+                or user['mfa'] or user['login_profile']):
+            raise FakeError('DeleteConflict', params['UserName'], status=409)
+        del iam.users[params['UserName']]
+
+    def _iam_list_groups_for_user(self, caller, params):
+        iam = self.iam[caller]
+        user = self._user(iam, params['UserName'])
+        groups = [self._public(iam.groups[g]) for g in user['groups']]
+        return self._iam_page(groups, params, 'Groups')
+
+    def _iam_list_attached_user_policies(self, caller, params):
+        iam = self.iam[caller]
+        user = self._user(iam, params['UserName'])
+        return self._iam_page(self._attached(iam, user['attached']),
+                params, 'AttachedPolicies')
+
+    def _iam_detach_user_policy(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        if params['PolicyArn'] not in user['attached']:
+            raise FakeError('NoSuchEntity', params['PolicyArn'], status=404)
+        user['attached'].remove(params['PolicyArn'])
+
+    def _iam_list_user_policies(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        return self._iam_page(sorted(user['inline']), params, 'PolicyNames')
+
+    def _iam_delete_user_policy(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        if params['PolicyName'] not in user['inline']:
+            raise FakeError('NoSuchEntity', params['PolicyName'], status=404)
+        del user['inline'][params['PolicyName']]
+
+    def _iam_list_access_keys(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        keys = [dict(UserName=user['UserName'], AccessKeyId=k, Status='Active',
+                CreateDate=_now()) for k in user['keys']]
+        return self._iam_page(keys, params, 'AccessKeyMetadata')
+
+    def _iam_delete_access_key(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        if params['AccessKeyId'] not in user['keys']:
+            raise FakeError('NoSuchEntity', params['AccessKeyId'], status=404)
+        user['keys'].remove(params['AccessKeyId'])
+
+    def _iam_list_mfa_devices(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        devices = [dict(UserName=user['UserName'], SerialNumber=s,
+                EnableDate=_now()) for s in user['mfa']]
+        return self._iam_page(devices, params, 'MFADevices')
+
+    def _iam_deactivate_mfa_device(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        if params['SerialNumber'] not in user['mfa']:
+            raise FakeError('NoSuchEntity', params['SerialNumber'], status=404)
+        user['mfa'].remove(params['SerialNumber'])
+
+    def _iam_delete_login_profile(self, caller, params):
+        user = self._user(self.iam[caller], params['UserName'])
+        if not user['login_profile']:
+            raise FakeError('NoSuchEntity', 'login profile', status=404)
+        user['login_profile'] = False
+
+    # groups
+    def _iam_list_groups(self, caller, params):
+        groups = [self._public(g) for g in self.iam[caller].groups.values()]
+        return self._iam_page(self._path_filter(groups, params), params, 'Groups')
+
+    def _members(self, iam, group_name):
+        return [self._public(u) for u in iam.users.values()
+                if group_name in u['groups']]
+
+    def _iam_get_group(self, caller, params):
+        iam = self.iam[caller]
+        group = self._group(iam, params['GroupName'])
+        response = self._iam_page(self._members(iam, params['GroupName']),
+                params, 'Users')
+        response['Group'] = self._public(group)
+        return response
+
+    def _iam_create_group(self, caller, params):
+        iam = self.iam[caller]
+        if params['GroupName'] in iam.groups:
+            raise FakeError('EntityAlreadyExists', params['GroupName'], status=409)
+        group = self.add_group(caller, params['GroupName'], params.get('Path', '/'))
+        return dict(Group=self._public(group))
+
+    def _iam_update_group(self, caller, params):
+        group = self._group(self.iam[caller], params['GroupName'])
+        if 'NewPath' in params:
+            group['Path'] = params['NewPath']
+
+    def _iam_delete_group(self, caller, params):
+        iam = self.iam[caller]
+        group = self._group(iam, params['GroupName'])
+        if (self._members(iam, params['GroupName']) or group['attached']
+                or group['inline']):
+            raise FakeError('DeleteConflict', params['GroupName'], status=409)
+        del iam.groups[params['GroupName']]
+
+    def _iam_add_user_to_group(self, caller, params):
+        iam = self.iam[caller]
+        self._group(iam, params['GroupName'])
+        user = self._user(iam, params['UserName'])
+        if params['GroupName'] not in user['groups']:
+            user['groups'].append(params['GroupName'])
+
+    def _iam_remove_user_from_group(self, caller, params):
+        iam = self.iam[caller]
+        self._group(iam, params['GroupName'])
+        user = self._user(iam, params['UserName'])
+        if params['GroupName'] not in user['groups']:
+            raise FakeError('NoSuchEntity', params['UserName'], status=404)
+        user['groups'].remove(params['GroupName'])
+
+    def _iam_list_attached_group_policies(self, caller, params):
+        iam = self.iam[caller]
+        group = self._group(iam, params['GroupName'])
+        return self._iam_page(self._attached(iam, group['attached']),
+                params, 'AttachedPolicies')
+
+    def _iam_attach_group_policy(self, caller, params):
+        iam = self.iam[caller]
+        group = self._group(iam, params['GroupName'])
+        self._policy(iam, params['PolicyArn'])
+        if params['PolicyArn'] not in group['attached']:
+            if len(group['attached']) >= GROUP_ATTACHED_POLICIES:
+                raise FakeError('LimitExceeded', 'Cannot exceed quota for '
+                        'PoliciesPerGroup: %d' % GROUP_ATTACHED_POLICIES, status=409)
+            group['attached'].append(params['PolicyArn'])
+
+    def _iam_detach_group_policy(self, caller, params):
+        group = self._group(self.iam[caller], params['GroupName'])
+        if params['PolicyArn'] not in group['attached']:
+            raise FakeError('NoSuchEntity', params['PolicyArn'], status=404)
+        group['attached'].remove(params['PolicyArn'])
+
+    def _iam_list_group_policies(self, caller, params):
+        group = self._group(self.iam[caller], params['GroupName'])
+        return self._iam_page(sorted(group['inline']), params, 'PolicyNames')
+
+    def _iam_get_group_policy(self, caller, params):
+        group = self._group(self.iam[caller], params['GroupName'])
+        if params['PolicyName'] not in group['inline']:
+            raise FakeError('NoSuchEntity', params['PolicyName'], status=404)
+        return dict(GroupName=params['GroupName'],
+                PolicyName=params['PolicyName'],
+                PolicyDocument=self._doc(group['inline'][params['PolicyName']]))
+
+    def _iam_put_group_policy(self, caller, params):
+        group = self._group(self.iam[caller], params['GroupName'])
+        size = self._policy_size(params['PolicyDocument'])
+        size += sum(self._policy_size(json.dumps(d))
+                for n, d in group['inline'].items() if n != params['PolicyName'])
+        if size > GROUP_INLINE_POLICY_SIZE:
+            raise FakeError('LimitExceeded', 'Maximum policy size of %d bytes '
+                    'exceeded for group %s' % (GROUP_INLINE_POLICY_SIZE,
+                    params['GroupName']), status=409)
+        group['inline'][params['PolicyName']] = json.loads(params['PolicyDocument'])
+
+    def _iam_delete_group_policy(self, caller, params):
+        group = self._group(self.iam[caller], params['GroupName'])
+        if params['PolicyName'] not in group['inline']:
+            raise FakeError('NoSuchEntity', params['PolicyName'], status=404)
+        del group['inline'][params['PolicyName']]
+
+    # roles
+    def _role_public(self, role):
+        public = self._public(role)
+        public['AssumeRolePolicyDocument'] = self._doc(role['AssumeRolePolicyDocument'])
+        return public
+
+    def _iam_list_roles(self, caller, params):
+        roles = [self._role_public(r) for r in self.iam[caller].roles.values()]
+        return self._iam_page(self._path_filter(roles, params), params, 'Roles')
+
+    def _iam_get_role(self, caller, params):
+        return dict(Role=self._role_public(
+                self._role(self.iam[caller], params['RoleName'])))
+
+    def _iam_create_role(self, caller, params):
+        iam = self.iam[caller]
+        if params['RoleName'] in iam.roles:
+            raise FakeError('EntityAlreadyExists', params['RoleName'], status=409)
+        self._put_role(iam, params['RoleName'], params.get('Path', '/'),
+                params.get('Description', ''),
+                json.loads(params['AssumeRolePolicyDocument']))
+        return dict(Role=self._role_public(iam.roles[params['RoleName']]))
+
+    def _iam_delete_role(self, caller, params):
+        iam = self.iam[caller]
+        role = self._role(iam, params['RoleName'])
+        if role['attached']:
+            raise FakeError('DeleteConflict', params['RoleName'], status=409)
+        del iam.roles[params['RoleName']]
+
+    def _iam_update_assume_role_policy(self, caller, params):
+        role = self._role(self.iam[caller], params['RoleName'])
+        role['AssumeRolePolicyDocument'] = json.loads(params['PolicyDocument'])
+
+    def _iam_update_role_description(self, caller, params):
+        role = self._role(self.iam[caller], params['RoleName'])
+        role['Description'] = params['Description']
+        return dict(Role=self._role_public(role))
+
+    def _iam_update_role(self, caller, params):
+        role = self._role(self.iam[caller], params['RoleName'])
+        if 'Description' in params:
+            role['Description'] = params['Description']
+
+    def _iam_list_attached_role_policies(self, caller, params):
+        iam = self.iam[caller]
+        role = self._role(iam, params['RoleName'])
+        return self._iam_page(self._attached(iam, role['attached']),
+                params, 'AttachedPolicies')
+
+    def _iam_attach_role_policy(self, caller, params):
+        iam = self.iam[caller]
+        role = self._role(iam, params['RoleName'])
+        self._policy(iam, params['PolicyArn'])
+        if params['PolicyArn'] not in role['attached']:
+            role['attached'].append(params['PolicyArn'])
+
+    def _iam_detach_role_policy(self, caller, params):
+        role = self._role(self.iam[caller], params['RoleName'])
+        if params['PolicyArn'] not in role['attached']:
+            raise FakeError('NoSuchEntity', params['PolicyArn'], status=404)
+        role['attached'].remove(params['PolicyArn'])
+
+    # managed policies
+    def _policy_public(self, policy):
+        return dict((k, v) for k, v in policy.items() if k != 'versions')
+
+    def _iam_list_policies(self, caller, params):
+        iam = self.iam[caller]
+        scope = params.get('Scope', 'All')
+        policies = []
+        if scope in ('All', 'AWS'):
+            policies += self.aws_policies
+        if scope in ('All', 'Local'):
+            policies += [self._policy_public(p) for p in iam.policies.values()]
+        return self._iam_page(policies, params, 'Policies')
+
+    def _iam_get_policy(self, caller, params):
+        policy = self._policy(self.iam[caller], params['PolicyArn'])
+        return dict(Policy=self._policy_public(policy))
+
+    def _iam_create_policy(self, caller, params):
+        iam = self.iam[caller]
+        path = params.get('Path', '/')
+        arn = iam.arn('policy', path, params['PolicyName'])
+        if arn in iam.policies:
+            raise FakeError('EntityAlreadyExists', params['PolicyName'], status=409)
+        self._check_policy_size(params['PolicyDocument'])
+        iam.policies[arn] = dict(
+                PolicyName=params['PolicyName'],
+                PolicyId=iam.next_id('ANPA'),
+                Arn=arn,
+                Path=path,
+                Description=params.get('Description', ''),
+                DefaultVersionId='v1',
+                AttachmentCount=0,
+                IsAttachable=True,
+                CreateDate=_now(),
+                UpdateDate=_now(),
+                versions={'v1': json.loads(params['PolicyDocument'])})
+        return dict(Policy=self._policy_public(iam.policies[arn]))
+
+    def _check_policy_size(self, document):
+        if self._policy_size(document) > MANAGED_POLICY_SIZE:
+            raise FakeError('LimitExceeded', 'Cannot exceed quota for '
+                    'PolicySize: %d' % MANAGED_POLICY_SIZE, status=409)
+
+    def _iam_delete_policy(self, caller, params):
+        iam = self.iam[caller]
+        policy = self._local_policy(iam, params['PolicyArn'])
+        entities = (list(iam.users.values()) + list(iam.groups.values())
+                + list(iam.roles.values()))
+        if (len(policy['versions']) > 1 or any(params['PolicyArn'] in e['attached']
+                for e in entities)):
+            raise FakeError('DeleteConflict', params['PolicyArn'], status=409)
+        del iam.policies[params['PolicyArn']]
+
+    def _local_policy(self, iam, arn):
+        if arn not in iam.policies:
+            raise FakeError('NoSuchEntity', arn, status=404)
+        return iam.policies[arn]
+
+    def _iam_get_policy_version(self, caller, params):
+        policy = self._local_policy(self.iam[caller], params['PolicyArn'])
+        if params['VersionId'] not in policy['versions']:
+            raise FakeError('NoSuchEntity', params['VersionId'], status=404)
+        return dict(PolicyVersion=dict(
+                Document=self._doc(policy['versions'][params['VersionId']]),
+                VersionId=params['VersionId'],
+                IsDefaultVersion=params['VersionId'] == policy['DefaultVersionId'],
+                CreateDate=_now()))
+
+    def _iam_list_policy_versions(self, caller, params):
+        policy = self._local_policy(self.iam[caller], params['PolicyArn'])
+        versions = [dict(VersionId=v, IsDefaultVersion=v == policy['DefaultVersionId'],
+                CreateDate=_now()) for v in sorted(policy['versions'])]
+        return self._iam_page(versions, params, 'Versions')
+
+    def _iam_delete_policy_version(self, caller, params):
+        policy = self._local_policy(self.iam[caller], params['PolicyArn'])
+        if params['VersionId'] == policy['DefaultVersionId']:
+            raise FakeError('DeleteConflict', params['VersionId'], status=409)
+        del policy['versions'][params['VersionId']]
+
+    def _iam_create_policy_version(self, caller, params):
+        policy = self._local_policy(self.iam[caller], params['PolicyArn'])
+        if len(policy['versions']) >= 5:
+            raise FakeError('LimitExceeded', 'too many versions', status=409)
+        self._check_policy_size(params['PolicyDocument'])
+        number = max(int(v[1:]) for v in policy['versions']) + 1
+        version_id = 'v%d' % number
+        policy['versions'][version_id] = json.loads(params['PolicyDocument'])
+        if params.get('SetAsDefault'):
+            policy['DefaultVersionId'] = version_id
+        return dict(PolicyVersion=dict(VersionId=version_id,
+                IsDefaultVersion=bool(params.get('SetAsDefault')),
+                CreateDate=_now()))
+
+    def _iam_get_account_authorization_details(self, caller, params):
+        iam = self.iam[caller]
+        filters = params.get('Filter') or ['User', 'Group', 'Role',
+                'LocalManagedPolicy', 'AWSManagedPolicy']
+        items = []
+        if 'User' in filters:
+            for user in iam.users.values():
+                detail = self._public(user)
+                detail['GroupList'] = list(user['groups'])
+                detail['AttachedManagedPolicies'] = self._attached(iam, user['attached'])
+                detail['UserPolicyList'] = [dict(PolicyName=n, PolicyDocument=self._doc(d))
+                        for n, d in sorted(user['inline'].items())]
+                items.append(('UserDetailList', detail))
+        if 'Group' in filters:
+            for group in iam.groups.values():
+                detail = self._public(group)
+                detail['AttachedManagedPolicies'] = self._attached(iam, group['attached'])
+                detail['GroupPolicyList'] = [dict(PolicyName=n, PolicyDocument=self._doc(d))
+                        for n, d in sorted(group['inline'].items())]
+                items.append(('GroupDetailList', detail))
+        if 'Role' in filters:
+            for role in iam.roles.values():
+                detail = self._role_public(role)
+                detail['AttachedManagedPolicies'] = self._attached(iam, role['attached'])
+                detail['RolePolicyList'] = []
+                detail['InstanceProfileList'] = []
+                items.append(('RoleDetailList', detail))
+        if 'LocalManagedPolicy' in filters:
+            for policy in iam.policies.values():
+                detail = self._policy_public(policy)
+                detail['PolicyVersionList'] = [dict(
+                        Document=self._doc(d), VersionId=v,
+                        IsDefaultVersion=v == policy['DefaultVersionId'],
+                        CreateDate=_now())
+                        for v, d in sorted(policy['versions'].items())]
+                items.append(('Policies', detail))
+        page = self._iam_page(items, params, 'Items')
+        response = dict(UserDetailList=[], GroupDetailList=[], RoleDetailList=[],
+                Policies=[], IsTruncated=page['IsTruncated'])
+        if 'Marker' in page:
+            response['Marker'] = page['Marker']
+        for key, detail in page['Items']:
+            response[key].append(detail)
+        return response
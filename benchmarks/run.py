@@ -0,0 +1,245 @@
+"""Benchmark the awsorgs tools against an in-process fake of AWS.
+
+Each scenario runs one console script end to end in its own process
+against a freshly generated FakeAWS organization and records API calls
+per operation, wall time and peak memory.  The run fails when a scenario
+makes more API calls than recorded in the budget file, or has no budget.
+Scenarios which change resources are then run a second time, which
+fails if it makes any write.
+
+Run from the top of the source tree with 'python -m benchmarks.run'.
+
+Usage:
+  run [options] [SCENARIO...]
+  run --child SCENARIO ACCOUNTS DEPTH POLICIES
+
+Scenarios:
+  orgs-report         awsorgs report
+  orgs-organization   awsorgs organization --exec
+  accounts-create     awsaccounts create --exec
+  auth-report         awsauth report
+  auth-users          awsauth users --exec
+  auth-delegation     awsauth delegation --exec
+
+Options:
+  -h, --help              Show this help message and exit.
+  -a, --accounts LIST     Comma separated org sizes in accounts [default: 10,100,1000].
+  -d, --depth LIST        Comma separated OU tree depths [default: 3].
+  -p, --policies LIST     Comma separated custom SCP counts [default: 20].
+  -b, --budget FILE       API call budget file [default: benchmarks/budgets.json].
+  -u, --update-budget     Record API call counts as the new budget.
+                          Scenarios without a budget do not fail.
+  -o, --output FILE       Write full results to FILE in json format.
+  -v, --verbose           Print API call counts per operation.
+
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import itertools
+import subprocess
+import tracemalloc
+
+import yaml
+from docopt import docopt
+
+from benchmarks.fake_aws import FakeAWS, MASTER_ID
+from benchmarks import specs
+
+
+SCENARIOS = [
+    'orgs-report',
+    'orgs-organization',
+    'accounts-create',
+    'auth-report',
+    'auth-users',
+    'auth-delegation',
+]
+
+
+def write_spec(directory, name, spec):
+    filename = os.path.join(directory, name)
+    with open(filename, 'w') as f:
+        f.write(yaml.safe_dump(spec, default_flow_style=False))
+    return filename
+
+
+def prepare(scenario, fake, depth, directory):
+    """
+    Return the console script entry point and argv for a scenario.
+    """
+    if scenario.startswith('orgs-'):
+        from awsorgs.orgs import main
+        if scenario == 'orgs-report':
+            return main, ['awsorgs', 'report']
+        spec_file = write_spec(directory, 'org-spec.yaml',
+                specs.org_spec(fake, depth, new_ous=max(depth, len(fake.ou) // 5)))
+        return main, ['awsorgs', 'organization', '-s', spec_file, '--exec']
+    if scenario == 'accounts-create':
+        from awsorgs.accounts import main
+        spec_file = write_spec(directory, 'account-spec.yaml',
+                specs.account_spec(fake, new_accounts=5))
+        return main, ['awsaccounts', 'create', '-s', spec_file, '--exec']
+    from awsorgs.auth import main
+    mode = scenario.split('-')[1]
+    spec_file = write_spec(directory, 'auth-spec.yaml',
+            specs.auth_spec(fake, absent_users=5))
+    argv = ['awsauth', mode, '-s', spec_file]
+    if mode != 'report':
+        argv.append('--exec')
+    return main, argv
+
+
+# Operations which read state.  Any other call on the second run of a
+# scenario counts as a write.
+READ_PREFIXES = ('list_', 'get_', 'describe_')
+
+
+def write_calls(calls):
+    """
+    Return dict of counts of write operations in 'calls', keyed as
+    'service.operation'.  sts calls are not writes.
+    """
+    return dict(('%s.%s' % key, count) for key, count in sorted(calls.items())
+            if key[0] != 'sts' and not key[1].startswith(READ_PREFIXES))
+
+
+def run_main(main, argv):
+    """
+    Run a console script entry point.  Return error message or None.
+    """
+    sys.argv = argv
+    try:
+        main()
+    except SystemExit as e:
+        if e.code:
+            return 'exit status %s' % e.code
+    except Exception as e:
+        return '%s: %s' % (e.__class__.__name__, e)
+    return None
+
+
+def run_child(scenario, accounts, depth, policies):
+    """
+    Run one scenario in this process and print its results as json.
+    Scenarios run with '--exec' are run again against the changed fake,
+    and the writes of the second run are reported as 'rerun_writes'.
+    """
+    os.environ.update(
+            AWS_ACCESS_KEY_ID='AKIAFAKE%s' % MASTER_ID,
+            AWS_SECRET_ACCESS_KEY='fake',
+            AWS_DEFAULT_REGION='us-east-1')
+    os.environ.pop('AWS_PROFILE', None)
+    fake = FakeAWS(accounts=accounts, depth=depth, policies=policies)
+    # account creation polls on a timer.  count the time instead.
+    slept = []
+    time.sleep = slept.append
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['AWSORGS_CACHE_DIR'] = directory
+        main, argv = prepare(scenario, fake, depth, directory)
+        fake.install()
+        tracemalloc.start()
+        start = time.time()
+        error = run_main(main, argv)
+        wall = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        calls = dict(('%s.%s' % key, count)
+                for key, count in sorted(fake.calls.items()))
+        rerun_writes = {}
+        if '--exec' in argv and not error:
+            fake.calls.clear()
+            error = run_main(main, argv)
+            rerun_writes = write_calls(fake.calls)
+        fake.uninstall()
+    print(json.dumps(dict(
+            calls=calls,
+            total=sum(calls.values()),
+            wall=wall,
+            sleep=sum(slept),
+            peak=peak,
+            rerun_writes=rerun_writes,
+            error=error)))
+
+
+def run_scenario(scenario, accounts, depth, policies):
+    output = subprocess.check_output([sys.executable, '-m', 'benchmarks.run',
+            '--child', scenario, str(accounts), str(depth), str(policies)],
+            stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def budget_key(scenario, accounts, depth, policies):
+    return '%s accounts=%s depth=%s policies=%s' % (
+            scenario, accounts, depth, policies)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    args = docopt(__doc__)
+    if args['--child']:
+        run_child(args['SCENARIO'][0], int(args['ACCOUNTS']),
+                int(args['DEPTH']), int(args['POLICIES']))
+        return
+
+    scenarios = args['SCENARIO'] or SCENARIOS
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            sys.exit("unknown scenario '%s'" % scenario)
+    budget = {}
+    if os.path.exists(args['--budget']):
+        with open(args['--budget']) as f:
+            budget = json.load(f)
+
+    results = {}
+    failed = False
+    print('%-64s %8s %9s %9s %10s' % ('scenario', 'calls', 'budget', 'wall(s)', 'peak(KiB)'))
+    for scenario, accounts, depth, policies in itertools.product(scenarios,
+            int_list(args['--accounts']), int_list(args['--depth']),
+            int_list(args['--policies'])):
+        key = budget_key(scenario, accounts, depth, policies)
+        result = run_scenario(scenario, accounts, depth, policies)
+        results[key] = result
+        limit = budget.get(key)
+        status = ''
+        if result['error']:
+            status = 'ERROR %s' % result['error']
+            failed = True
+        elif result['rerun_writes']:
+            status = 'NOT CONVERGED %s' % ', '.join('%s=%d' % item
+                    for item in sorted(result['rerun_writes'].items()))
+            failed = True
+        elif limit is None and not args['--update-budget']:
+            status = 'NO BUDGET'
+            failed = True
+        elif limit is not None and result['total'] > limit:
+            status = 'OVER BUDGET'
+            failed = True
+        print('%-64s %8d %9s %9.2f %10d  %s' % (key, result['total'],
+                '-' if limit is None else limit, result['wall'],
+                result['peak'] // 1024, status))
+        if args['--verbose']:
+            for operation, count in sorted(result['calls'].items()):
+                print('    %-56s %8d' % (operation, count))
+        if args['--update-budget'] and not result['error']:
+            budget[key] = result['total']
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args['--update-budget']:
+        with open(args['--budget'], 'w') as f:
+            json.dump(budget, f, indent=2, sort_keys=True)
+            f.write('\n')
+    elif failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
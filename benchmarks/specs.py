@@ -0,0 +1,193 @@
+"""Build awsorgs spec-files describing the state of a FakeAWS organization.
+
+Each builder returns a spec dictionary matching the deployed fake, plus a
+few deliberate differences, so that running a tool in '--exec' mode has
+real work to do.
+"""
+
+import json
+
+from benchmarks.fake_aws import MASTER_ID, ORG_ACCESS_ROLE, DEFAULT_POLICY
+
+
+def _account_names(fake, parent_id):
+    return sorted(fake.accounts[a]['Name'] for a, p in fake.account_parent.items()
+            if p == parent_id)
+
+
+def _scp_names(fake, target_id):
+    return sorted(fake.scp[p]['PolicySummary']['Name']
+            for p, targets in fake.scp_targets.items()
+            if target_id in targets and p != 'p-FullAWSAccess')
+
+
+def _ou_spec(fake, ou_id, name):
+    spec = dict(
+            Name=name,
+            Accounts=_account_names(fake, ou_id),
+            SC_Policies=_scp_names(fake, ou_id))
+    children = [_ou_spec(fake, child, fake.ou[child]['Name'])
+            for child in fake.children[ou_id]]
+    if children:
+        spec['Child_OU'] = children
+    return spec
+
+
+def _new_subtree(prefix, depth, fanout, level=1):
+    spec = dict(Name='%s-%d' % (prefix, level), SC_Policies=[], Accounts=[])
+    if level < depth:
+        spec['Child_OU'] = [_new_subtree('%s-%d' % (prefix, n), depth, fanout, level + 1)
+                for n in range(fanout)]
+    return spec
+
+
+def _walk(spec):
+    yield spec
+    for child in spec.get('Child_OU', []):
+        for s in _walk(child):
+            yield s
+
+
+def org_spec(fake, depth=1, new_ous=0):
+    """
+    Org spec matching the fake.  Adds a fresh subtree of 'new_ous'
+    organizational units, moves every seventh account into it and attaches
+    a custom policy to the new OUs.  The new OUs also list the default
+    policy, which Organizations attaches when creating them.
+    """
+    root = _ou_spec(fake, fake.root_id, 'root')
+    sc_policies = []
+    for policy in fake.scp.values():
+        summary = policy['PolicySummary']
+        if summary['Name'] == DEFAULT_POLICY:
+            continue
+        statement = json.loads(policy['Content'])['Statement'][0]
+        sc_policies.append(dict(
+                Name=summary['Name'],
+                Description=summary['Description'],
+                Effect=statement['Effect'],
+                Actions=statement['Action']))
+    if new_ous:
+        fanout = 1
+        while sum(fanout ** n for n in range(depth)) < new_ous and fanout < new_ous:
+            fanout += 1
+        subtree = _new_subtree('new-ou', depth, fanout)
+        new_specs = list(_walk(subtree))
+        moved = []
+        count = 0
+        for spec in _walk(root):
+            keep = []
+            for account in spec['Accounts']:
+                count += 1
+                if account != 'master' and count % 7 == 0:
+                    moved.append(account)
+                else:
+                    keep.append(account)
+            spec['Accounts'] = keep
+        for n, account in enumerate(moved):
+            new_specs[n % len(new_specs)]['Accounts'].append(account)
+        if sc_policies:
+            for spec in new_specs:
+                spec['SC_Policies'] = [DEFAULT_POLICY, sc_policies[0]['Name']]
+        root.setdefault('Child_OU', []).append(subtree)
+    return dict(
+            master_account_id=MASTER_ID,
+            default_policy=DEFAULT_POLICY,
+            default_ou='root',
+            organizational_units=[root],
+            sc_policies=sc_policies)
+
+
+def account_spec(fake, new_accounts=0):
+    """
+    Account spec listing every deployed account plus 'new_accounts'
+    accounts still to be created.
+    """
+    accounts = [dict(Name=a['Name'], Team='team') for a in fake.accounts.values()]
+    accounts += [dict(Name='new-account-%03d' % n, Team='team')
+            for n in range(new_accounts)]
+    return dict(
+            master_account_id=MASTER_ID,
+            default_domain='example.com',
+            teams=[dict(Name='team', BusinessContacts=[], TechnicalContacts=[])],
+            accounts=accounts)
+
+
+def auth_spec(fake, users=50, groups=10, delegations=5, absent_users=0):
+    """
+    Auth spec for the fake.  Deploys roughly half of the specified users,
+    groups and delegations into the fake first, so that a run both creates
+    and updates resources.  The last 'absent_users' users are deployed
+    with dependent resources and specified 'absent'.  Delegations are
+    trusted by deployed groups and write consolidated assume role
+    policies.
+    """
+    auth_id = sorted(a for a in fake.accounts if a != MASTER_ID)[0]
+    default_path = 'awsauth'
+    spec_users = []
+    for n in range(users):
+        name = 'user-%04d' % n
+        u_spec = dict(Name=name, Team='team', Email='%s@example.com' % name)
+        if n >= users - absent_users:
+            u_spec['Ensure'] = 'absent'
+            fake.add_user(auth_id, name, access_keys=2, mfa=1)
+        elif n % 2:
+            fake.add_user(auth_id, name, '/%s/' % default_path)
+        spec_users.append(u_spec)
+    live_users = [u['Name'] for u in spec_users if 'Ensure' not in u]
+
+    custom_policies = [dict(
+            PolicyName='custom-policy-%d' % n,
+            Description='custom policy %d' % n,
+            Statement=[dict(Effect='Allow', Action=['s3:Get*', 's3:List*'],
+                    Resource='*')])
+            for n in range(2)]
+
+    spec_groups = []
+    for n in range(groups):
+        name = 'group-%02d' % n
+        members = live_users[n::groups] if n else 'ALL'
+        g_spec = dict(Name=name, Members=members,
+                Policies=['ReadOnlyAccess', 'IAMUserChangePassword'])
+        if n % 2:
+            fake.add_group(auth_id, name, '/%s/' % default_path)
+            if members != 'ALL':
+                for user in members[::2]:
+                    if user in fake.iam[auth_id].users:
+                        fake.add_group_member(auth_id, name, user)
+            for absent in spec_users[users - absent_users:]:
+                fake.add_group_member(auth_id, name, absent['Name'])
+        spec_groups.append(g_spec)
+
+    account_names = sorted(a['Name'] for a in fake.accounts.values())
+    spec_delegations = []
+    for n in range(delegations):
+        trusting = 'ALL' if n % 2 == 0 else account_names[n::3]
+        spec_delegations.append(dict(
+                RoleName='delegation-%d' % n,
+                Description='delegation role %d' % n,
+                TrustingAccount=trusting,
+                TrustedGroup='group-%02d' % ((2 * n + 1) % groups) if groups else 'none',
+                RequireMFA=True,
+                Policies=['ReadOnlyAccess', 'custom-policy-%d' % (n % 2)]))
+        # deploy the role into every other account.  IAM hands back the
+        # trust policy with its own key order.
+        trust = dict(Version='2012-10-17', Statement=[dict(
+                Action='sts:AssumeRole',
+                Condition={'Bool': {'aws:MultiFactorAuthPresent': 'true'}},
+                Effect='Allow',
+                Principal=dict(AWS='arn:aws:iam::%s:root' % auth_id))])
+        for account_id in sorted(fake.accounts)[::2]:
+            fake._put_role(fake.iam[account_id], 'delegation-%d' % n,
+                    '/%s/' % default_path, 'delegation role %d' % n, trust,
+                    ['arn:aws:iam::aws:policy/ReadOnlyAccess'])
+    return dict(
+            master_account_id=MASTER_ID,
+            auth_account_id=auth_id,
+            org_access_role=ORG_ACCESS_ROLE,
+            default_path=default_path,
+            assume_role_group_policies='consolidated',
+            users=spec_users,
+            groups=spec_groups,
+            delegations=spec_delegations,
+            custom_policies=custom_policies)
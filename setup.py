@@ -26,8 +26,16 @@ setup(
         'Programming Language :: Python :: 2.7',
     ],
     keywords='aws organizations',
-    packages=find_packages(exclude=['scratch', 'notes']),
-    install_requires=['boto3', 'docopt', 'PyYAML'],
+    packages=find_packages(exclude=['scratch', 'notes', 'benchmarks']),
+    install_requires=[
+        'boto3>=1.12',
+        'docopt',
+        'PyYAML',
+        'futures; python_version < "3.0"',
+    ],
+    extras_require={
+        'credential-cache': ['cryptography'],
+    },
     package_data={
         'awsorgs': [
             'samples/*.yaml',